@@ -0,0 +1,46 @@
+from django.db.models import BooleanField, Exists, OuterRef, Value
+
+from .models import Note, Membership
+
+
+def get_note_id(view):
+    note_id = view.kwargs.get("note_id")
+    if note_id is None:
+        note_id = view.kwargs.get("pk")
+    return note_id
+
+
+def get_note(request, note_id):
+    """
+    Return the note with its author, university and group, and whether the
+    user is a member of its group, loaded in one query. The result (or None
+    if the note does not exist) is kept on the request, so permission
+    classes, views and serializers handling it share a single lookup.
+    """
+    try:
+        note_id = int(note_id)
+    except (TypeError, ValueError):
+        return None
+    notes = getattr(request, "_notehub_notes", None)
+    if notes is None:
+        notes = request._notehub_notes = {}
+    if note_id not in notes:
+        notes[note_id] = get_note_queryset(request.user).filter(pk=note_id).first()
+    return notes[note_id]
+
+
+def get_note_queryset(user):
+    notes = Note.objects.select_related("author", "university", "group")
+    if user.is_anonymous:
+        return notes.annotate(is_member=Value(False, output_field=BooleanField()))
+    memberships = Membership.objects.filter(user=user, group=OuterRef("group"))
+    return notes.annotate(is_member=Exists(memberships))
+
+
+def can_read_note(user, note):
+    if note is None:
+        return False
+    if note.author_id == user.id or note.group_id is None:
+        return True
+    return note.is_member
+
@@ -8,6 +8,7 @@ from .models import (
     NoteReport,
     CommentReport,
     Subscription,
+    UserStats,
 )
 # Register your models here.
 
@@ -19,3 +20,4 @@ admin.site.register(Group)
 admin.site.register(NoteReport)
 admin.site.register(CommentReport)
 admin.site.register(Subscription)
+admin.site.register(UserStats)
@@ -0,0 +1,327 @@
+import asyncio
+import collections
+import contextvars
+import os
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.exception import response_for_exception
+from django.db import close_old_connections
+from django.urls import Resolver404, resolve
+from django.utils.module_loading import import_string
+
+from .downloads import serve_note_file
+from .metrics import finish_request, start_request
+from .serializers import get_rated_notes
+from .views import NoteDetailView, NoteFileContentView, NoteView, SearchView
+
+# Middleware that redirects or adds headers without touching the database;
+# natively served requests go through it too.
+NATIVE_MIDDLEWARE = (
+    "django.middleware.security.SecurityMiddleware",
+    "django.middleware.common.CommonMiddleware",
+    "django.middleware.clickjacking.XFrameOptionsMiddleware",
+)
+# Middleware the native path skips, because it has nothing to do for a GET
+# without a session cookie that is not for the browsable API: there is no
+# session to load or user to log in, CSRF checks only unsafe methods, and
+# messages are only shown in templates.
+BYPASSED_MIDDLEWARE = (
+    "django.contrib.sessions.middleware.SessionMiddleware",
+    "django.middleware.csrf.CsrfViewMiddleware",
+    "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "django.contrib.messages.middleware.MessageMiddleware",
+)
+METRICS_MIDDLEWARE = "api.metrics.MetricsMiddleware"
+# Threads, and so database connections, for native requests per process.
+THREADS = getattr(settings, "NOTEHUB_ASGI_THREADS", min(32, (os.cpu_count() or 1) + 4))
+
+
+class ThreadPool:
+    """
+    At most `size` single-thread executors shared by native requests. Each
+    thread keeps its database connection between requests, as long as
+    CONN_MAX_AGE allows.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.created = 0
+        self.idle = []
+        self.waiters = collections.deque()
+
+    def acquire_nowait(self):
+        if self.idle:
+            return self.idle.pop()
+        if self.created < self.size:
+            self.created += 1
+            return ThreadPoolExecutor(1, thread_name_prefix="notehub-asgi")
+        return None
+
+    async def acquire(self):
+        executor = self.acquire_nowait()
+        if executor is not None:
+            return executor
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(waiter.result())
+            raise
+
+    def release(self, executor):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(executor)
+                return
+        self.idle.append(executor)
+
+
+class RequestThreads:
+    """
+    Threads of `pool` that run the database work of one native request.
+    Lookups that run at the same time get a thread each while the pool has
+    one to spare, and otherwise queue behind the request's other lookups, so
+    a request never waits on the pool for more than its first thread. When
+    the request ends, the connections are closed if they are broken or past
+    CONN_MAX_AGE, as Django does for a synchronous request, and the threads
+    go back to the pool.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        # Executor -> number of calls running or queued on it.
+        self.calls = {}
+        self.first = asyncio.Lock()
+
+    async def get_executor(self):
+        if not self.calls:
+            # Concurrent first lookups wait for a single thread.
+            async with self.first:
+                if not self.calls:
+                    self.calls[await self.pool.acquire()] = 0
+        executor = min(self.calls, key=self.calls.get)
+        if self.calls[executor] == 0:
+            return executor
+        spare = self.pool.acquire_nowait()
+        if spare is None:
+            return executor
+        self.calls[spare] = 0
+        return spare
+
+    async def run(self, func, *args, **kwargs):
+        executor = await self.get_executor()
+        self.calls[executor] += 1
+        # Run in a copy of this context, so the request's metrics are kept.
+        call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, call)
+        finally:
+            self.calls[executor] -= 1
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(
+                loop.run_in_executor(executor, close_old_connections)
+                for executor in self.calls
+            )
+        )
+        for executor in self.calls:
+            self.pool.release(executor)
+
+
+async def gather(*awaitables):
+    """
+    Await `awaitables` concurrently. If any fail, the first in argument order
+    is raised, so a failed permission check is reported ahead of a lookup
+    that ran beside it.
+    """
+    results = await asyncio.gather(*awaitables, return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    return results
+
+
+def get_response_headers(response):
+    headers = []
+    for header, value in response.items():
+        if isinstance(header, str):
+            header = header.encode("ascii")
+        if isinstance(value, str):
+            value = value.encode("latin1")
+        headers.append((bytes(header), bytes(value)))
+    for cookie in response.cookies.values():
+        headers.append(
+            (b"Set-Cookie", cookie.output(header="").encode("ascii").strip())
+        )
+    return headers
+
+
+def check_access(view, request):
+    view.perform_authentication(request)
+    view.check_permissions(request)
+    view.check_throttles(request)
+
+
+class NoteHubASGIHandler(ASGIHandler):
+    """
+    ASGI handler that serves note listing, note detail, search and file
+    downloads natively, and every other request through Django as usual.
+
+    Django 3.0 views are synchronous, so a native request runs the stages of
+    DRF's dispatch itself: database work runs in the thread pool, lookups
+    that do not depend on each other run concurrently, and response bodies
+    are streamed with every block read off the event loop. Requests with a
+    session cookie, or for the browsable API, need Django's middleware and
+    take the regular path, as does every request if MIDDLEWARE holds any
+    middleware not listed in NATIVE_MIDDLEWARE or BYPASSED_MIDDLEWARE.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.native_views = {
+            NoteView: self.serve_in_thread,
+            SearchView: self.serve_in_thread,
+            NoteDetailView: self.retrieve_note,
+            NoteFileContentView: self.download_note_file,
+        }
+        known = NATIVE_MIDDLEWARE + BYPASSED_MIDDLEWARE + (METRICS_MIDDLEWARE,)
+        if not set(settings.MIDDLEWARE).issubset(known):
+            self.native_views = {}
+        self.native_middleware = [
+            import_string(path)()
+            for path in settings.MIDDLEWARE
+            if path in NATIVE_MIDDLEWARE
+        ]
+        self.record_metrics = METRICS_MIDDLEWARE in settings.MIDDLEWARE
+        self.threads = ThreadPool(THREADS)
+
+    def get_native_view(self, request):
+        if request.method != "GET":
+            return None
+        if settings.SESSION_COOKIE_NAME in request.COOKIES:
+            return None
+        if "text/html" in request.META.get("HTTP_ACCEPT", ""):
+            return None
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        view_class = getattr(match.func, "view_class", None)
+        if view_class not in self.native_views:
+            return None
+        request.resolver_match = match
+        view = view_class(**match.func.view_initkwargs)
+        view.args = match.args
+        view.kwargs = match.kwargs
+        view.request = view.initialize_request(request, *match.args, **match.kwargs)
+        view.headers = view.default_response_headers
+        return view
+
+    async def get_response(self, request):
+        # ASGIHandler awaits get_response instead of running it in a thread
+        # when it is a coroutine function.
+        view = self.get_native_view(request)
+        if view is None:
+            get_response = sync_to_async(super().get_response, thread_sensitive=False)
+            return await get_response(request)
+        if self.record_metrics:
+            metrics, token = start_request()
+        threads = RequestThreads(self.threads)
+        try:
+            response = self.process_request(request)
+            if response is None:
+                response = await self.dispatch(view, threads)
+        except Exception as exc:
+            response = response_for_exception(request, exc)
+        finally:
+            await threads.close()
+        for middleware in reversed(self.native_middleware):
+            response = middleware.process_response(request, response)
+        if self.record_metrics:
+            finish_request(request, response, metrics, token)
+        return response
+
+    def process_request(self, request):
+        for middleware in self.native_middleware:
+            if hasattr(middleware, "process_request"):
+                response = middleware.process_request(request)
+                if response is not None:
+                    return response
+        return None
+
+    async def dispatch(self, view, threads):
+        request = view.request
+        try:
+            view.format_kwarg = view.get_format_suffix(**view.kwargs)
+            negotiated = view.perform_content_negotiation(request)
+            request.accepted_renderer, request.accepted_media_type = negotiated
+            version, scheme = view.determine_version(request, **view.kwargs)
+            request.version, request.versioning_scheme = version, scheme
+            handler = self.native_views[type(view)]
+            response = await handler(view, request, threads)
+        except Exception as exc:
+            response = view.handle_exception(exc)
+        response = view.finalize_response(request, response)
+        if hasattr(response, "render"):
+            response.render()
+        return response
+
+    async def serve_in_thread(self, view, request, threads):
+        def serve():
+            check_access(view, request)
+            return view.get(request, *view.args, **view.kwargs)
+
+        return await threads.run(serve)
+
+    async def retrieve_note(self, view, request, threads):
+        await threads.run(view.perform_authentication, request)
+        # The permission check loads the note; the user's rating of it does
+        # not depend on that lookup.
+        _, view.rated_notes = await gather(
+            threads.run(check_access, view, request),
+            threads.run(get_rated_notes, request.user, [view.kwargs["pk"]]),
+        )
+        return await threads.run(view.get, request, **view.kwargs)
+
+    async def download_note_file(self, view, request, threads):
+        await threads.run(view.perform_authentication, request)
+        _, note_file = await gather(
+            threads.run(check_access, view, request),
+            threads.run(view.get_note_file),
+        )
+        return await threads.run(serve_note_file, request, note_file, view.field)
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            await super().send_response(response, send)
+            return
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": get_response_headers(response),
+            }
+        )
+        # Blocks are read in the thread pool, so slow storage does not stall
+        # every other request on the event loop.
+        read = sync_to_async(next, thread_sensitive=False)
+        parts = iter(response)
+        while True:
+            part = await read(parts, None)
+            if part is None:
+                break
+            for chunk, _ in self.chunk_bytes(part):
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+        await send({"type": "http.response.body"})
+        response.close()
@@ -0,0 +1,154 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .localcache import LocalCache
+
+User = get_user_model()
+
+TOKEN_CACHE_KEY = "token:{0}"
+USER_CACHE_KEY = "user:{0}"
+CACHE_TTL = getattr(settings, "NOTEHUB_TOKEN_CACHE_TTL", 60)
+# Only what authentication checks is cached; other fields of request.user are
+# loaded from the database when first accessed.
+USER_FIELDS = [User._meta.pk.attname, "is_active", "token_generation"]
+
+ACCESS_TOKEN_SALT = "api.authentication.access"
+REFRESH_TOKEN_SALT = "api.authentication.refresh"
+ACCESS_TOKEN_TTL = getattr(settings, "NOTEHUB_ACCESS_TOKEN_TTL", 15 * 60)
+REFRESH_TOKEN_TTL = getattr(settings, "NOTEHUB_REFRESH_TOKEN_TTL", 30 * 24 * 3600)
+
+# Token digest or user id key -> the column values of a user.
+local_cache = LocalCache(
+    getattr(settings, "NOTEHUB_TOKEN_CACHE_SIZE", 10000), CACHE_TTL
+)
+
+
+def get_shared_cache():
+    # Optionally share entries between workers through one of Django's caches,
+    # e.g. NOTEHUB_TOKEN_CACHE = "default" with a Redis or memcached backend.
+    alias = getattr(settings, "NOTEHUB_TOKEN_CACHE", None)
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def hash_token(key):
+    # Caches never see usable credentials.
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def get_cached_user(cache_key, users):
+    """
+    Return the user in the `users` queryset, loaded through the caches under
+    `cache_key`, or None. The user is a snapshot with every field but
+    USER_FIELDS deferred, and may be up to CACHE_TTL seconds old, so it must
+    never be saved: views that change a user load and save a fresh row.
+    """
+    values = local_cache.get(cache_key)
+    if values is None:
+        shared = get_shared_cache()
+        values = shared.get(cache_key) if shared is not None else None
+        if values is None:
+            values = users.values_list(*USER_FIELDS).first()
+            if values is None:
+                return None
+            if shared is not None:
+                shared.set(cache_key, values, CACHE_TTL)
+        local_cache.set(cache_key, values, time.time() + CACHE_TTL)
+    return User.from_db(DEFAULT_DB_ALIAS, USER_FIELDS, values)
+
+
+def get_token_user(key):
+    cache_key = TOKEN_CACHE_KEY.format(hash_token(key))
+    return get_cached_user(cache_key, User.objects.filter(auth_token__key=key))
+
+
+def invalidate(cache_key):
+    local_cache.delete(cache_key)
+    shared = get_shared_cache()
+    if shared is not None:
+        shared.delete(cache_key)
+
+
+def invalidate_token(key):
+    invalidate(TOKEN_CACHE_KEY.format(hash_token(key)))
+
+
+def invalidate_user(user_id):
+    invalidate(USER_CACHE_KEY.format(user_id))
+    for key in Token.objects.filter(user=user_id).values_list("key", flat=True):
+        invalidate_token(key)
+
+
+def make_signed_token(user, salt):
+    return signing.dumps([user.pk, user.token_generation], salt=salt)
+
+
+def issue_signed_tokens(user):
+    return {
+        "access": make_signed_token(user, ACCESS_TOKEN_SALT),
+        "refresh": make_signed_token(user, REFRESH_TOKEN_SALT),
+        "expires_in": ACCESS_TOKEN_TTL,
+    }
+
+
+def get_signed_token_user(token, salt, max_age):
+    """
+    Return the active user a signed token was issued to, or None if the
+    token is invalid, expired, or from before the user's tokens were revoked
+    by bumping their token_generation.
+    """
+    try:
+        user_id, generation = signing.loads(token, salt=salt, max_age=max_age)
+        user_id = int(user_id)
+    except (signing.BadSignature, TypeError, ValueError):
+        return None
+    user = get_cached_user(
+        USER_CACHE_KEY.format(user_id), User.objects.filter(pk=user_id)
+    )
+    if user is None or user.token_generation != generation or not user.is_active:
+        return None
+    return user
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication that keeps the user of recently seen tokens in a
+    per-process LRU, and optionally a shared cache, for NOTEHUB_TOKEN_CACHE_TTL
+    seconds. Entries are dropped when the token is deleted or its user saved.
+    """
+
+    def authenticate_credentials(self, key):
+        user = get_token_user(key)
+        if user is None:
+            raise exceptions.AuthenticationFailed(_("Invalid token."))
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_("User inactive or deleted."))
+        return user, Token(key=key, user=user)
+
+
+class SignedTokenAuthentication(TokenAuthentication):
+    """
+    Authentication with "Authorization: Bearer <access token>", where the
+    token is signed with SECRET_KEY and expires after NOTEHUB_ACCESS_TOKEN_TTL
+    seconds. Verifying one needs no token table; the user comes from the same
+    caches as for CachedTokenAuthentication.
+    """
+
+    keyword = "Bearer"
+
+    def authenticate_credentials(self, key):
+        user = get_signed_token_user(key, ACCESS_TOKEN_SALT, ACCESS_TOKEN_TTL)
+        if user is None:
+            raise exceptions.AuthenticationFailed(_("Invalid or expired token."))
+        return user, key
@@ -0,0 +1,181 @@
+import bisect
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import University
+
+VERSION_CACHE_KEY = "university_index_version"
+VERSION_CHECK_INTERVAL = 5
+MAX_WORD_SCAN = 2000
+MIN_SIMILARITY = 0.3
+COMMON_TRIGRAM_SHARE = 0.05
+COMMON_TRIGRAM_MIN = 100
+
+
+def normalize(text):
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+
+def trigrams(text):
+    padded = "  " + text + " "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class UniversityIndex:
+    """
+    In-memory autocomplete index over university names.
+
+    Names are matched by prefix of the whole name first, then by prefix of
+    each word, both through bisection of sorted lists. If neither matches,
+    names are ranked by trigram similarity so queries with typos still find
+    something.
+    """
+
+    def __init__(self, universities):
+        self.names = {}
+        self.keys = {}
+        self.prefixes = []
+        self.words = []
+        self.trigram_counts = {}
+        self.postings = defaultdict(list)
+        for pk, name in universities:
+            key = normalize(name)
+            self.names[pk] = name
+            self.keys[pk] = key
+            self.prefixes.append((key, pk))
+            for word in set(key.split()):
+                self.words.append((word, pk))
+            grams = trigrams(key)
+            self.trigram_counts[pk] = len(grams)
+            for gram in grams:
+                self.postings[gram].append(pk)
+        self.prefixes.sort()
+        self.words.sort()
+
+    def scan(self, entries, prefix, limit=None):
+        start = bisect.bisect_left(entries, (prefix,))
+        end = len(entries) if limit is None else min(start + limit, len(entries))
+        for i in range(start, end):
+            key, pk = entries[i]
+            if not key.startswith(prefix):
+                return
+            yield pk
+
+    def complete(self, query, limit):
+        query = normalize(query)
+        if not query:
+            return []
+        found = []
+        seen = set()
+
+        def add(pks):
+            for pk in pks:
+                if len(found) == limit:
+                    return
+                if pk not in seen:
+                    seen.add(pk)
+                    found.append(pk)
+
+        add(self.scan(self.prefixes, query))
+        terms = query.split()
+        if len(found) < limit:
+            longest = max(terms, key=len)
+            candidates = self.scan(self.words, longest, MAX_WORD_SCAN)
+            candidates = sorted(candidates, key=self.keys.get)
+            add(pk for pk in candidates if self.matches(pk, terms))
+        if not found and len(query) >= 3:
+            add(self.similar(query, limit))
+        return [{"id": pk, "name": self.names[pk]} for pk in found]
+
+    def matches(self, pk, terms):
+        words = self.keys[pk].split()
+        return all(any(word.startswith(term) for word in words) for term in terms)
+
+    def similar(self, query, limit):
+        # Rank by the share of the query's trigrams found in the name, then by
+        # overall similarity so shorter names win ties. Trigrams found in many
+        # names ("uni", "col") are left out when rarer ones exist, which keeps
+        # the posting lists to merge short.
+        grams = trigrams(query)
+        common = max(COMMON_TRIGRAM_SHARE * len(self.names), COMMON_TRIGRAM_MIN)
+        rare = [gram for gram in grams if len(self.postings.get(gram, ())) <= common]
+        counted = rare or grams
+        shared = Counter()
+        for gram in counted:
+            shared.update(self.postings.get(gram, ()))
+        scores = (
+            (
+                count / len(counted),
+                count / (len(grams) + self.trigram_counts[pk] - count),
+                pk,
+            )
+            for pk, count in shared.items()
+            if count / len(counted) >= MIN_SIMILARITY
+        )
+        return [pk for coverage, similarity, pk in heapq.nlargest(limit, scores)]
+
+
+_index = None
+_index_version = None
+_index_built_at = 0
+_index_checked_at = 0
+_lock = threading.Lock()
+
+
+def get_shared_cache():
+    # Workers learn of changes made by others through a version kept in one
+    # of Django's caches that they share, e.g. NOTEHUB_AUTOCOMPLETE_CACHE =
+    # "default" with a Redis or memcached backend. Without one, each worker
+    # rebuilds its index every NOTEHUB_AUTOCOMPLETE_REBUILD_INTERVAL seconds.
+    alias = getattr(settings, "NOTEHUB_AUTOCOMPLETE_CACHE", None)
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def get_university_index():
+    """
+    Return this process's index, rebuilding it if universities have changed
+    since it was loaded: at once for changes made by this process, and within
+    a few seconds (or the rebuild interval, without a shared cache) for
+    changes made by others.
+    """
+    global _index, _index_version, _index_built_at, _index_checked_at
+    now = time.monotonic()
+    if _index is not None and now - _index_checked_at < VERSION_CHECK_INTERVAL:
+        return _index
+    with _lock:
+        shared = get_shared_cache()
+        if shared is not None:
+            version = shared.get(VERSION_CACHE_KEY, 0)
+            stale = version != _index_version
+        else:
+            version = None
+            interval = getattr(settings, "NOTEHUB_AUTOCOMPLETE_REBUILD_INTERVAL", 300)
+            stale = now - _index_built_at >= interval
+        if _index is None or stale:
+            _index = UniversityIndex(University.objects.values_list("id", "name"))
+            _index_version = version
+            _index_built_at = now
+        _index_checked_at = now
+        return _index
+
+
+def invalidate_university_index():
+    global _index
+    shared = get_shared_cache()
+    if shared is not None:
+        try:
+            shared.incr(VERSION_CACHE_KEY)
+        except ValueError:
+            shared.set(VERSION_CACHE_KEY, 1, None)
+    _index = None
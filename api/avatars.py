@@ -0,0 +1,105 @@
+import re
+import uuid
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from PIL import Image, ImageOps
+from users.models import user_avatar_path
+
+AVATAR_SIZES = (32, 64, 256)
+AVATAR_QUALITY = getattr(settings, "NOTEHUB_AVATAR_QUALITY", 80)
+# Larger sources are rejected rather than decoded.
+MAX_AVATAR_PIXELS = 40 * 1000 * 1000
+AVATAR_NAME_RE = re.compile(r"^(?P<base>.+)-{0}\.webp$".format(max(AVATAR_SIZES)))
+
+
+class AvatarError(Exception):
+    pass
+
+
+def get_avatar_name(base, size):
+    return "{0}-{1}.webp".format(base, size)
+
+
+def render_avatars(file):
+    """
+    Decode an uploaded image and return {size: webp bytes} of square crops at
+    every avatar size. Re-encoding drops EXIF and any other metadata.
+    """
+    try:
+        image = Image.open(file)
+        if image.width * image.height > MAX_AVATAR_PIXELS:
+            raise AvatarError("Image is too large.")
+        largest = max(AVATAR_SIZES)
+        image.draft("RGB", (largest, largest))
+        image.load()
+    except (OSError, SyntaxError, Image.DecompressionBombError):
+        raise AvatarError("Upload a valid image.")
+    image = ImageOps.exif_transpose(image)
+    has_alpha = image.mode in ("RGBA", "LA") or "transparency" in image.info
+    image = image.convert("RGBA" if has_alpha else "RGB")
+
+    avatars = {}
+    # Each size is scaled down from the previous, larger one.
+    for size in sorted(AVATAR_SIZES, reverse=True):
+        image = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        buffer = BytesIO()
+        image.save(buffer, "WEBP", quality=AVATAR_QUALITY, method=6)
+        avatars[size] = buffer.getvalue()
+    return avatars
+
+
+def set_avatar(user, file):
+    """
+    Store the avatars rendered from `file` (or none when it is empty) and
+    point `user.avatar` at the largest. Replaced files are removed once the
+    transaction commits.
+    """
+    old_names = get_avatar_names(user.avatar)
+    storage = user.avatar.storage
+    if file:
+        avatars = render_avatars(file)
+        base = user_avatar_path(user, "avatars/" + uuid.uuid4().hex[:12])
+        for size, content in avatars.items():
+            storage.save(get_avatar_name(base, size), ContentFile(content))
+        user.avatar.name = get_avatar_name(base, max(AVATAR_SIZES))
+    else:
+        user.avatar.name = ""
+    user.save(update_fields=["avatar"])
+
+    def remove_old():
+        for name in old_names:
+            storage.delete(name)
+
+    transaction.on_commit(remove_old)
+
+
+def get_avatar_names(avatar):
+    if not avatar:
+        return []
+    match = AVATAR_NAME_RE.match(avatar.name)
+    if match is None:
+        return [avatar.name]
+    return [get_avatar_name(match.group("base"), size) for size in AVATAR_SIZES]
+
+
+def get_avatar_urls(avatar):
+    """
+    Return {size: url} for a user's avatar. Avatars uploaded before they were
+    resized, until backfilled, use the original image for every size.
+    """
+    if not avatar:
+        return None
+    match = AVATAR_NAME_RE.match(avatar.name)
+    if match is None:
+        return {str(size): avatar.url for size in AVATAR_SIZES}
+    return {
+        str(size): avatar.storage.url(get_avatar_name(match.group("base"), size))
+        for size in AVATAR_SIZES
+    }
+
+
+def is_normalized(avatar):
+    return AVATAR_NAME_RE.match(avatar.name) is not None
@@ -0,0 +1,620 @@
+"""
+Query-count benchmarks of every API route.
+
+`seed` fills the database with realistic fixtures and `run_benchmarks`
+requests each route in ENDPOINTS against them, recording SQL queries, wall
+time and payload size. `check_results` compares a run with the stored
+baseline: an endpoint fails if it runs more queries than its baseline, or if
+a paginated list runs more queries for a large page than for a small one.
+"""
+import contextlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from io import BytesIO, StringIO
+from urllib.parse import quote
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from . import urls
+from .authentication import issue_signed_tokens
+from .authentication import local_cache as token_cache
+from .models import (
+    Comment,
+    CommentReport,
+    Favorite,
+    Group,
+    Invitation,
+    Membership,
+    Note,
+    NoteFile,
+    NoteReport,
+    Rating,
+    University,
+    UploadSession,
+    rebuild_user_stats,
+    update_rating_totals,
+)
+from .premium import local_cache as premium_cache
+from .previews import process_pending
+from .search import get_search_backend
+from .throttling import DEFAULT_RATES
+from .throttling import local_buckets as throttle_buckets
+from .uploads import create_upload_file, get_upload_path
+
+User = get_user_model()
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "benchmark_baseline.json")
+PASSWORD = "benchmark-password"
+USERS = ("author", "reader", "moderator", "invitee", "writer", "changer", "subscriber")
+SUBJECTS = (
+    ("Calculus", "MATH 251"),
+    ("Organic Chemistry", "CH 331"),
+    ("Linear Algebra", "MATH 341"),
+    ("Microeconomics", "ECON 201"),
+    ("World History", "HST 101"),
+)
+RATINGS_PER_NOTE = 3
+RELATIONSHIP_NOTES = 20
+UPLOAD_BODY = b"%PDF-" + bytes(range(256)) * 4
+ROUTE_PARAMETER_RE = re.compile(r"<(?:\w+:)?(\w+)>")
+
+
+def png(size=(64, 64)):
+    buffer = BytesIO()
+    Image.new("RGB", size, "white").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def seed(notes=2000, rows=60, universities_path=None):
+    """
+    Create the fixtures the benchmarks run against and return the ids they
+    refer to. `rows` sizes every paginated list other than notes and must be
+    larger than the largest page benchmarked. Universities are imported from
+    `universities_path` if given, otherwise `rows` are made up.
+    """
+    password = make_password(PASSWORD)
+    User.objects.bulk_create(
+        User(username=name, email=name + "@example.com", password=password)
+        for name in USERS + tuple("member{0}".format(i) for i in range(rows))
+    )
+    users = {user.username: user for user in User.objects.all()}
+    members = [users["member{0}".format(i)] for i in range(rows)]
+
+    if universities_path is not None:
+        call_command("import_universities", universities_path, stdout=StringIO())
+    else:
+        University.objects.bulk_create(
+            University(name="{0} State University".format(name))
+            for name in ("Benchmark {0}".format(i) for i in range(rows))
+        )
+    university_ids = list(
+        University.objects.order_by("pk").values_list("pk", flat=True)[:rows]
+    )
+    university = (
+        University.objects.exclude(name__contains="/").order_by("pk").first().name
+    )
+
+    def make_note(index, author, group=None):
+        title, course = SUBJECTS[index % len(SUBJECTS)]
+        return Note(
+            author=author,
+            title="{0} {1}".format(title, index),
+            course=course,
+            university_id=university_ids[index % len(university_ids)],
+            group=group,
+        )
+
+    Note.objects.bulk_create(
+        make_note(i, users["author"] if i % 2 == 0 else members[i % rows])
+        for i in range(notes)
+    )
+    public_notes = list(Note.objects.order_by("pk").values_list("pk", flat=True))
+    note = public_notes[0]
+
+    Rating.objects.bulk_create(
+        Rating(
+            author=members[(i + offset) % rows],
+            note_id=pk,
+            score=(i + offset) % 5 + 1,
+        )
+        for i, pk in enumerate(public_notes)
+        for offset in range(RATINGS_PER_NOTE)
+    )
+    Comment.objects.bulk_create(
+        Comment(author=members[i % rows], note_id=pk, text="Thanks for sharing.")
+        for i, pk in enumerate(public_notes)
+    )
+    Comment.objects.bulk_create(
+        Comment(author=member, note_id=note, text="Very helpful.")
+        for member in members
+    )
+    rating = Rating.objects.create(author=users["reader"], note_id=note, score=5)
+    comment = Comment.objects.filter(note=note).order_by("pk").first()
+
+    group = Group.objects.create(name="Study group", moderator=users["moderator"])
+    Membership.objects.bulk_create(
+        Membership(group=group, user=user)
+        for user in [users["moderator"], users["reader"]] + members
+    )
+    Note.objects.bulk_create(
+        make_note(i, users["moderator"], group) for i in range(rows)
+    )
+    Group.objects.bulk_create(
+        Group(name="Group {0}".format(i), moderator=users["moderator"])
+        for i in range(rows)
+    )
+    other_groups = Group.objects.exclude(pk=group.pk)
+    Membership.objects.bulk_create(
+        Membership(group=other, user=user)
+        for other in other_groups
+        for user in (users["moderator"], users["reader"])
+    )
+    Invitation.objects.bulk_create(
+        Invitation(group=other, user=users["invitee"]) for other in other_groups
+    )
+    invitation = Invitation.objects.create(group=group, user=users["invitee"])
+    membership = Membership.objects.get(group=group, user=users["reader"])
+
+    favorited = public_notes[:rows]
+    Favorite.objects.bulk_create(
+        Favorite(user=users["reader"], note_id=pk) for pk in favorited
+    )
+    Note.objects.filter(pk__in=favorited).update(favorite_count=1)
+    favorite = Favorite.objects.get(user=users["reader"], note=note)
+    NoteReport.objects.create(user=users["reader"], note_id=note)
+    CommentReport.objects.create(user=users["reader"], comment=comment)
+
+    for index in range(3):
+        NoteFile.objects.create(
+            note_id=note,
+            index=index,
+            file=SimpleUploadedFile("page{0}.png".format(index), png()),
+        )
+    process_pending()
+    sessions = {}
+    for name, index in (("partial_upload", 10), ("complete_upload", 11)):
+        session = UploadSession.objects.create(
+            note_id=note,
+            user=users["author"],
+            index=index,
+            filename="notes.pdf",
+            size=len(UPLOAD_BODY),
+        )
+        create_upload_file(session)
+        sessions[name] = session.pk
+    UploadSession.objects.filter(pk=sessions["complete_upload"]).update(
+        received_bytes=len(UPLOAD_BODY)
+    )
+
+    update_rating_totals(Note.objects.all())
+    rebuild_user_stats(User.objects.all())
+    backend = get_search_backend()
+    backend.index_notes(Note.objects.all())
+    if universities_path is None:
+        backend.index_universities(University.objects.all())
+
+    fixtures = {name: user.pk for name, user in users.items() if name in USERS}
+    fixtures.update(sessions, first_file=0)
+    fixtures.update(
+        note=note,
+        notes=",".join(str(pk) for pk in public_notes[:RELATIONSHIP_NOTES]),
+        rating=rating.pk,
+        comment=comment.pk,
+        favorite=favorite.pk,
+        group=group.pk,
+        membership=membership.pk,
+        invitation=invitation.pk,
+        university=university,
+        university_id=university_ids[0],
+        refresh=issue_signed_tokens(users["reader"])["refresh"],
+    )
+    return fixtures
+
+
+def write_complete_upload(fixtures):
+    # Finalizing moves the file away, and rolling back does not restore it.
+    session = UploadSession.objects.get(pk=fixtures["complete_upload"])
+    with open(get_upload_path(session), "wb") as file:
+        file.write(UPLOAD_BODY)
+
+
+class Endpoint:
+    """
+    One request to benchmark. `args` maps the route's parameters to fixture
+    names; string values in `query` and `data` are formatted with the
+    fixtures, and `data` may also be a function of them. Paginated lists are
+    requested with each page size.
+    """
+
+    def __init__(
+        self,
+        method,
+        route,
+        user=None,
+        args=None,
+        query=None,
+        data=None,
+        status=200,
+        paginated=False,
+        label=None,
+        prepare=None,
+        **extra
+    ):
+        self.method = method
+        self.route = route
+        self.user = user
+        self.args = args or {}
+        self.query = query or {}
+        self.data = data
+        self.status = status
+        self.paginated = paginated
+        self.prepare = prepare
+        self.extra = extra
+        self.name = "{0} /api/{1}".format(method.upper(), route)
+        if label is not None:
+            self.name += " ({0})".format(label)
+
+    def get_path(self, fixtures):
+        def replace(match):
+            return quote(str(fixtures[self.args[match.group(1)]]))
+
+        return "/api/" + ROUTE_PARAMETER_RE.sub(replace, self.route)
+
+    def get_data(self, fixtures, page_size):
+        if callable(self.data):
+            return self.data(fixtures)
+        values = dict(self.query if self.method == "get" else self.data or {})
+        if self.paginated:
+            values["page_size"] = page_size
+        return {
+            key: value.format(**fixtures) if isinstance(value, str) else value
+            for key, value in values.items()
+        }
+
+
+NOTE = {"note_id": "note"}
+GROUP = {"group_id": "group"}
+CREDENTIALS = {"username": "reader", "password": PASSWORD}
+
+ENDPOINTS = [
+    Endpoint("post", "login/", data=CREDENTIALS),
+    Endpoint("post", "token/", data=CREDENTIALS),
+    Endpoint("post", "token/refresh/", data={"refresh": "{refresh}"}),
+    Endpoint("get", "user/", "reader"),
+    Endpoint("get", "user/notes/", "author", paginated=True),
+    Endpoint("get", "user/groups/", "reader", paginated=True),
+    Endpoint("get", "user/invitations/", "invitee", paginated=True),
+    Endpoint("get", "user/favorites/", "reader", paginated=True),
+    Endpoint("get", "user/relationships/", "reader", query={"notes": "{notes}"}),
+    Endpoint(
+        "put",
+        "user/update_password/",
+        "changer",
+        data={"old_password": PASSWORD, "new_password": PASSWORD + "-2"},
+    ),
+    Endpoint(
+        "put",
+        "user/upload_avatar/",
+        "writer",
+        data=lambda fixtures: {"new_avatar": SimpleUploadedFile("a.png", png())},
+        format="multipart",
+    ),
+    Endpoint("post", "user/add_subscription/", "subscriber", status=201),
+    Endpoint("get", "users/", "reader", paginated=True),
+    Endpoint("get", "notes/", "reader", paginated=True),
+    Endpoint(
+        "post",
+        "notes/",
+        "writer",
+        data={
+            "title": "New notes",
+            "course": "CS 161",
+            "university": "{university_id}",
+        },
+        status=201,
+    ),
+    Endpoint("get", "notes/<int:pk>/", "reader", args={"pk": "note"}),
+    Endpoint("get", "notes/<int:note_id>/files/", "reader", args=NOTE),
+    Endpoint(
+        "get",
+        "notes/<int:note_id>/files/<int:index>/",
+        "reader",
+        args=dict(NOTE, index="first_file"),
+    ),
+    Endpoint(
+        "get",
+        "notes/<int:note_id>/files/<int:index>/content/",
+        "reader",
+        args=dict(NOTE, index="first_file"),
+    ),
+    Endpoint(
+        "get",
+        "notes/<int:note_id>/files/<int:index>/thumbnail/",
+        "reader",
+        args=dict(NOTE, index="first_file"),
+    ),
+    Endpoint(
+        "get",
+        "notes/<int:note_id>/files/<int:index>/preview/",
+        "reader",
+        args=dict(NOTE, index="first_file"),
+    ),
+    Endpoint(
+        "post",
+        "notes/<int:note_id>/uploads/",
+        "author",
+        args=NOTE,
+        data={"index": 20, "filename": "notes.pdf", "size": len(UPLOAD_BODY)},
+        status=201,
+    ),
+    Endpoint(
+        "put",
+        "notes/<int:note_id>/uploads/<uuid:pk>/",
+        "author",
+        args=dict(NOTE, pk="partial_upload"),
+        data=lambda fixtures: UPLOAD_BODY,
+        content_type="application/octet-stream",
+        HTTP_CONTENT_RANGE="bytes 0-{0}/{1}".format(
+            len(UPLOAD_BODY) - 1, len(UPLOAD_BODY)
+        ),
+    ),
+    Endpoint(
+        "post",
+        "notes/<int:note_id>/uploads/<uuid:pk>/finalize/",
+        "author",
+        args=dict(NOTE, pk="complete_upload"),
+        status=201,
+        prepare=write_complete_upload,
+    ),
+    Endpoint("get", "notes/<int:note_id>/ratings/", "reader", args=NOTE),
+    Endpoint(
+        "post",
+        "notes/<int:note_id>/ratings/",
+        "writer",
+        args=NOTE,
+        data={"score": 4},
+        status=201,
+    ),
+    Endpoint(
+        "get",
+        "notes/<int:note_id>/ratings/<int:pk>/",
+        "reader",
+        args=dict(NOTE, pk="rating"),
+    ),
+    Endpoint(
+        "get", "notes/<int:note_id>/comments/", "reader", args=NOTE, paginated=True
+    ),
+    Endpoint(
+        "post",
+        "notes/<int:note_id>/comments/",
+        "writer",
+        args=NOTE,
+        data={"text": "Great summary."},
+        status=201,
+    ),
+    Endpoint(
+        "get",
+        "notes/<int:note_id>/comments/<int:pk>/",
+        "reader",
+        args=dict(NOTE, pk="comment"),
+    ),
+    Endpoint(
+        "get",
+        "notes/<int:note_id>/comments/<int:comment_id>/report/",
+        "reader",
+        args=dict(NOTE, comment_id="comment"),
+    ),
+    Endpoint("get", "notes/<int:note_id>/favorites/", "reader", args=NOTE),
+    Endpoint(
+        "post", "notes/<int:note_id>/favorites/", "writer", args=NOTE, status=201
+    ),
+    Endpoint(
+        "get",
+        "notes/<int:note_id>/favorites/<int:pk>/",
+        "reader",
+        args=dict(NOTE, pk="favorite"),
+    ),
+    Endpoint("get", "notes/<int:note_id>/report/", "reader", args=NOTE),
+    Endpoint("get", "search/", "reader", query={"q": "calculus"}, label="notes"),
+    Endpoint(
+        "get",
+        "search/",
+        "reader",
+        query={"q": "state", "type": "universities"},
+        label="universities",
+    ),
+    Endpoint("get", "universities/", "reader", paginated=True),
+    Endpoint("get", "universities/autocomplete/", "reader", query={"q": "state"}),
+    Endpoint(
+        "get", "universities/<str:name>/", "reader", args={"name": "university"}
+    ),
+    Endpoint("post", "groups/", "writer", data={"name": "New group"}, status=201),
+    Endpoint("get", "groups/<int:pk>/", "reader", args={"pk": "group"}),
+    Endpoint(
+        "get", "groups/<int:group_id>/notes/", "reader", args=GROUP, paginated=True
+    ),
+    Endpoint(
+        "get",
+        "groups/<int:group_id>/memberships/",
+        "reader",
+        args=GROUP,
+        paginated=True,
+    ),
+    Endpoint(
+        "get",
+        "groups/<int:group_id>/memberships/<int:pk>/",
+        "reader",
+        args=dict(GROUP, pk="membership"),
+    ),
+    Endpoint("get", "groups/<int:group_id>/invitations/", "moderator", args=GROUP),
+    Endpoint(
+        "get",
+        "groups/<int:group_id>/invitations/<int:pk>/",
+        "invitee",
+        args=dict(GROUP, pk="invitation"),
+    ),
+]
+
+
+def find_uncovered_routes(endpoints=ENDPOINTS):
+    covered = {endpoint.route for endpoint in endpoints}
+    return [
+        str(pattern.pattern)
+        for pattern in urls.urlpatterns
+        if str(pattern.pattern) not in covered
+    ]
+
+
+def clear_local_caches():
+    for local_cache in (token_cache, premium_cache, throttle_buckets):
+        local_cache.clear()
+
+
+@contextlib.contextmanager
+def benchmark_settings():
+    """
+    Store files in a temporary directory and turn throttling and slow request
+    logging off while benchmarking.
+    """
+    media_root = tempfile.mkdtemp()
+    overrides = override_settings(
+        MEDIA_ROOT=media_root,
+        NOTEHUB_UPLOAD_DIR=os.path.join(media_root, "uploads"),
+        NOTEHUB_THROTTLE_RATES={scope: None for scope in DEFAULT_RATES},
+        NOTEHUB_SLOW_REQUEST_SECONDS=None,
+    )
+    clear_local_caches()
+    try:
+        with overrides:
+            yield
+    finally:
+        clear_local_caches()
+        shutil.rmtree(media_root)
+
+
+def read_body(response):
+    if not response.streaming:
+        return response.content
+    try:
+        return b"".join(response.streaming_content)
+    finally:
+        response.close()
+
+
+def measure(client, endpoint, fixtures, page_size=None):
+    """
+    Request an endpoint in a transaction that is rolled back afterwards, so
+    every request sees the same fixtures. Returns (status, queries, seconds,
+    payload bytes).
+    """
+    user = None
+    if endpoint.user is not None:
+        user = User.objects.get(pk=fixtures[endpoint.user])
+    client.force_authenticate(user)
+    path = endpoint.get_path(fixtures)
+    data = endpoint.get_data(fixtures, page_size)
+    with transaction.atomic():
+        if endpoint.prepare is not None:
+            endpoint.prepare(fixtures)
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(client, endpoint.method)(path, data, **endpoint.extra)
+            body = read_body(response)
+            elapsed = time.perf_counter() - started
+        transaction.set_rollback(True)
+    return response.status_code, len(queries), elapsed, len(body)
+
+
+def run_benchmarks(fixtures, page_sizes=(5, 50), endpoints=ENDPOINTS):
+    """
+    Request every endpoint once to warm per-process caches, then once more
+    for each page size, or once if it is not paginated, and return the
+    results by endpoint name.
+    """
+    client = APIClient()
+    results = {}
+    for endpoint in endpoints:
+        measure(client, endpoint, fixtures, page_sizes[0])
+        runs = [
+            measure(client, endpoint, fixtures, page_size)
+            for page_size in (page_sizes if endpoint.paginated else page_sizes[:1])
+        ]
+        status, queries, elapsed, size = runs[0]
+        result = {
+            "status": status,
+            "queries": queries,
+            "ms": round(elapsed * 1000, 1),
+            "bytes": size,
+        }
+        if endpoint.paginated:
+            result["page_queries"] = {
+                str(page_size): run[1] for page_size, run in zip(page_sizes, runs)
+            }
+        results[endpoint.name] = result
+    return results
+
+
+def check_results(results, baseline, endpoints=ENDPOINTS):
+    """Return a description of every regression in `results`, or []."""
+    failures = [
+        "/api/{0} is not benchmarked.".format(route)
+        for route in find_uncovered_routes(endpoints)
+    ]
+    for endpoint in endpoints:
+        result = results[endpoint.name]
+        if result["status"] != endpoint.status:
+            failures.append(
+                "{0} returned {1}, expected {2}.".format(
+                    endpoint.name, result["status"], endpoint.status
+                )
+            )
+        page_queries = result.get("page_queries", {})
+        if len(set(page_queries.values())) > 1:
+            failures.append(
+                "{0} runs more queries for larger pages: {1}.".format(
+                    endpoint.name,
+                    ", ".join(
+                        "{0} for {1} rows".format(queries, page_size)
+                        for page_size, queries in page_queries.items()
+                    ),
+                )
+            )
+        budget = baseline.get(endpoint.name, {}).get("queries")
+        if budget is None:
+            failures.append("{0} has no baseline.".format(endpoint.name))
+        elif result["queries"] > budget:
+            failures.append(
+                "{0} ran {1} queries, over its budget of {2}.".format(
+                    endpoint.name, result["queries"], budget
+                )
+            )
+    return failures
+
+
+def load_baseline(path=BASELINE_PATH):
+    try:
+        with open(path) as baseline_file:
+            return json.load(baseline_file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    baseline = {
+        name: {key: result[key] for key in ("queries", "ms", "bytes")}
+        for name, result in results.items()
+    }
+    with open(path, "w") as baseline_file:
+        json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        baseline_file.write("\n")
@@ -0,0 +1,152 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+NOTE_FINGERPRINT = (
+    "id",
+    "title",
+    "course",
+    "updated_at",
+    "rating_count",
+    "rating_sum",
+    "author.username",
+    "university.name",
+    "group.name",
+    "group.moderator_id",
+    "comments_version",
+    "ratings_version",
+    "files_version",
+)
+COMMENT_FINGERPRINT = ("id", "updated_at", "author.username")
+UNIVERSITY_FINGERPRINT = ("id", "name")
+
+
+def resolve(obj, path):
+    for attr in path.split("."):
+        if obj is None:
+            return None
+        obj = getattr(obj, attr)
+    return obj
+
+
+def make_etag(*parts):
+    return quote_etag(hashlib.md5(repr(parts).encode()).hexdigest())
+
+
+def get_response_cache():
+    # Rendered responses for anonymous users can be kept in one of Django's
+    # caches, e.g. NOTEHUB_RESPONSE_CACHE = "default". Keys include the ETag,
+    # so any write to what a response shows makes its entry unreachable.
+    alias = getattr(settings, "NOTEHUB_RESPONSE_CACHE", None)
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+class ConditionalGetMixin:
+    """
+    ETag validation for list and retrieve views.
+
+    The ETag is computed from `fingerprint_fields` of the objects a response
+    is built from, once they are loaded but before any serializer runs, so a
+    request whose If-None-Match matches is answered with 304 for the price of
+    the lookup alone.
+
+    Lists that belong to a note or group can instead return its version
+    counter from `get_collection_version()`, which makes the ETag known
+    before the list is queried at all.
+    """
+
+    fingerprint_fields = ()
+    last_modified_field = None
+
+    def get_collection_version(self):
+        return None
+
+    def get_etag(self, request, *parts):
+        # Fields such as is_author and has_rated depend on who is asking.
+        url = request.build_absolute_uri()
+        return make_etag(url, request.user.id, *parts)
+
+    def get_fingerprints(self, objects):
+        return [
+            tuple(resolve(obj, path) for path in self.fingerprint_fields)
+            for obj in objects
+        ]
+
+    def get_last_modified(self, objects):
+        if self.last_modified_field is None:
+            return None
+        values = [getattr(obj, self.last_modified_field) for obj in objects]
+        return max(values) if values else None
+
+    def conditional_response(self, request, etag, build, objects=()):
+        # Last-Modified is sent for information only. Counters such as ratings
+        # change without touching updated_at, so only the ETag is validated.
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            cache = get_response_cache() if request.user.is_anonymous else None
+            key = "response:{0}".format(etag.strip('"'))
+            data = cache.get(key) if cache is not None else None
+            if data is None:
+                data = build()
+                if cache is not None:
+                    timeout = getattr(settings, "NOTEHUB_RESPONSE_CACHE_TTL", 300)
+                    cache.set(key, data, timeout)
+            response = Response(data)
+        response["ETag"] = etag
+        last_modified = self.get_last_modified(objects)
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified.timestamp())
+        if request.user.is_anonymous:
+            patch_cache_control(response, public=True, no_cache=True)
+        else:
+            patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ("Authorization", "Cookie"))
+        return response
+
+    def serialize_list(self, objects):
+        serializer = self.get_serializer(objects, many=True)
+        if not self.paginated:
+            return serializer.data
+        return self.get_paginated_response(serializer.data).data
+
+    def list(self, request, *args, **kwargs):
+        version = self.get_collection_version()
+        if version is not None:
+            etag = self.get_etag(request, version)
+
+            def build():
+                return self.serialize_list(self.paginate_list())
+
+            return self.conditional_response(request, etag, build)
+
+        objects = self.paginate_list()
+        paging = None
+        if self.paginated:
+            paging = (self.paginator.has_next, self.paginator.has_previous)
+        etag = self.get_etag(request, self.get_fingerprints(objects), paging)
+        return self.conditional_response(
+            request, etag, lambda: self.serialize_list(objects), objects
+        )
+
+    def paginate_list(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        self.paginated = page is not None
+        return list(queryset) if page is None else page
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag = self.get_etag(request, self.get_fingerprints([instance]))
+        return self.conditional_response(
+            request, etag, lambda: self.get_serializer(instance).data, [instance]
+        )
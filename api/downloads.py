@@ -0,0 +1,129 @@
+import hashlib
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+BLOCK_SIZE = 64 * 1024
+
+
+def get_etag(note_file, field_file):
+    key = "{0}:{1}:{2}".format(
+        note_file.pk, field_file.name, note_file.created_at.timestamp()
+    )
+    return quote_etag(hashlib.md5(key.encode()).hexdigest())
+
+
+def parse_range(header, size):
+    """
+    Return the inclusive (start, end) byte positions requested by a Range
+    header, None if the header should be ignored (multiple or malformed
+    ranges), or False if the range cannot be satisfied.
+    """
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first == "" and last == "":
+        return None
+    if size == 0:
+        return False
+    if first == "":
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = size - 1 if last == "" else min(int(last), size - 1)
+    if start > end:
+        return False
+    return start, end
+
+
+def iter_range(file, start, length):
+    file.seek(start)
+    while length > 0:
+        block = file.read(min(BLOCK_SIZE, length))
+        if not block:
+            break
+        length -= len(block)
+        yield block
+    file.close()
+
+
+def sendfile_response(field_file):
+    """
+    Hand the file over to the web server, which then takes care of ranges,
+    when NOTEHUB_SENDFILE is "nginx" (X-Accel-Redirect) or "apache"
+    (X-Sendfile).
+    """
+    backend = getattr(settings, "NOTEHUB_SENDFILE", None)
+    if backend is None:
+        return None
+    response = HttpResponse()
+    if backend == "nginx":
+        prefix = getattr(settings, "NOTEHUB_SENDFILE_PREFIX", "/protected/")
+        response["X-Accel-Redirect"] = prefix + field_file.name
+    else:
+        response["X-Sendfile"] = field_file.path
+    return response
+
+
+def serve_note_file(request, note_file, field="file"):
+    """
+    Respond with the note file, or with its "thumbnail" or "preview" image
+    when `field` names one.
+    """
+    field_file = getattr(note_file, field)
+    etag = get_etag(note_file, field_file)
+    last_modified = note_file.created_at.timestamp()
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified)
+    )
+    if response is not None:
+        return response
+
+    response = sendfile_response(field_file)
+    if response is None:
+        response = stream_note_file(request, field_file, etag)
+
+    name = os.path.basename(field_file.name)
+    content_type, encoding = mimetypes.guess_type(name)
+    response["Content-Type"] = content_type or "application/octet-stream"
+    response["Content-Disposition"] = 'inline; filename="{0}"'.format(name)
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    response["Accept-Ranges"] = "bytes"
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def stream_note_file(request, field_file, etag):
+    size = field_file.size
+    byte_range = None
+    if "HTTP_RANGE" in request.META:
+        if_range = request.META.get("HTTP_IF_RANGE")
+        if if_range is None or if_range == etag:
+            byte_range = parse_range(request.META["HTTP_RANGE"], size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = "bytes */{0}".format(size)
+        return response
+
+    file = field_file.open("rb")
+    if byte_range is None:
+        response = FileResponse(file)
+        response["Content-Length"] = size
+        return response
+    start, end = byte_range
+    response = StreamingHttpResponse(
+        iter_range(file, start, end - start + 1), status=206
+    )
+    response["Content-Range"] = "bytes {0}-{1}/{2}".format(start, end, size)
+    response["Content-Length"] = end - start + 1
+    return response
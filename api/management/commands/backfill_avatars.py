@@ -0,0 +1,38 @@
+from io import BytesIO
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from api.avatars import AvatarError, is_normalized, set_avatar
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Resize avatars uploaded before they were normalized into every avatar "
+        "size, replacing the original images."
+    )
+
+    def handle(self, *args, **options):
+        users = User.objects.exclude(avatar="").only("id", "username", "avatar")
+        converted = failed = 0
+        for user in users.order_by("pk").iterator():
+            if is_normalized(user.avatar):
+                continue
+            try:
+                with user.avatar.open("rb") as file:
+                    content = BytesIO(file.read())
+                set_avatar(user, content)
+            except (OSError, AvatarError) as error:
+                failed += 1
+                self.stderr.write(
+                    "Could not convert the avatar of {0}: {1}".format(
+                        user.username, error
+                    )
+                )
+                continue
+            converted += 1
+        self.stdout.write(
+            "Converted {0} avatars ({1} failed).".format(converted, failed)
+        )
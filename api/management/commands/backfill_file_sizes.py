@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import (
+    Note,
+    NoteFile,
+    UserStats,
+    update_storage_totals,
+    update_user_stats,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Store the size of every note file, read once from storage, and "
+        "recompute the storage totals of notes and users from them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Re-read sizes of files that already have one stored.",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        files = NoteFile.objects.order_by("pk")
+        if not options["all"]:
+            files = files.filter(size_bytes=0)
+        ids = list(files.values_list("pk", flat=True))
+        batch_size = options["batch_size"]
+        missing = 0
+        for start in range(0, len(ids), batch_size):
+            batch = NoteFile.objects.filter(pk__in=ids[start : start + batch_size])
+            batch = list(batch)
+            for note_file in batch:
+                try:
+                    note_file.size_bytes = note_file.file.size
+                except (OSError, ValueError):
+                    missing += 1
+                    self.stderr.write(
+                        "Missing file for note file {0}.".format(note_file.pk)
+                    )
+            NoteFile.objects.bulk_update(batch, ["size_bytes"])
+        with transaction.atomic():
+            update_storage_totals(Note.objects.all())
+            update_user_stats(UserStats.objects.all(), "total_bytes")
+        self.stdout.write(
+            "Stored sizes of {0} files ({1} missing).".format(
+                len(ids) - missing, missing
+            )
+        )
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Note, update_rating_totals
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized rating totals stored on every note."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        ids = list(Note.objects.order_by("pk").values_list("pk", flat=True))
+        updated = 0
+        for start in range(0, len(ids), batch_size):
+            with transaction.atomic():
+                updated += update_rating_totals(
+                    Note.objects.filter(pk__in=ids[start : start + batch_size])
+                )
+        self.stdout.write("Updated rating totals of {0} notes.".format(updated))
@@ -0,0 +1,145 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.db.backends.signals import connection_created
+from django.core.management.base import BaseCommand, CommandError
+
+from api.asgi import NoteHubASGIHandler
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare throughput of the WSGI and ASGI entry points by sending the "
+        "same GET requests to each in-process, with the same number of worker "
+        "threads and requests in flight. Run it against a copy of production "
+        "data with DEBUG off, e.g. "
+        "benchmark_asgi /api/notes/ /api/search/?q=calc --token <key>"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="Paths to request in turn.")
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=16,
+            help="Requests in flight and worker threads (default: 16).",
+        )
+        parser.add_argument("--token", help="API token to authenticate with.")
+        parser.add_argument("--host", default="localhost")
+
+    def handle(self, *args, **options):
+        if options["requests"] < 1 or options["concurrency"] < 1:
+            raise CommandError("--requests and --concurrency must be positive.")
+        requests = [
+            urlsplit(options["paths"][index % len(options["paths"])])
+            for index in range(options["requests"])
+        ]
+        headers = {"host": options["host"]}
+        if options["token"]:
+            headers["authorization"] = "Token " + options["token"]
+
+        connections = []
+
+        def count_connection(sender, connection, **kwargs):
+            connections.append(connection.alias)
+
+        connection_created.connect(count_connection)
+        for name, run in (("WSGI", self.run_wsgi), ("ASGI", self.run_asgi)):
+            connections.clear()
+            started = time.monotonic()
+            results = run(requests, headers, options["concurrency"])
+            elapsed = time.monotonic() - started
+            latencies = [latency for status, latency in results]
+            failed = sum(1 for status, latency in results if status >= 400)
+            self.stdout.write(
+                "{0}: {1:.1f} requests/s, p50 {2:.1f} ms, p95 {3:.1f} ms, "
+                "{4} failed, {5:.2f} database connections per request".format(
+                    name,
+                    len(results) / elapsed,
+                    percentile(latencies, 0.5) * 1000,
+                    percentile(latencies, 0.95) * 1000,
+                    failed,
+                    len(connections) / len(results),
+                )
+            )
+        connection_created.disconnect(count_connection)
+
+    def run_wsgi(self, requests, headers, concurrency):
+        application = WSGIHandler()
+
+        def send(url):
+            environ = {
+                "REQUEST_METHOD": "GET",
+                "PATH_INFO": url.path,
+                "QUERY_STRING": url.query,
+                "SCRIPT_NAME": "",
+                "SERVER_NAME": headers["host"],
+                "SERVER_PORT": "80",
+                "SERVER_PROTOCOL": "HTTP/1.1",
+                "wsgi.input": BytesIO(),
+                "wsgi.url_scheme": "http",
+            }
+            for name, value in headers.items():
+                environ["HTTP_" + name.upper()] = value
+            statuses = []
+
+            def start_response(status, response_headers, exc_info=None):
+                statuses.append(int(status.split()[0]))
+
+            started = time.monotonic()
+            result = application(environ, start_response)
+            try:
+                for _ in result:
+                    pass
+            finally:
+                result.close()
+            return statuses[0], time.monotonic() - started
+
+        with ThreadPoolExecutor(concurrency) as executor:
+            return list(executor.map(send, requests))
+
+    def run_asgi(self, requests, headers, concurrency):
+        application = NoteHubASGIHandler()
+        scope_headers = [
+            (name.encode(), value.encode()) for name, value in headers.items()
+        ]
+
+        async def send(url, slots):
+            async with slots:
+                scope = {
+                    "type": "http",
+                    "method": "GET",
+                    "path": url.path,
+                    "query_string": url.query.encode(),
+                    "headers": scope_headers,
+                }
+                statuses = []
+
+                async def receive():
+                    return {"type": "http.request", "body": b""}
+
+                async def send_message(message):
+                    if message["type"] == "http.response.start":
+                        statuses.append(message["status"])
+
+                started = time.monotonic()
+                await application(scope, receive, send_message)
+                return statuses[0], time.monotonic() - started
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            loop.set_default_executor(ThreadPoolExecutor(concurrency))
+            slots = asyncio.Semaphore(concurrency)
+            return await asyncio.gather(*(send(url, slots) for url in requests))
+
+        return asyncio.run(run())
@@ -0,0 +1,98 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.runner import DiscoverRunner
+
+from api.benchmarks import (
+    BASELINE_PATH,
+    benchmark_settings,
+    check_results,
+    load_baseline,
+    run_benchmarks,
+    save_baseline,
+    seed,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a test database with realistic fixtures, request every API "
+        "route against it and report SQL queries, wall time and payload size "
+        "per endpoint. Fails if an endpoint runs more queries than its "
+        "baseline, or more for large pages than for small ones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--notes", type=int, default=2000)
+        parser.add_argument(
+            "--rows",
+            type=int,
+            default=60,
+            help="Rows of every other paginated list (default: 60).",
+        )
+        parser.add_argument(
+            "--page-sizes",
+            type=int,
+            nargs=2,
+            default=(5, 50),
+            metavar=("SMALL", "LARGE"),
+        )
+        parser.add_argument(
+            "--universities",
+            default=os.path.join(settings.BASE_DIR, "uni.csv"),
+            help="CSV file of universities to import (default: uni.csv).",
+        )
+        parser.add_argument("--baseline", default=BASELINE_PATH)
+        parser.add_argument(
+            "--update-baseline",
+            action="store_true",
+            help="Store the results as the new baseline instead of checking.",
+        )
+
+    def handle(self, *args, **options):
+        if options["rows"] <= max(options["page_sizes"]):
+            raise CommandError("--rows must be larger than the page sizes.")
+        # The fixtures go into a test database, like the test runner's.
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        runner.setup_test_environment()
+        old_config = runner.setup_databases()
+        try:
+            with benchmark_settings():
+                started = time.monotonic()
+                fixtures = seed(
+                    options["notes"], options["rows"], options["universities"]
+                )
+                self.stdout.write(
+                    "Seeded fixtures in {0:.1f}s.".format(time.monotonic() - started)
+                )
+                results = run_benchmarks(fixtures, options["page_sizes"])
+        finally:
+            runner.teardown_databases(old_config)
+            runner.teardown_test_environment()
+
+        baseline = load_baseline(options["baseline"])
+        self.report(results, baseline)
+        if options["update_baseline"]:
+            save_baseline(results, options["baseline"])
+            self.stdout.write("Stored the baseline in {0}.".format(options["baseline"]))
+            return
+        failures = check_results(results, baseline)
+        if failures:
+            raise CommandError("\n".join(failures))
+        self.stdout.write("All endpoints are within their query budgets.")
+
+    def report(self, results, baseline):
+        self.stdout.write(
+            "{0:<62} {1:>7} {2:>7} {3:>9} {4:>9}".format(
+                "Endpoint", "Queries", "Budget", "ms", "Bytes"
+            )
+        )
+        for name, result in results.items():
+            budget = baseline.get(name, {}).get("queries", "-")
+            self.stdout.write(
+                "{0:<62} {1:>7} {2:>7} {3:>9} {4:>9}".format(
+                    name, result["queries"], budget, result["ms"], result["bytes"]
+                )
+            )
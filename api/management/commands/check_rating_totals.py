@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import Note, rating_totals, update_rating_totals
+
+TOLERANCE = 1e-6
+
+
+class Command(BaseCommand):
+    help = "Report notes whose stored rating totals disagree with their ratings."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fix", action="store_true", help="Recompute totals of stale notes."
+        )
+
+    def handle(self, *args, **options):
+        actual = {"actual_" + name: value for name, value in rating_totals().items()}
+        notes = (
+            Note.objects.order_by("pk")
+            .annotate(**actual)
+            .values(
+                "pk",
+                "rating_count",
+                "rating_sum",
+                "rating_avg",
+                "actual_rating_count",
+                "actual_rating_sum",
+                "actual_rating_avg",
+            )
+        )
+        stale = []
+        for note in notes.iterator():
+            for name in ("rating_count", "rating_sum", "rating_avg"):
+                if abs(note[name] - note["actual_" + name]) > TOLERANCE:
+                    stale.append(note["pk"])
+                    self.stdout.write(
+                        "Note {0}: {1} is {2}, expected {3}".format(
+                            note["pk"], name, note[name], note["actual_" + name]
+                        )
+                    )
+                    break
+        if not stale:
+            self.stdout.write("Rating totals are consistent.")
+            return
+        if options["fix"]:
+            update_rating_totals(Note.objects.filter(pk__in=stale))
+            self.stdout.write("Fixed rating totals of {0} notes.".format(len(stale)))
+            return
+        raise CommandError("{0} notes have stale rating totals.".format(len(stale)))
@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import UploadSession
+from api.uploads import remove_upload_file
+
+
+class Command(BaseCommand):
+    help = "Delete upload sessions, and their partial files, left idle too long."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hours",
+            type=int,
+            default=24,
+            help="Delete sessions not written to for this many hours.",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options["hours"])
+        sessions = list(UploadSession.objects.filter(updated_at__lt=cutoff))
+        for session in sessions:
+            remove_upload_file(session)
+        UploadSession.objects.filter(pk__in=[s.pk for s in sessions]).delete()
+        self.stdout.write("Deleted {0} upload sessions.".format(len(sessions)))
@@ -0,0 +1,145 @@
+import csv
+import io
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.autocomplete import invalidate_university_index
+from api.models import University
+from api.search import get_search_backend
+
+NAME_LENGTH = University._meta.get_field("name").max_length
+
+
+def batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+class Command(BaseCommand):
+    help = (
+        "Import university names from a CSV file whose first column is the "
+        "name. Only names not stored yet are inserted, so reruns are cheap."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path",
+            nargs="?",
+            default=os.path.join(settings.BASE_DIR, "uni.csv"),
+            help="CSV file to import (default: uni.csv).",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--delete-missing",
+            action="store_true",
+            help="Delete universities missing from the file that no note uses.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report what would change without writing anything.",
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        names = self.read_names(options["path"])
+        existing = set(University.objects.values_list("name", flat=True))
+        added = sorted(names - existing)
+        missing = sorted(existing - names)
+        self.report("Read {0} names".format(len(names)), started)
+
+        if options["dry_run"]:
+            self.stdout.write(
+                "Would add {0} and find {1} missing universities.".format(
+                    len(added), len(missing)
+                )
+            )
+            return
+
+        with transaction.atomic():
+            step = time.monotonic()
+            if connection.vendor == "postgresql":
+                self.copy_names(added)
+            else:
+                self.insert_names(added, options["batch_size"])
+            self.report("Added {0} universities".format(len(added)), step)
+
+            step = time.monotonic()
+            backend = get_search_backend()
+            batch_size = options["batch_size"]
+            for batch in batches(added, batch_size):
+                backend.index_universities(University.objects.filter(name__in=batch))
+            self.report("Indexed new universities", step)
+
+            if options["delete_missing"] and missing:
+                step = time.monotonic()
+                deleted = 0
+                for batch in batches(missing, batch_size):
+                    unused = University.objects.filter(
+                        name__in=batch, note__isnull=True
+                    )
+                    deleted += unused.delete()[1].get(University._meta.label, 0)
+                self.report(
+                    "Deleted {0} universities ({1} still used by notes)".format(
+                        deleted, len(missing) - deleted
+                    ),
+                    step,
+                )
+            # Signals do not fire for bulk inserts.
+            transaction.on_commit(invalidate_university_index)
+        self.report("Done", started)
+
+    def read_names(self, path):
+        names = set()
+        try:
+            with open(path, newline="", encoding="utf-8") as csv_file:
+                for row in csv.reader(csv_file):
+                    name = row[0].strip() if row else ""
+                    if not name:
+                        continue
+                    if len(name) > NAME_LENGTH:
+                        self.stderr.write(
+                            "Skipping name longer than {0}: {1}".format(
+                                NAME_LENGTH, name
+                            )
+                        )
+                        continue
+                    names.add(name)
+        except OSError as error:
+            raise CommandError("Could not read {0}: {1}".format(path, error))
+        return names
+
+    def insert_names(self, names, batch_size):
+        University.objects.bulk_create(
+            (University(name=name) for name in names),
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+
+    def copy_names(self, names):
+        """Load names through COPY into a temporary table, then insert them."""
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows([name] for name in names)
+        buffer.seek(0)
+        table = University._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TEMPORARY TABLE university_import (name varchar({0})) "
+                "ON COMMIT DROP".format(NAME_LENGTH)
+            )
+            cursor.copy_expert(
+                "COPY university_import (name) FROM STDIN WITH (FORMAT csv)", buffer
+            )
+            cursor.execute(
+                "INSERT INTO {0} (name) SELECT name FROM university_import "
+                "ON CONFLICT (name) DO NOTHING".format(table)
+            )
+
+    def report(self, message, started):
+        self.stdout.write(
+            "{0} in {1:.2f}s.".format(message, time.monotonic() - started)
+        )
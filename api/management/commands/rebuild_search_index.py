@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Note, University
+from api.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index of notes and universities."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        batch_size = options["batch_size"]
+        for model, label, index in (
+            (University, "universities", backend.index_universities),
+            (Note, "notes", backend.index_notes),
+        ):
+            ids = list(model.objects.order_by("pk").values_list("pk", flat=True))
+            for start in range(0, len(ids), batch_size):
+                with transaction.atomic():
+                    index(model.objects.filter(pk__in=ids[start : start + batch_size]))
+            self.stdout.write("Indexed {0} {1}.".format(len(ids), label))
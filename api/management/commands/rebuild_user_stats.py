@@ -0,0 +1,25 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import rebuild_user_stats
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Recreate and recompute the precomputed statistics of every user."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        ids = list(User.objects.order_by("pk").values_list("pk", flat=True))
+        updated = 0
+        for start in range(0, len(ids), batch_size):
+            with transaction.atomic():
+                updated += rebuild_user_stats(
+                    User.objects.filter(pk__in=ids[start : start + batch_size])
+                )
+        self.stdout.write("Rebuilt statistics of {0} users.".format(updated))
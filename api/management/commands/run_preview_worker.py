@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.models import NoteFile
+from api.previews import process_pending
+
+
+class Command(BaseCommand):
+    help = (
+        "Render thumbnails and previews of note files queued for them. Runs "
+        "until interrupted unless --once is given; start several to share the "
+        "queue."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5,
+            help="Seconds to wait before polling an empty queue again.",
+        )
+        parser.add_argument(
+            "--retry-failed",
+            action="store_true",
+            help="Queue files whose previews failed again first.",
+        )
+
+    def handle(self, *args, **options):
+        if options["retry_failed"]:
+            retried = NoteFile.objects.filter(
+                preview_status=NoteFile.PREVIEW_FAILED
+            ).update(preview_status=NoteFile.PREVIEW_PENDING, preview_attempts=0)
+            self.stdout.write("Queued {0} failed files again.".format(retried))
+        while True:
+            close_old_connections()
+            processed = process_pending(limit=100)
+            if processed:
+                self.stdout.write("Processed {0} files.".format(processed))
+            elif options["once"]:
+                break
+            else:
+                time.sleep(options["interval"])
@@ -0,0 +1,297 @@
+import bisect
+import contextvars
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+from rest_framework.serializers import BaseSerializer
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SLOW_REQUEST_MAX_QUERIES = 100
+
+current_request = contextvars.ContextVar("notehub_request_metrics", default=None)
+
+
+class RequestMetrics:
+    """What one request spent on queries and serializers."""
+
+    def __init__(self, keep_queries=False):
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializing = False
+        self.queries = [] if keep_queries else None
+        # Lookups of one request may run in several threads at once.
+        self.lock = threading.Lock()
+
+    def add_query(self, sql, duration):
+        with self.lock:
+            self.query_count += 1
+            self.db_time += duration
+            if self.queries is not None:
+                if len(self.queries) < SLOW_REQUEST_MAX_QUERIES:
+                    self.queries.append((duration, sql))
+
+
+class Registry:
+    """
+    Per-process request metrics by route and method, rendered in the
+    Prometheus text format. Each worker process reports its own.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, route, method, status, duration, metrics, response_bytes):
+        with self.lock:
+            series = self.series.get((route, method))
+            if series is None:
+                series = self.series[(route, method)] = {
+                    "durations": [0] * (len(DURATION_BUCKETS) + 1),
+                    "duration_sum": 0.0,
+                    "queries": [0] * (len(QUERY_BUCKETS) + 1),
+                    "query_sum": 0,
+                    "db_seconds": 0.0,
+                    "serializer_seconds": 0.0,
+                    "response_bytes": 0,
+                    "statuses": {},
+                }
+            series["durations"][bisect.bisect_left(DURATION_BUCKETS, duration)] += 1
+            series["duration_sum"] += duration
+            index = bisect.bisect_left(QUERY_BUCKETS, metrics.query_count)
+            series["queries"][index] += 1
+            series["query_sum"] += metrics.query_count
+            series["db_seconds"] += metrics.db_time
+            series["serializer_seconds"] += metrics.serializer_time
+            series["response_bytes"] += response_bytes
+            statuses = series["statuses"]
+            statuses[status] = statuses.get(status, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+
+    def render(self):
+        with self.lock:
+            return self.render_series(self.series)
+
+    def render_series(self, series):
+        lines = []
+
+        def labels(route, method, **extra):
+            pairs = [("route", route), ("method", method)] + list(extra.items())
+            return ",".join(
+                '{0}="{1}"'.format(name, str(value).replace('"', '\\"'))
+                for name, value in pairs
+            )
+
+        def histogram(name, help, buckets, counts_key, sum_key):
+            lines.append("# HELP {0} {1}".format(name, help))
+            lines.append("# TYPE {0} histogram".format(name))
+            for (route, method), values in sorted(series.items()):
+                total = 0
+                bounds = [str(bound) for bound in buckets] + ["+Inf"]
+                for bound, count in zip(bounds, values[counts_key]):
+                    total += count
+                    lines.append(
+                        "{0}_bucket{{{1}}} {2}".format(
+                            name, labels(route, method, le=bound), total
+                        )
+                    )
+                lines.append(
+                    "{0}_sum{{{1}}} {2}".format(
+                        name, labels(route, method), values[sum_key]
+                    )
+                )
+                lines.append(
+                    "{0}_count{{{1}}} {2}".format(name, labels(route, method), total)
+                )
+
+        def counter(name, help, key):
+            lines.append("# HELP {0} {1}".format(name, help))
+            lines.append("# TYPE {0} counter".format(name))
+            for (route, method), values in sorted(series.items()):
+                lines.append(
+                    "{0}{{{1}}} {2}".format(name, labels(route, method), values[key])
+                )
+
+        lines.append("# HELP notehub_requests_total Requests served.")
+        lines.append("# TYPE notehub_requests_total counter")
+        for (route, method), values in sorted(series.items()):
+            for status, count in sorted(values["statuses"].items()):
+                lines.append(
+                    "notehub_requests_total{{{0}}} {1}".format(
+                        labels(route, method, status=status), count
+                    )
+                )
+        histogram(
+            "notehub_request_duration_seconds",
+            "Time to build the response.",
+            DURATION_BUCKETS,
+            "durations",
+            "duration_sum",
+        )
+        histogram(
+            "notehub_request_queries",
+            "SQL queries per request.",
+            QUERY_BUCKETS,
+            "queries",
+            "query_sum",
+        )
+        counter(
+            "notehub_request_db_seconds_total", "Time spent in SQL.", "db_seconds"
+        )
+        counter(
+            "notehub_request_serializer_seconds_total",
+            "Time spent serializing, including queries serializers run.",
+            "serializer_seconds",
+        )
+        counter(
+            "notehub_response_bytes_total",
+            "Response body bytes, where known up front.",
+            "response_bytes",
+        )
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = current_request.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add_query(sql, time.perf_counter() - started)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    # Installed on every connection, so queries that a request runs in other
+    # threads, like the ASGI handler's concurrent lookups, are counted too.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def install_serializer_timing():
+    """
+    Time the top-level `.data` of DRF serializers. Nested serializers are
+    rendered with to_representation(), so only the outermost call counts.
+    """
+    data = BaseSerializer.data.fget
+    if getattr(data, "timed", False):
+        return
+
+    def timed_data(serializer):
+        metrics = current_request.get()
+        if metrics is None or metrics.serializing:
+            return data(serializer)
+        metrics.serializing = True
+        started = time.perf_counter()
+        try:
+            return data(serializer)
+        finally:
+            metrics.serializing = False
+            metrics.serializer_time += time.perf_counter() - started
+
+    timed_data.timed = True
+    BaseSerializer.data = property(timed_data)
+
+
+def install():
+    connection_created.connect(install_query_recorder)
+    install_serializer_timing()
+
+
+def get_slow_request_seconds():
+    return getattr(settings, "NOTEHUB_SLOW_REQUEST_SECONDS", None)
+
+
+def start_request():
+    metrics = RequestMetrics(keep_queries=get_slow_request_seconds() is not None)
+    return metrics, current_request.set(metrics)
+
+
+def finish_request(request, response, metrics, token):
+    current_request.reset(token)
+    duration = time.perf_counter() - metrics.started
+    match = getattr(request, "resolver_match", None)
+    route = "/" + match.route if match is not None else "unmatched"
+    if response.streaming:
+        response_bytes = int(response.get("Content-Length", 0))
+    else:
+        response_bytes = len(response.content)
+    registry.observe(
+        route,
+        request.method,
+        response.status_code,
+        duration,
+        metrics,
+        response_bytes,
+    )
+    threshold = get_slow_request_seconds()
+    if threshold is not None and duration >= threshold:
+        queries = "".join(
+            "\n  {0:.4f}s {1}".format(query_time, sql)
+            for query_time, sql in metrics.queries
+        )
+        logger.warning(
+            "Slow request %s %s: %.3fs, %d queries in %.3fs, %.3fs serializing%s",
+            request.method,
+            request.get_full_path(),
+            duration,
+            metrics.query_count,
+            metrics.db_time,
+            metrics.serializer_time,
+            queries,
+        )
+
+
+class MetricsMiddleware:
+    """
+    Record the latency, SQL queries, DB and serializer time and response size
+    of every request, and log the queries of requests slower than
+    NOTEHUB_SLOW_REQUEST_SECONDS. Should be first in MIDDLEWARE.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics, token = start_request()
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            current_request.reset(token)
+            raise
+        finish_request(request, response, metrics, token)
+        return response
+
+
+def metrics_view(request):
+    """
+    Serve metrics in the Prometheus text format to requests that carry
+    NOTEHUB_METRICS_TOKEN as a bearer token. Without a token configured the
+    endpoint is disabled, since a reverse proxy on the same host makes every
+    client's address look local.
+    """
+    token = getattr(settings, "NOTEHUB_METRICS_TOKEN", None)
+    if not token:
+        raise Http404
+    expected = "Bearer {0}".format(token)
+    if not constant_time_compare(request.META.get("HTTP_AUTHORIZATION", ""), expected):
+        raise Http404
+    return HttpResponse(
+        registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
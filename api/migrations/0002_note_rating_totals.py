@@ -0,0 +1,48 @@
+# Generated by Django 3.0.2 on 2026-10-17 22:47
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_rating_totals(apps, schema_editor):
+    Note = apps.get_model('api', 'Note')
+    Rating = apps.get_model('api', 'Rating')
+    ratings = Rating.objects.filter(note=OuterRef('pk')).order_by().values('note')
+    Note.objects.update(
+        rating_count=Coalesce(
+            Subquery(ratings.annotate(value=Count('id')).values('value')), Value(0)
+        ),
+        rating_sum=Coalesce(
+            Subquery(ratings.annotate(value=Sum('score')).values('value')), Value(0.0)
+        ),
+        rating_avg=Coalesce(
+            Subquery(ratings.annotate(value=Avg('score')).values('value')), Value(0.0)
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='rating_avg',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='rating_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='rating_sum',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_totals, migrations.RunPython.noop),
+    ]
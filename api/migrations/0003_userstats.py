@@ -0,0 +1,65 @@
+# Generated by Django 3.0.2 on 2026-10-17 22:50
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def create_user_stats(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    UserStats = apps.get_model('api', 'UserStats')
+    Note = apps.get_model('api', 'Note')
+    Favorite = apps.get_model('api', 'Favorite')
+    Subscription = apps.get_model('api', 'Subscription')
+    UserStats.objects.bulk_create(
+        [UserStats(user_id=pk) for pk in User.objects.values_list('pk', flat=True)]
+    )
+    notes = Note.objects.filter(author=OuterRef('user')).order_by().values('author')
+    favorites = Favorite.objects.filter(user=OuterRef('user')).order_by().values('user')
+    subscriptions = Subscription.objects.filter(user=OuterRef('user')).order_by(
+        '-expires_at'
+    )
+    UserStats.objects.update(
+        total_uploads=Coalesce(
+            Subquery(notes.annotate(value=Count('id')).values('value')), Value(0)
+        ),
+        total_favorite=Coalesce(
+            Subquery(favorites.annotate(value=Count('id')).values('value')), Value(0)
+        ),
+        rating_count=Coalesce(
+            Subquery(notes.annotate(value=Sum('rating_count')).values('value')),
+            Value(0),
+        ),
+        rating_sum=Coalesce(
+            Subquery(notes.annotate(value=Sum('rating_sum')).values('value')),
+            Value(0.0),
+        ),
+        premium_starts_at=Subquery(subscriptions.values('starts_at')[:1]),
+        premium_expires_at=Subquery(subscriptions.values('expires_at')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0002_note_rating_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('total_uploads', models.IntegerField(default=0)),
+                ('total_favorite', models.IntegerField(default=0)),
+                ('rating_count', models.IntegerField(default=0)),
+                ('rating_sum', models.FloatField(default=0)),
+                ('premium_starts_at', models.DateTimeField(blank=True, null=True)),
+                ('premium_expires_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(create_user_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 3.0.2 on 2026-10-17 22:51
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+POSTGRES_FORWARD = [
+    'CREATE INDEX api_note_search_vector_gin ON api_note USING gin (search_vector)',
+    'CREATE INDEX api_university_search_vector_gin '
+    'ON api_university USING gin (search_vector)',
+    "UPDATE api_note SET search_vector = "
+    "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(course, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce((SELECT name FROM api_university "
+    "WHERE api_university.id = api_note.university_id), '')), 'C')",
+    "UPDATE api_university SET search_vector = "
+    "to_tsvector('simple', coalesce(name, ''))",
+]
+POSTGRES_BACKWARD = [
+    'DROP INDEX IF EXISTS api_note_search_vector_gin',
+    'DROP INDEX IF EXISTS api_university_search_vector_gin',
+]
+SQLITE_FORWARD = [
+    'CREATE VIRTUAL TABLE api_note_fts USING fts5(title, course, university)',
+    'CREATE VIRTUAL TABLE api_university_fts USING fts5(name)',
+    "INSERT INTO api_note_fts (rowid, title, course, university) "
+    "SELECT api_note.id, api_note.title, api_note.course, "
+    "coalesce(api_university.name, '') FROM api_note LEFT JOIN api_university "
+    "ON api_university.id = api_note.university_id",
+    'INSERT INTO api_university_fts (rowid, name) SELECT id, name FROM api_university',
+]
+SQLITE_BACKWARD = [
+    'DROP TABLE IF EXISTS api_note_fts',
+    'DROP TABLE IF EXISTS api_university_fts',
+]
+
+
+def run_statements(postgres, sqlite):
+    def run(apps, schema_editor):
+        statements = {'postgresql': postgres, 'sqlite': sqlite}
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_userstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='university',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(
+            run_statements(POSTGRES_FORWARD, SQLITE_FORWARD),
+            run_statements(POSTGRES_BACKWARD, SQLITE_BACKWARD),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.0.2 on 2026-10-17 22:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_search_vectors'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['user', 'expires_at'], name='subscription_user_expires_idx'),
+        ),
+    ]
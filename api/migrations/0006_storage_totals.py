@@ -0,0 +1,28 @@
+# Generated by Django 3.0.2 on 2026-10-17 22:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_subscription_user_expires_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='total_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='notefile',
+            name='size_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userstats',
+            name='total_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
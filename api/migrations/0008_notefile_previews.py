@@ -0,0 +1,43 @@
+# Generated by Django 3.0.2 on 2026-10-17 23:01
+
+import api.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notefile',
+            name='preview',
+            field=models.ImageField(blank=True, editable=False, upload_to=api.models.preview_upload_path),
+        ),
+        migrations.AddField(
+            model_name='notefile',
+            name='preview_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='notefile',
+            name='preview_claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='notefile',
+            name='preview_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='notefile',
+            name='thumbnail',
+            field=models.ImageField(blank=True, editable=False, upload_to=api.models.preview_upload_path),
+        ),
+        migrations.AddIndex(
+            model_name='notefile',
+            index=models.Index(fields=['preview_status', 'id'], name='notefile_preview_queue_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.0.2 on 2026-10-17 23:04
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicate_universities(apps, schema_editor):
+    University = apps.get_model('api', 'University')
+    Note = apps.get_model('api', 'Note')
+    duplicates = (
+        University.objects.values('name')
+        .annotate(keep=Min('id'), count=Count('id'))
+        .filter(count__gt=1)
+    )
+    for duplicate in list(duplicates):
+        others = University.objects.filter(name=duplicate['name']).exclude(
+            pk=duplicate['keep']
+        )
+        Note.objects.filter(university__in=others).update(
+            university=duplicate['keep']
+        )
+        others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_notefile_previews'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_universities, migrations.RunPython.noop),
+    ]
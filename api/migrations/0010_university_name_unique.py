@@ -0,0 +1,18 @@
+# Generated by Django 3.0.2 on 2026-10-17 23:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_merge_duplicate_universities'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='university',
+            name='name',
+            field=models.CharField(max_length=200, unique=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.0.2 on 2026-10-17 23:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_university_name_unique'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['note', 'created_at', 'id'], name='comment_note_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(condition=models.Q(group__isnull=True), fields=['-created_at', '-id'], name='note_public_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(condition=models.Q(group__isnull=True), fields=['course', '-created_at', '-id'], name='note_public_course_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(condition=models.Q(group__isnull=True), fields=['university', '-created_at', '-id'], name='note_public_university_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['group', '-created_at', '-id'], name='note_group_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['author', '-created_at', '-id'], name='note_author_created_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 3.0.2 on 2026-10-17 23:07
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_favorite_counts(apps, schema_editor):
+    Note = apps.get_model('api', 'Note')
+    Favorite = apps.get_model('api', 'Favorite')
+    favorites = Favorite.objects.filter(note=OuterRef('pk')).order_by().values('note')
+    Note.objects.update(
+        favorite_count=Coalesce(
+            Subquery(favorites.annotate(value=Count('id')).values('value')), Value(0)
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='favorite_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_favorite_counts, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(condition=models.Q(group__isnull=True), fields=['-updated_at', '-id'], name='note_public_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(condition=models.Q(group__isnull=True), fields=['title', 'id'], name='note_public_title_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(condition=models.Q(group__isnull=True), fields=['-rating_avg', '-rating_count', '-id'], name='note_public_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(condition=models.Q(group__isnull=True), fields=['-favorite_count', '-id'], name='note_public_popularity_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.0.2 on 2026-10-17 23:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_note_sort_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='group',
+            name='members_version',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='notes_version',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='comments_version',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='files_version',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='ratings_version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
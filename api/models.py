@@ -1,4 +1,11 @@
+import threading
+import uuid
+from contextlib import contextmanager
+
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import Avg, Count, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 
@@ -11,21 +18,73 @@ def user_upload_path(instance, filename):
 
 
 class University(models.Model):
-    name = models.CharField(max_length=200)
+    name = models.CharField(max_length=200, unique=True)
+    search_vector = SearchVectorField(blank=True, null=True, editable=False)
 
     def __str__(self):
         return self.name
 
 
-class Group(models.Model):
+# Rows whose delete() is running, as (model, pk) pairs.
+_deleting = threading.local()
+
+
+@contextmanager
+def deleting(instance):
+    """
+    Mark `instance` as being deleted while the block runs, so receivers for
+    the rows deleted with it can skip totals that are deleted too.
+    """
+    key = (type(instance), instance.pk)
+    marked = getattr(_deleting, "keys", frozenset())
+    _deleting.keys = marked | {key}
+    try:
+        yield
+    finally:
+        _deleting.keys = marked
+
+
+def is_deleting(model, pk):
+    return (model, pk) in getattr(_deleting, "keys", ())
+
+
+class MaintainedFieldsMixin:
+    """
+    Leaves the columns named in `maintained_fields` out when saving an existing
+    row. They are kept up to date with UPDATE statements when related rows
+    change, so an instance loaded earlier must not write its copies back.
+    """
+
+    maintained_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = self.get_update_fields()
+        super().save(*args, **kwargs)
+
+    def get_update_fields(self):
+        return [
+            field.name
+            for field in self._meta.concrete_fields
+            if not field.primary_key and field.name not in self.maintained_fields
+        ]
+
+
+class Group(MaintainedFieldsMixin, models.Model):
     name = models.CharField(max_length=200)
     moderator = models.ForeignKey(User, on_delete=models.CASCADE)
+    notes_version = models.IntegerField(default=0)
+    members_version = models.IntegerField(default=0)
+
+    # Bumped with UPDATE statements whenever the group's notes or members
+    # change, so clients and caches can tell those collections are unchanged.
+    maintained_fields = ("notes_version", "members_version")
 
     def __str__(self):
         return self.name
 
 
-class Note(models.Model):
+class Note(MaintainedFieldsMixin, models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     title = models.CharField(max_length=50)
     university = models.ForeignKey(University, models.SET_NULL, blank=True, null=True)
@@ -33,33 +92,208 @@ class Note(models.Model):
     group = models.ForeignKey(Group, on_delete=models.CASCADE, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    rating_count = models.IntegerField(default=0)
+    rating_sum = models.FloatField(default=0)
+    rating_avg = models.FloatField(default=0)
+    search_vector = SearchVectorField(blank=True, null=True, editable=False)
+    total_bytes = models.BigIntegerField(default=0)
+    favorite_count = models.IntegerField(default=0)
+    comments_version = models.IntegerField(default=0)
+    ratings_version = models.IntegerField(default=0)
+    files_version = models.IntegerField(default=0)
+
+    class Meta:
+        # Listings are paginated newest first, on (created_at, id).
+        indexes = [
+            models.Index(
+                fields=["-created_at", "-id"],
+                name="note_public_created_idx",
+                condition=Q(group__isnull=True),
+            ),
+            models.Index(
+                fields=["course", "-created_at", "-id"],
+                name="note_public_course_idx",
+                condition=Q(group__isnull=True),
+            ),
+            models.Index(
+                fields=["university", "-created_at", "-id"],
+                name="note_public_university_idx",
+                condition=Q(group__isnull=True),
+            ),
+            models.Index(
+                fields=["-updated_at", "-id"],
+                name="note_public_updated_idx",
+                condition=Q(group__isnull=True),
+            ),
+            models.Index(
+                fields=["title", "id"],
+                name="note_public_title_idx",
+                condition=Q(group__isnull=True),
+            ),
+            models.Index(
+                fields=["-rating_avg", "-rating_count", "-id"],
+                name="note_public_rating_idx",
+                condition=Q(group__isnull=True),
+            ),
+            models.Index(
+                fields=["-favorite_count", "-id"],
+                name="note_public_popularity_idx",
+                condition=Q(group__isnull=True),
+            ),
+            models.Index(
+                fields=["group", "-created_at", "-id"], name="note_group_created_idx"
+            ),
+            models.Index(
+                fields=["author", "-created_at", "-id"], name="note_author_created_idx"
+            ),
+        ]
+
+    # Kept up to date with UPDATE statements when related rows change, so
+    # saving a note loaded earlier must not write its copies back.
+    maintained_fields = (
+        "rating_count",
+        "rating_sum",
+        "rating_avg",
+        "search_vector",
+        "total_bytes",
+        "favorite_count",
+        "comments_version",
+        "ratings_version",
+        "files_version",
+    )
+
+    def delete(self, *args, **kwargs):
+        # Its ratings are deleted with it and need not update its totals.
+        with deleting(self):
+            return super().delete(*args, **kwargs)
 
     def get_avg_rating(self):
-        ratings = Rating.objects.filter(note=self.id)
-        if len(ratings) == 0:
-            return 0
-        total = 0
-        for rating in ratings:
-            total += rating.score
-        return total / len(ratings)
+        return self.rating_avg
 
     def __str__(self):
         return self.title
 
 
-class NoteFile(models.Model):
+def rating_totals():
+    ratings = Rating.objects.filter(note=OuterRef("pk")).order_by().values("note")
+    return {
+        "rating_count": Coalesce(
+            Subquery(ratings.annotate(value=Count("id")).values("value")), Value(0)
+        ),
+        "rating_sum": Coalesce(
+            Subquery(ratings.annotate(value=Sum("score")).values("value")), Value(0.0)
+        ),
+        "rating_avg": Coalesce(
+            Subquery(ratings.annotate(value=Avg("score")).values("value")), Value(0.0)
+        ),
+    }
+
+
+def update_rating_totals(notes):
+    """Recompute rating_count, rating_sum and rating_avg of notes in SQL."""
+    return notes.update(**rating_totals())
+
+
+def preview_upload_path(instance, filename):
+    return "{0}/previews/{1}".format(instance.note_id, filename)
+
+
+class NoteFile(MaintainedFieldsMixin, models.Model):
+    PREVIEW_PENDING = "pending"
+    PREVIEW_PROCESSING = "processing"
+    PREVIEW_READY = "ready"
+    PREVIEW_FAILED = "failed"
+    PREVIEW_STATUSES = [
+        (PREVIEW_PENDING, "Pending"),
+        (PREVIEW_PROCESSING, "Processing"),
+        (PREVIEW_READY, "Ready"),
+        (PREVIEW_FAILED, "Failed"),
+    ]
+
     note = models.ForeignKey(Note, on_delete=models.CASCADE)
     index = models.IntegerField()
     file = models.FileField(upload_to=user_upload_path)
+    size_bytes = models.BigIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
+    thumbnail = models.ImageField(
+        upload_to=preview_upload_path, blank=True, editable=False
+    )
+    preview = models.ImageField(
+        upload_to=preview_upload_path, blank=True, editable=False
+    )
+    preview_status = models.CharField(
+        max_length=10, choices=PREVIEW_STATUSES, default=PREVIEW_PENDING
+    )
+    preview_attempts = models.PositiveSmallIntegerField(default=0)
+    preview_claimed_at = models.DateTimeField(null=True, blank=True)
+
+    # Written by the preview worker, so saving a file loaded earlier must not
+    # write its copies back unless the file itself changed.
+    maintained_fields = (
+        "thumbnail",
+        "preview",
+        "preview_status",
+        "preview_attempts",
+        "preview_claimed_at",
+    )
 
     class Meta:
         unique_together = ["note", "index"]
+        indexes = [
+            models.Index(
+                fields=["preview_status", "id"], name="notefile_preview_queue_idx"
+            )
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.file and not self.file._committed:
+            self.size_bytes = self.file.size
+            self.preview_status = self.PREVIEW_PENDING
+            self.preview_attempts = 0
+            self.preview_claimed_at = None
+        super().save(*args, **kwargs)
+
+    def get_update_fields(self):
+        # A new file resets its preview, so every column is written.
+        if self.file and not self.file._committed:
+            return None
+        return super().get_update_fields()
 
     def __str__(self):
         return self.title
 
 
+def bump_versions(queryset, *fields):
+    """Increment the version counters `fields` of every row in `queryset`."""
+    return queryset.update(**{field: F(field) + 1 for field in fields})
+
+
+def update_storage_totals(notes):
+    """Recompute total_bytes of notes from the sizes of their files in SQL."""
+    files = NoteFile.objects.filter(note=OuterRef("pk")).order_by().values("note")
+    return notes.update(
+        total_bytes=Coalesce(
+            Subquery(files.annotate(value=Sum("size_bytes")).values("value")),
+            Value(0),
+        )
+    )
+
+
+class UploadSession(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    note = models.ForeignKey(Note, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    index = models.IntegerField()
+    filename = models.CharField(max_length=100)
+    size = models.BigIntegerField()
+    received_bytes = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.filename
+
+
 class Rating(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     note = models.ForeignKey(Note, on_delete=models.CASCADE)
@@ -79,6 +313,13 @@ class Comment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["note", "created_at", "id"], name="comment_note_created_idx"
+            )
+        ]
+
     def __str__(self):
         return self.text
 
@@ -138,6 +379,87 @@ class Subscription(models.Model):
     starts_at = models.DateTimeField()
     expires_at = models.DateTimeField()
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["user", "expires_at"], name="subscription_user_expires_idx"
+            )
+        ]
+
     def is_active(self):
         current = timezone.now()
         return self.starts_at < current and current < self.expires_at
+
+
+class UserStats(models.Model):
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name="stats"
+    )
+    total_uploads = models.IntegerField(default=0)
+    total_favorite = models.IntegerField(default=0)
+    rating_count = models.IntegerField(default=0)
+    rating_sum = models.FloatField(default=0)
+    total_bytes = models.BigIntegerField(default=0)
+    premium_starts_at = models.DateTimeField(blank=True, null=True)
+    premium_expires_at = models.DateTimeField(blank=True, null=True)
+
+    def get_avg_rating(self):
+        if self.rating_count == 0:
+            return None
+        return self.rating_sum / self.rating_count
+
+    def is_premium(self):
+        if self.premium_starts_at is None or self.premium_expires_at is None:
+            return False
+        current = timezone.now()
+        return self.premium_starts_at < current and current < self.premium_expires_at
+
+    def __str__(self):
+        return "Stats for " + str(self.user)
+
+
+def user_stats_totals(*fields):
+    notes = Note.objects.filter(author=OuterRef("user")).order_by().values("author")
+    favorites = Favorite.objects.filter(user=OuterRef("user")).order_by().values("user")
+    subscriptions = Subscription.objects.filter(user=OuterRef("user")).order_by(
+        "-expires_at"
+    )
+    totals = {
+        "total_uploads": Coalesce(
+            Subquery(notes.annotate(value=Count("id")).values("value")), Value(0)
+        ),
+        "total_favorite": Coalesce(
+            Subquery(favorites.annotate(value=Count("id")).values("value")), Value(0)
+        ),
+        "rating_count": Coalesce(
+            Subquery(notes.annotate(value=Sum("rating_count")).values("value")),
+            Value(0),
+        ),
+        "rating_sum": Coalesce(
+            Subquery(notes.annotate(value=Sum("rating_sum")).values("value")),
+            Value(0.0),
+        ),
+        "total_bytes": Coalesce(
+            Subquery(notes.annotate(value=Sum("total_bytes")).values("value")),
+            Value(0),
+        ),
+        "premium_starts_at": Subquery(subscriptions.values("starts_at")[:1]),
+        "premium_expires_at": Subquery(subscriptions.values("expires_at")[:1]),
+    }
+    if fields:
+        return {field: totals[field] for field in fields}
+    return totals
+
+
+def update_user_stats(stats, *fields):
+    """Recompute the given UserStats fields (all of them by default) in SQL."""
+    return stats.update(**user_stats_totals(*fields))
+
+
+def rebuild_user_stats(users):
+    """Create missing UserStats rows for users and recompute all of them."""
+    missing = users.filter(stats__isnull=True).values_list("pk", flat=True)
+    UserStats.objects.bulk_create(
+        [UserStats(user_id=pk) for pk in missing], ignore_conflicts=True
+    )
+    return update_user_stats(UserStats.objects.filter(user__in=users))
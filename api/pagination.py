@@ -0,0 +1,142 @@
+import datetime
+import json
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import CursorPagination, _reverse_ordering
+
+# Sort keys accepted by `order_by`, each backed by an index and ending in an
+# id tiebreaker so KeysetPagination can page through it.
+NOTE_ORDERINGS = {
+    "newest": ("-created_at", "-id"),
+    "updated": ("-updated_at", "-id"),
+    "title": ("title", "id"),
+    "rating": ("-rating_avg", "-rating_count", "-id"),
+    "popularity": ("-favorite_count", "-id"),
+}
+UNIVERSITY_ORDERINGS = {
+    "name": ("name", "id"),
+}
+
+
+def order_by_param(queryset, request, orderings, default):
+    key = request.query_params.get("order_by", default)
+    if key not in orderings:
+        raise ValidationError(
+            {"order_by": ["Must be one of: {0}.".format(", ".join(orderings))]}
+        )
+    return queryset.order_by(*orderings[key])
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination over the full ordering of a queryset.
+
+    The cursor stores the value of every ordering field of the last row, and
+    an id tiebreaker is always appended, so each page is a single indexed
+    range query that stays stable when rows are inserted concurrently.
+
+    The ordering is taken from the queryset if the view ordered it, otherwise
+    from the view's `ordering` attribute, otherwise from this class.
+    """
+
+    page_size = 25
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    ordering = ("-created_at", "-id")
+
+    def get_ordering(self, request, queryset, view):
+        ordering = (
+            queryset.query.order_by or getattr(view, "ordering", None) or self.ordering
+        )
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        ordering = tuple(ordering)
+        if not {"id", "-id", "pk", "-pk"}.intersection(ordering):
+            ordering += ("-id",) if ordering[0].startswith("-") else ("id",)
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (offset, reverse, current_position) = (0, False, None)
+        else:
+            (offset, reverse, current_position) = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*_reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if current_position is not None:
+            queryset = queryset.filter(self.get_keyset_filter(current_position, reverse))
+
+        results = list(queryset[offset : offset + self.page_size + 1])
+        self.page = list(results[: self.page_size])
+
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(
+                results[-1], self.ordering
+            )
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = (current_position is not None) or (offset > 0)
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = (current_position is not None) or (offset > 0)
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def get_keyset_filter(self, position, reverse):
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        keyset = Q()
+        equal = Q()
+        for order, value in zip(self.ordering, values):
+            field = order.lstrip("-")
+            lookup = "__lt" if order.startswith("-") != reverse else "__gt"
+            keyset |= equal & Q(**{field + lookup: value})
+            equal &= Q(**{field: value})
+        return keyset
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+        for order in ordering:
+            value = instance
+            for attr in order.lstrip("-").split("__"):
+                value = value[attr] if isinstance(value, dict) else getattr(value, attr)
+            if hasattr(value, "pk"):
+                value = value.pk
+            if isinstance(value, (datetime.date, datetime.time)):
+                value = value.isoformat()
+            values.append(value)
+        return json.dumps(values)
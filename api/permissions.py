@@ -1,7 +1,6 @@
 from rest_framework import permissions
-from django.core.exceptions import ObjectDoesNotExist
+from .access import get_note, get_note_id, can_read_note
 from .models import (
-    Note,
     Rating,
     Membership,
     Group,
@@ -61,26 +60,8 @@ class IsAuthorOrModeratorOrReadOnly(permissions.BasePermission):
 
 class CanAccessNote(permissions.BasePermission):
     def has_permission(self, request, view):
-        note_id = view.kwargs.get("note_id")
-        if note_id is None:
-            note_id = view.kwargs.get("pk")
-        note = None
-        try:
-            note = Note.objects.get(pk=note_id)
-        except ObjectDoesNotExist:
-            return False
-        if note.author == request.user:
-            return True
-        if note.group is None:
-            return True
-        if request.user.is_anonymous:
-            return False
-        return (
-            Membership.objects.all()
-            .filter(user=request.user)
-            .filter(group=note.group)
-            .exists()
-        )
+        note = get_note(request, get_note_id(view))
+        return can_read_note(request.user, note)
 
 
 class CanAccessGroup(permissions.BasePermission):
@@ -144,9 +125,8 @@ class IsNoteAuthorOrReadOnly(permissions.BasePermission):
 
     def has_permission(self, request, view):
         if request.method == "POST":
-            note_id = view.kwargs["note_id"]
-            obj = Note.objects.get(pk=note_id)
-            return obj.author == request.user
+            note = get_note(request, view.kwargs["note_id"])
+            return note is not None and note.author_id == request.user.id
         return True
 
 
@@ -204,25 +184,11 @@ class AlreadyPostedCommentReport(permissions.BasePermission):
 
 class CanAccessFavorite(permissions.BasePermission):
     def has_permission(self, request, view):
-        note_id = view.kwargs.get("note_id")
-        if note_id is None:
-            note_id = view.kwargs.get("pk")
-        note = None
-        try:
-            note = Note.objects.get(pk=note_id)
-        except ObjectDoesNotExist:
+        note = get_note(request, get_note_id(view))
+        if note is None:
             return False
-        if note.author == request.user:
-            return True
-        if note.group is None:
+        if can_read_note(request.user, note):
             return True
         if request.user.is_anonymous:
             return False
-        is_member = (
-            Membership.objects.all()
-            .filter(user=request.user)
-            .filter(group=note.group)
-            .exists()
-        )
-        is_get = request.method == "GET"
-        return is_member or is_get
+        return request.method == "GET"
@@ -0,0 +1,71 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from .localcache import LocalCache
+from .models import Subscription
+
+CACHE_KEY = "premium:{0}"
+SHARED_CACHE_TTL = getattr(settings, "NOTEHUB_PREMIUM_SHARED_CACHE_TTL", 3600)
+
+# User id -> premium flag. Entries expire when the subscription that made the
+# user premium runs out, or when the next one starts, so the status is never
+# reported past the point it changes.
+local_cache = LocalCache(
+    getattr(settings, "NOTEHUB_PREMIUM_CACHE_SIZE", 10000),
+    getattr(settings, "NOTEHUB_PREMIUM_CACHE_TTL", 60),
+)
+
+
+def get_shared_cache():
+    # Optionally share entries between workers through one of Django's caches,
+    # e.g. NOTEHUB_PREMIUM_CACHE = "default" with a Redis or memcached backend.
+    alias = getattr(settings, "NOTEHUB_PREMIUM_CACHE", None)
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def load_premium(user_id):
+    """
+    Return (premium, until) for a user: whether a subscription is active, and
+    when that changes, i.e. when the active subscription expires or the next
+    one starts.
+    """
+    now = timezone.now()
+    subscriptions = Subscription.objects.filter(
+        user=user_id, expires_at__gt=now
+    ).values_list("starts_at", "expires_at")
+    active = [expires_at for starts_at, expires_at in subscriptions if starts_at < now]
+    if active:
+        return True, max(active).timestamp()
+    upcoming = [starts_at for starts_at, expires_at in subscriptions]
+    if upcoming:
+        return False, min(upcoming).timestamp()
+    return False, float("inf")
+
+
+def is_premium(user):
+    if user.is_anonymous:
+        return False
+    premium = local_cache.get(user.id)
+    if premium is not None:
+        return premium
+    shared = get_shared_cache()
+    entry = shared.get(CACHE_KEY.format(user.id)) if shared is not None else None
+    if entry is None or entry[1] <= time.time():
+        entry = load_premium(user.id)
+        if shared is not None:
+            timeout = min(entry[1] - time.time(), SHARED_CACHE_TTL)
+            shared.set(CACHE_KEY.format(user.id), entry, timeout)
+    local_cache.set(user.id, *entry)
+    return entry[0]
+
+
+def invalidate_premium(user_id):
+    local_cache.delete(user_id)
+    shared = get_shared_cache()
+    if shared is not None:
+        shared.delete(CACHE_KEY.format(user_id))
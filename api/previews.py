@@ -0,0 +1,199 @@
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db.models import F, Q
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import Note, NoteFile, bump_versions
+from .uploads import get_extension
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = getattr(settings, "NOTEHUB_THUMBNAIL_SIZE", (256, 256))
+PREVIEW_SIZE = getattr(settings, "NOTEHUB_PREVIEW_SIZE", (1024, 1024))
+JPEG_QUALITY = 80
+MAX_ATTEMPTS = 3
+PDF_RENDER_TIMEOUT = 60
+# A claim older than this belongs to a worker that died mid-job.
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+class PreviewError(Exception):
+    pass
+
+
+def open_first_page(note_file):
+    extension = get_extension(note_file.file.name)
+    if extension == "pdf":
+        return render_pdf_page(note_file)
+    with note_file.file.open("rb") as file:
+        image = Image.open(file)
+        # JPEG can decode straight at a fraction of the full resolution.
+        image.draft("RGB", PREVIEW_SIZE)
+        image.load()
+    # Phone photos of notes are usually stored sideways with an EXIF rotation.
+    return ImageOps.exif_transpose(image)
+
+
+def render_pdf_page(note_file):
+    """Rasterize the first page of a PDF with poppler's pdftoppm."""
+    pdftoppm = shutil.which(getattr(settings, "NOTEHUB_PDFTOPPM", "pdftoppm"))
+    if pdftoppm is None:
+        raise PreviewError("pdftoppm is not installed.")
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "source.pdf")
+        with note_file.file.open("rb") as file, open(source, "wb") as copy:
+            shutil.copyfileobj(file, copy)
+        output = os.path.join(directory, "page")
+        command = [
+            pdftoppm,
+            "-f",
+            "1",
+            "-l",
+            "1",
+            "-singlefile",
+            "-png",
+            "-scale-to",
+            str(max(PREVIEW_SIZE)),
+            source,
+            output,
+        ]
+        try:
+            subprocess.run(
+                command,
+                check=True,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                timeout=PDF_RENDER_TIMEOUT,
+            )
+        except (OSError, subprocess.SubprocessError) as error:
+            raise PreviewError("Could not render PDF: {0}".format(error))
+        image = Image.open(output + ".png")
+        image.load()
+    return image
+
+
+def encode_jpeg(image, size):
+    image = image.copy()
+    image.thumbnail(size, Image.LANCZOS)
+    if image.mode != "RGB":
+        background = Image.new("RGB", image.size, "white")
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background.paste(image, mask=image.split()[-1])
+        else:
+            background.paste(image.convert("RGB"))
+        image = background
+    buffer = BytesIO()
+    image.save(buffer, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return image, ContentFile(buffer.getvalue())
+
+
+def render_previews(note_file):
+    """
+    Render and store the preview and thumbnail of a claimed note file, and
+    remove the ones they replace. Returns False if the file was replaced
+    while rendering, in which case the new file gets its own job.
+    """
+    old_names = [note_file.thumbnail.name, note_file.preview.name]
+    name = os.path.splitext(os.path.basename(note_file.file.name))[0]
+    preview, content = encode_jpeg(open_first_page(note_file), PREVIEW_SIZE)
+    note_file.preview.save(name + ".preview.jpg", content, save=False)
+    thumbnail, content = encode_jpeg(preview, THUMBNAIL_SIZE)
+    note_file.thumbnail.save(name + ".thumb.jpg", content, save=False)
+
+    rendered = [note_file.thumbnail.name, note_file.preview.name]
+    updated = NoteFile.objects.filter(
+        pk=note_file.pk,
+        file=note_file.file.name,
+        preview_status=NoteFile.PREVIEW_PROCESSING,
+    ).update(
+        thumbnail=note_file.thumbnail.name,
+        preview=note_file.preview.name,
+        preview_status=NoteFile.PREVIEW_READY,
+        preview_claimed_at=None,
+    )
+    if updated:
+        bump_versions(Note.objects.filter(pk=note_file.note_id), "files_version")
+    storage = note_file.thumbnail.storage
+    for name in old_names if updated else rendered:
+        if name:
+            storage.delete(name)
+    return bool(updated)
+
+
+def delete_previews(note_file):
+    for field_file in (note_file.thumbnail, note_file.preview):
+        if field_file:
+            field_file.storage.delete(field_file.name)
+
+
+def claimable():
+    stale = timezone.now() - CLAIM_TIMEOUT
+    return Q(preview_status=NoteFile.PREVIEW_PENDING) | Q(
+        preview_status=NoteFile.PREVIEW_PROCESSING, preview_claimed_at__lt=stale
+    )
+
+
+def claim_next():
+    """
+    Claim the oldest pending note file with a conditional UPDATE, so several
+    workers can share the queue without a broker or row locks.
+    """
+    while True:
+        pk = (
+            NoteFile.objects.filter(claimable())
+            .order_by("id")
+            .values_list("id", flat=True)
+            .first()
+        )
+        if pk is None:
+            return None
+        claimed = NoteFile.objects.filter(claimable(), pk=pk).update(
+            preview_status=NoteFile.PREVIEW_PROCESSING,
+            preview_claimed_at=timezone.now(),
+            preview_attempts=F("preview_attempts") + 1,
+        )
+        if claimed:
+            return NoteFile.objects.get(pk=pk)
+
+
+def process_next():
+    """Render previews for one queued note file. Returns False when idle."""
+    note_file = claim_next()
+    if note_file is None:
+        return False
+    try:
+        render_previews(note_file)
+    except Exception as error:
+        logger.exception("Could not render previews of note file %s", note_file.pk)
+        # PreviewError means retrying will not help, e.g. pdftoppm is missing.
+        status = NoteFile.PREVIEW_PENDING
+        if isinstance(error, PreviewError):
+            status = NoteFile.PREVIEW_FAILED
+        elif note_file.preview_attempts >= MAX_ATTEMPTS:
+            status = NoteFile.PREVIEW_FAILED
+        NoteFile.objects.filter(
+            pk=note_file.pk, preview_status=NoteFile.PREVIEW_PROCESSING
+        ).update(preview_status=status, preview_claimed_at=None)
+        if status == NoteFile.PREVIEW_FAILED:
+            notes = Note.objects.filter(pk=note_file.note_id)
+            bump_versions(notes, "files_version")
+    return True
+
+
+def process_pending(limit=None):
+    processed = 0
+    while limit is None or processed < limit:
+        if not process_next():
+            break
+        processed += 1
+    return processed
@@ -0,0 +1,124 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.expressions import RawSQL
+
+from .models import Note, University
+
+SEARCH_CONFIG = "simple"
+MAX_TERMS = 8
+
+
+def get_terms(query):
+    return re.findall(r"\w+", query.lower())[:MAX_TERMS]
+
+
+class PostgresSearchBackend:
+    """
+    Ranked prefix search over the `search_vector` tsvector columns, which are
+    backed by GIN indexes. Note titles weigh more than courses, and courses
+    more than university names.
+    """
+
+    def index_notes(self, notes):
+        university_name = University.objects.filter(pk=OuterRef("university")).values(
+            "name"
+        )
+        notes.update(
+            search_vector=SearchVector("title", weight="A", config=SEARCH_CONFIG)
+            + SearchVector("course", weight="B", config=SEARCH_CONFIG)
+            + SearchVector(Subquery(university_name), weight="C", config=SEARCH_CONFIG)
+        )
+
+    def index_universities(self, universities):
+        universities.update(search_vector=SearchVector("name", config=SEARCH_CONFIG))
+
+    def remove(self, model, ids):
+        pass
+
+    def search(self, queryset, query):
+        terms = get_terms(query)
+        if not terms:
+            return queryset.none()
+        search_query = SearchQuery(
+            " & ".join(term + ":*" for term in terms),
+            search_type="raw",
+            config=SEARCH_CONFIG,
+        )
+        return (
+            queryset.filter(search_vector=search_query)
+            .annotate(rank=SearchRank(F("search_vector"), search_query))
+            .order_by("-rank", "-id")
+        )
+
+
+class SqliteSearchBackend:
+    """
+    Ranked prefix search over FTS5 tables whose rowid is the id of the indexed
+    row, used for local development on SQLite.
+    """
+
+    tables = {
+        Note: ("api_note_fts", ("title", "course", "university"), (10.0, 5.0, 1.0)),
+        University: ("api_university_fts", ("name",), (1.0,)),
+    }
+
+    def replace(self, model, rows):
+        table, columns, weights = self.tables[model]
+        rows = list(rows)
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "DELETE FROM {0} WHERE rowid = %s".format(table),
+                [(row[0],) for row in rows],
+            )
+            cursor.executemany(
+                "INSERT INTO {0} (rowid, {1}) VALUES (%s, {2})".format(
+                    table, ", ".join(columns), ", ".join(["%s"] * len(columns))
+                ),
+                [[value or "" for value in row] for row in rows],
+            )
+
+    def index_notes(self, notes):
+        self.replace(
+            Note, notes.values_list("id", "title", "course", "university__name")
+        )
+
+    def index_universities(self, universities):
+        self.replace(University, universities.values_list("id", "name"))
+
+    def remove(self, model, ids):
+        table = self.tables[model][0]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "DELETE FROM {0} WHERE rowid = %s".format(table),
+                [(pk,) for pk in ids],
+            )
+
+    def search(self, queryset, query):
+        terms = get_terms(query)
+        if not terms:
+            return queryset.none()
+        table, columns, weights = self.tables[queryset.model]
+        match = " ".join('"{0}"*'.format(term) for term in terms)
+        matches = RawSQL(
+            "SELECT rowid FROM {0} WHERE {0} MATCH %s".format(table), (match,)
+        )
+        rank = RawSQL(
+            "SELECT bm25({0}, {1}) FROM {0} WHERE {0} MATCH %s AND rowid = {2}.id".format(
+                table,
+                ", ".join(str(weight) for weight in weights),
+                queryset.model._meta.db_table,
+            ),
+            (match,),
+        )
+        return (
+            queryset.filter(id__in=matches).annotate(rank=rank).order_by("rank", "-id")
+        )
+
+
+def get_search_backend():
+    if connection.vendor == "postgresql":
+        return PostgresSearchBackend()
+    return SqliteSearchBackend()
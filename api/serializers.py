@@ -4,6 +4,8 @@ from django.core.validators import (
     MaxValueValidator,
     DecimalValidator,
 )
+from django.db import transaction
+from django.urls import reverse
 from rest_framework.validators import UniqueTogetherValidator
 from .models import (
     Note,
@@ -18,7 +20,12 @@ from .models import (
     NoteReport,
     CommentReport,
     Subscription,
+    UploadSession,
+    UserStats,
+    rebuild_user_stats,
 )
+from .avatars import AvatarError, get_avatar_urls, set_avatar
+from .uploads import FILE_SIGNATURES, get_extension
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 
@@ -30,30 +37,34 @@ class UserSerializer(serializers.ModelSerializer):
     total_uploads = serializers.SerializerMethodField(method_name="get_total_uploads")
     avg_rating = serializers.SerializerMethodField(method_name="get_avg_rating")
     total_favorite = serializers.SerializerMethodField(method_name="get_total_favorite")
+    avatars = serializers.SerializerMethodField(method_name="get_avatar_urls")
+
+    def get_stats(self, obj):
+        try:
+            return obj.stats
+        except UserStats.DoesNotExist:
+            rebuild_user_stats(User.objects.filter(pk=obj.pk))
+            obj.stats = UserStats.objects.get(user=obj)
+            return obj.stats
 
     def check_is_premium(self, obj):
-        subscriptions = Subscription.objects.filter(user=obj)
-        for subscription in subscriptions:
-            if subscription.is_active():
-                return True
-        return False
+        return self.get_stats(obj).is_premium()
 
     def get_total_uploads(self, obj):
-        notes = Note.objects.filter(author=obj)
-        return notes.count()
+        return self.get_stats(obj).total_uploads
 
     def get_avg_rating(self, obj):
-        ratings = Rating.objects.filter(note__author=obj)
-        if ratings.count() == 0:
-            return None
-        total = 0
-        for rating in ratings:
-            total += rating.score
-        return total/ratings.count()
+        return self.get_stats(obj).get_avg_rating()
 
     def get_total_favorite(self, obj):
-        favorites = Favorite.objects.filter(user=obj)
-        return favorites.count()
+        return self.get_stats(obj).total_favorite
+
+    def get_avatar_urls(self, obj):
+        urls = get_avatar_urls(obj.avatar)
+        request = self.context.get("request")
+        if urls is None or request is None:
+            return urls
+        return {size: request.build_absolute_uri(url) for size, url in urls.items()}
 
     class Meta:
         model = User
@@ -64,6 +75,7 @@ class UserSerializer(serializers.ModelSerializer):
             "last_name",
             "username",
             "avatar",
+            "avatars",
             "is_premium",
             "total_uploads",
             "avg_rating",
@@ -72,18 +84,32 @@ class UserSerializer(serializers.ModelSerializer):
         ]
         extra_kwargs = {"password": {"write_only": True}}
 
+    @transaction.atomic
     def create(self, data):
+        # An avatar that cannot be rendered rolls the new account back.
         user = User(
             email=data["email"],
             first_name=data["first_name"],
             last_name=data["last_name"],
             username=data["username"],
-            avatar=data.get("avatar"),
         )
         user.set_password(data["password"])
         user.save()
+        if data.get("avatar"):
+            self.set_avatar(user, data["avatar"])
         return user
 
+    def update(self, instance, data):
+        if "avatar" in data:
+            self.set_avatar(instance, data.pop("avatar"))
+        return super().update(instance, data)
+
+    def set_avatar(self, user, file):
+        try:
+            set_avatar(user, file)
+        except AvatarError as error:
+            raise serializers.ValidationError({"avatar": [str(error)]})
+
 
 class UpdateUserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -101,37 +127,63 @@ class UpdatePasswordSerializer(serializers.Serializer):
     new_password = serializers.CharField(max_length=50)
 
 
+class RefreshTokenSerializer(serializers.Serializer):
+    refresh = serializers.CharField()
+
+
 class UploadAvatarSerializer(serializers.Serializer):
     model = User
     new_avatar = serializers.ImageField()
 
 
+def get_rated_notes(user, notes):
+    """Return the ids of those of `notes` (or note ids) `user` has rated."""
+    if user.is_anonymous:
+        return set()
+    return set(
+        Rating.objects.filter(author=user, note__in=notes).values_list(
+            "note_id", flat=True
+        )
+    )
+
+
+class NoteListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        notes = list(data.all() if hasattr(data, "all") else data)
+        user = self.context["request"].user
+        if not user.is_anonymous:
+            self.context["rated_notes"] = get_rated_notes(user, notes)
+        return super().to_representation(notes)
+
+
 class NoteSerializer(serializers.ModelSerializer):
     author = serializers.HiddenField(default="author.id")
     author_username = serializers.ReadOnlyField(source="author.username")
     university_name = serializers.ReadOnlyField(source="university.name")
     group = serializers.ReadOnlyField(source="group.id")
     group_name = serializers.ReadOnlyField(source="group.name")
-    avg_rating = serializers.ReadOnlyField(source="get_avg_rating")
+    avg_rating = serializers.ReadOnlyField(source="rating_avg")
     is_author = serializers.SerializerMethodField(method_name="check_is_author")
     is_moderator = serializers.SerializerMethodField(method_name="check_is_moderator")
     has_rated = serializers.SerializerMethodField(method_name="check_has_rated")
 
     def check_is_author(self, obj):
         user = self.context["request"].user
-        return user == obj.author
+        return user.id == obj.author_id
 
     def check_is_moderator(self, obj):
         user = self.context["request"].user
-        if obj.group is None:
-            return False;
-        group = Group.objects.get(pk=obj.group.pk)
-        return user == group.moderator
+        if obj.group_id is None:
+            return False
+        return user.id == obj.group.moderator_id
 
     def check_has_rated(self, obj):
         user = self.context["request"].user
         if user.is_anonymous:
             return False
+        rated_notes = self.context.get("rated_notes")
+        if rated_notes is not None:
+            return obj.id in rated_notes
         return Rating.objects.filter(note=obj.id).filter(author=user).exists()
 
     class Meta:
@@ -150,14 +202,43 @@ class NoteSerializer(serializers.ModelSerializer):
             "group_name",
             "is_author",
             "is_moderator",
+            "comments_version",
+            "ratings_version",
+            "files_version",
             "created_at",
             "updated_at",
         ]
+        read_only_fields = ["comments_version", "ratings_version", "files_version"]
         extra_kwargs = {"university": {"write_only": True}}
+        list_serializer_class = NoteListSerializer
 
 
 class NoteFileSerializer(serializers.ModelSerializer):
     note = serializers.ReadOnlyField(source="note.id")
+    content = serializers.SerializerMethodField(method_name="get_content_url")
+    thumbnail = serializers.SerializerMethodField(method_name="get_thumbnail_url")
+    preview = serializers.SerializerMethodField(method_name="get_preview_url")
+
+    def build_url(self, name, obj):
+        url = reverse(name, args=[obj.note_id, obj.index])
+        request = self.context.get("request")
+        if request is None:
+            return url
+        return request.build_absolute_uri(url)
+
+    def get_content_url(self, obj):
+        return self.build_url("note-file-content", obj)
+
+    # Previews are rendered in the background, so they are null until ready.
+    def get_thumbnail_url(self, obj):
+        if obj.preview_status != NoteFile.PREVIEW_READY:
+            return None
+        return self.build_url("note-file-thumbnail", obj)
+
+    def get_preview_url(self, obj):
+        if obj.preview_status != NoteFile.PREVIEW_READY:
+            return None
+        return self.build_url("note-file-preview", obj)
 
     class Meta:
         model = NoteFile
@@ -165,13 +246,51 @@ class NoteFileSerializer(serializers.ModelSerializer):
             "note",
             "index",
             "file",
+            "content",
+            "thumbnail",
+            "preview",
+            "preview_status",
             "created_at",
         ]
+        read_only_fields = ["preview_status"]
+        # Files are only served through `content`, which checks access.
         extra_kwargs = {
-            "file": {"validators": [FileExtensionValidator(["pdf", "png", "jpg"])],}
+            "file": {
+                "validators": [FileExtensionValidator(["pdf", "png", "jpg"])],
+                "write_only": True,
+            }
         }
 
 
+class UploadSessionSerializer(serializers.ModelSerializer):
+    note = serializers.ReadOnlyField(source="note.id")
+
+    def validate_filename(self, value):
+        if get_extension(value) not in FILE_SIGNATURES:
+            raise serializers.ValidationError(
+                "File extension must be one of: {0}.".format(", ".join(FILE_SIGNATURES))
+            )
+        return value
+
+    def validate_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Size must be positive.")
+        return value
+
+    class Meta:
+        model = UploadSession
+        fields = [
+            "id",
+            "note",
+            "index",
+            "filename",
+            "size",
+            "received_bytes",
+            "created_at",
+        ]
+        read_only_fields = ["received_bytes"]
+
+
 class UniversitySerializer(serializers.ModelSerializer):
     class Meta:
         model = University
@@ -201,7 +320,7 @@ class RatingSerializer(serializers.ModelSerializer):
 
 
 class CommentSerializer(serializers.ModelSerializer):
-    note = serializers.ReadOnlyField(source="note.id")
+    note = serializers.ReadOnlyField(source="note_id")
     author = serializers.HiddenField(default="author.id")
     username = serializers.ReadOnlyField(source="author.username")
     is_author = serializers.SerializerMethodField(method_name="check_if_author")
@@ -231,9 +350,12 @@ class GroupSerializer(serializers.ModelSerializer):
 
     def check_if_moderator(self, obj):
         user = self.context["request"].user
-        return user == obj.moderator
+        return user.id == obj.moderator_id
 
     def get_membership_id(self, obj):
+        # SelfGroupView annotates the id of the user's membership.
+        if hasattr(obj, "user_membership_id"):
+            return obj.user_membership_id
         user = self.context["request"].user
         membership = Membership.objects.filter(group=obj).filter(user=user)
         if membership.exists():
@@ -249,7 +371,10 @@ class GroupSerializer(serializers.ModelSerializer):
             "moderator_username",
             "membership_id",
             "is_moderator",
+            "notes_version",
+            "members_version",
         ]
+        read_only_fields = ["notes_version", "members_version"]
 
 
 class MembershipSerializer(serializers.ModelSerializer):
@@ -265,8 +390,7 @@ class MembershipSerializer(serializers.ModelSerializer):
         return user == obj.user
 
     def get_role(self, obj):
-        moderator = Group.objects.get(pk=obj.group.id).moderator
-        is_moderator = obj.user == moderator
+        is_moderator = obj.user_id == obj.group.moderator_id
         if is_moderator:
             return "Moderator"
         else:
@@ -293,7 +417,7 @@ class InvitationSerializer(serializers.ModelSerializer):
     moderator_username = serializers.SerializerMethodField(method_name="get_moderator")
 
     def get_moderator(self, obj):
-        return Group.objects.get(pk=obj.group.id).moderator.username
+        return obj.group.moderator.username
 
     class Meta:
         model = Invitation
@@ -0,0 +1,226 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_init, post_save, post_delete, pre_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .models import (
+    Comment,
+    Group,
+    Invitation,
+    Membership,
+    Note,
+    NoteFile,
+    University,
+    Rating,
+    Favorite,
+    Subscription,
+    UserStats,
+    bump_versions,
+    is_deleting,
+    update_rating_totals,
+    update_user_stats,
+)
+from .authentication import invalidate_token, invalidate_user
+from .autocomplete import invalidate_university_index
+from .premium import invalidate_premium
+from .previews import delete_previews
+from .search import get_search_backend
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=User)
+def user_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=User)
+def user_updated(sender, instance, created, raw=False, **kwargs):
+    # Cached token users are snapshots of is_active and token_generation.
+    if not created and not raw:
+        invalidate_user(instance.pk)
+        transaction.on_commit(lambda: invalidate_user(instance.pk))
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+    transaction.on_commit(lambda: invalidate_token(instance.key))
+
+
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def rating_changed(sender, instance, **kwargs):
+    if is_deleting(Note, instance.note_id):
+        return
+    update_rating_totals(Note.objects.filter(pk=instance.note_id))
+    update_user_stats(
+        UserStats.objects.filter(user__note=instance.note_id),
+        "rating_count",
+        "rating_sum",
+    )
+    bump_versions(Note.objects.filter(pk=instance.note_id), "ratings_version")
+    # Group note listings show the average rating.
+    bump_versions(Group.objects.filter(note=instance.note_id), "notes_version")
+
+
+def bump_group_notes_version(instance):
+    # Group note listings show the notes' comment and file versions. Views
+    # attach the note they checked access to, which saves a join. Deleting the
+    # note bumps its group once.
+    if is_deleting(Note, instance.note_id):
+        return
+    if type(instance).note.is_cached(instance):
+        if instance.note.group_id is None:
+            return
+        groups = Group.objects.filter(pk=instance.note.group_id)
+    else:
+        groups = Group.objects.filter(note=instance.note_id)
+    bump_versions(groups, "notes_version")
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_changed(sender, instance, **kwargs):
+    bump_versions(Note.objects.filter(pk=instance.note_id), "comments_version")
+    bump_group_notes_version(instance)
+
+
+@receiver(post_save, sender=Note)
+def note_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    get_search_backend().index_notes(Note.objects.filter(pk=instance.pk))
+    if instance.group_id is not None:
+        bump_versions(Group.objects.filter(pk=instance.group_id), "notes_version")
+    if created:
+        UserStats.objects.filter(user=instance.author_id).update(
+            total_uploads=F("total_uploads") + 1
+        )
+
+
+@receiver(post_delete, sender=Note)
+def note_deleted(sender, instance, **kwargs):
+    get_search_backend().remove(Note, [instance.pk])
+    if instance.group_id is not None:
+        bump_versions(Group.objects.filter(pk=instance.group_id), "notes_version")
+    UserStats.objects.filter(user=instance.author_id).update(
+        total_uploads=F("total_uploads") - 1
+    )
+    update_user_stats(
+        UserStats.objects.filter(user=instance.author_id),
+        "rating_count",
+        "rating_sum",
+        "total_bytes",
+    )
+
+
+def add_note_bytes(note_id, size):
+    if size == 0:
+        return
+    Note.objects.filter(pk=note_id).update(total_bytes=F("total_bytes") + size)
+    UserStats.objects.filter(user__note=note_id).update(
+        total_bytes=F("total_bytes") + size
+    )
+
+
+@receiver(post_init, sender=NoteFile)
+def note_file_loaded(sender, instance, **kwargs):
+    instance._saved_size_bytes = instance.size_bytes if instance.pk else 0
+
+
+@receiver(post_save, sender=NoteFile)
+def note_file_saved(sender, instance, created, **kwargs):
+    previous = 0 if created else instance._saved_size_bytes
+    add_note_bytes(instance.note_id, instance.size_bytes - previous)
+    instance._saved_size_bytes = instance.size_bytes
+    bump_versions(Note.objects.filter(pk=instance.note_id), "files_version")
+    bump_group_notes_version(instance)
+
+
+@receiver(post_delete, sender=NoteFile)
+def note_file_deleted(sender, instance, **kwargs):
+    add_note_bytes(instance.note_id, -instance._saved_size_bytes)
+    bump_versions(Note.objects.filter(pk=instance.note_id), "files_version")
+    bump_group_notes_version(instance)
+    transaction.on_commit(lambda: delete_previews(instance))
+
+
+@receiver(post_save, sender=Favorite)
+def favorite_saved(sender, instance, created, **kwargs):
+    if created:
+        UserStats.objects.filter(user=instance.user_id).update(
+            total_favorite=F("total_favorite") + 1
+        )
+        Note.objects.filter(pk=instance.note_id).update(
+            favorite_count=F("favorite_count") + 1
+        )
+        bump_versions(Group.objects.filter(note=instance.note_id), "notes_version")
+
+
+@receiver(post_delete, sender=Favorite)
+def favorite_deleted(sender, instance, **kwargs):
+    UserStats.objects.filter(user=instance.user_id).update(
+        total_favorite=F("total_favorite") - 1
+    )
+    Note.objects.filter(pk=instance.note_id).update(
+        favorite_count=F("favorite_count") - 1
+    )
+    bump_versions(Group.objects.filter(note=instance.note_id), "notes_version")
+
+
+@receiver(post_save, sender=Membership)
+@receiver(post_delete, sender=Membership)
+@receiver(post_save, sender=Invitation)
+@receiver(post_delete, sender=Invitation)
+def member_changed(sender, instance, **kwargs):
+    bump_versions(Group.objects.filter(pk=instance.group_id), "members_version")
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, **kwargs):
+    if not created:
+        # Note and member listings show the group's name and moderator.
+        groups = Group.objects.filter(pk=instance.pk)
+        bump_versions(groups, "notes_version", "members_version")
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def subscription_changed(sender, instance, **kwargs):
+    invalidate_premium(instance.user_id)
+    transaction.on_commit(lambda: invalidate_premium(instance.user_id))
+    update_user_stats(
+        UserStats.objects.filter(user=instance.user_id),
+        "premium_starts_at",
+        "premium_expires_at",
+    )
+
+
+@receiver(post_save, sender=University)
+def university_saved(sender, instance, **kwargs):
+    backend = get_search_backend()
+    backend.index_universities(University.objects.filter(pk=instance.pk))
+    backend.index_notes(Note.objects.filter(university=instance.pk))
+    bump_versions(Group.objects.filter(note__university=instance.pk), "notes_version")
+    transaction.on_commit(invalidate_university_index)
+
+
+@receiver(pre_delete, sender=University)
+def university_deleting(sender, instance, **kwargs):
+    instance._note_ids = list(
+        Note.objects.filter(university=instance.pk).values_list("pk", flat=True)
+    )
+
+
+@receiver(post_delete, sender=University)
+def university_deleted(sender, instance, **kwargs):
+    backend = get_search_backend()
+    backend.remove(University, [instance.pk])
+    note_ids = getattr(instance, "_note_ids", [])
+    backend.index_notes(Note.objects.filter(pk__in=note_ids))
+    bump_versions(Group.objects.filter(note__in=note_ids), "notes_version")
+    transaction.on_commit(invalidate_university_index)
@@ -1,3 +1,1454 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APIRequestFactory
+from django.contrib.auth import get_user_model
+
+from .models import (
+    Comment,
+    Favorite,
+    Group,
+    Membership,
+    Note,
+    NoteFile,
+    NoteReport,
+    Rating,
+    Subscription,
+    University,
+    UploadSession,
+    UserStats,
+)
+from .asgi import NoteHubASGIHandler, RequestThreads, ThreadPool, gather
+from .benchmarks import (
+    benchmark_settings,
+    check_results,
+    load_baseline,
+    run_benchmarks,
+    seed,
+)
+from .authentication import local_cache as token_cache
+from .premium import is_premium, local_cache
+from .metrics import registry as metrics_registry
+from .previews import process_pending
+from .throttling import local_buckets as throttle_buckets, lock as throttle_lock
+from .uploads import get_upload_path, read_chunk
+
+User = get_user_model()
+
+
+def create_user(username):
+    return User.objects.create_user(
+        username=username, email=username + "@example.com", password="password"
+    )
+
+
+class RatingTotalsTests(TestCase):
+    def setUp(self):
+        self.author = create_user("author")
+        self.rater = create_user("rater")
+        self.note = Note.objects.create(author=self.author, title="Note", course="CS")
+        self.client = APIClient()
+        self.client.force_authenticate(self.rater)
+
+    def test_totals_follow_rating_changes(self):
+        url = "/api/notes/{0}/ratings/".format(self.note.id)
+        response = self.client.post(url, {"score": 4}, format="json")
+        self.assertEqual(response.status_code, 201)
+        Rating.objects.create(author=self.author, note=self.note, score=2)
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.rating_count, 2)
+        self.assertEqual(self.note.rating_avg, 3)
+
+        url += "{0}/".format(response.data["id"])
+        self.client.patch(url, {"score": 5}, format="json")
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.rating_sum, 7)
+
+        self.client.delete(url)
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.rating_count, 1)
+        self.assertEqual(self.note.rating_avg, 2)
+
+    def test_deletes_skip_totals_deleted_with_them(self):
+        other = Note.objects.create(author=self.author, title="Other", course="CS")
+        Rating.objects.create(author=self.author, note=self.note, score=2)
+        Rating.objects.create(author=self.rater, note=self.note, score=4)
+        Rating.objects.create(author=self.rater, note=other, score=4)
+        Rating.objects.create(author=self.author, note=other, score=1)
+        with mock.patch("api.signals.update_rating_totals") as update:
+            self.note.delete()
+        update.assert_not_called()
+        self.assertEqual(UserStats.objects.get(user=self.author).rating_count, 2)
+
+        self.rater.delete()
+        other.refresh_from_db()
+        self.assertEqual((other.rating_count, other.rating_avg), (1, 1))
+
+        # A failed delete leaves no mark on the note.
+        with mock.patch("django.db.models.Model.delete", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                other.delete()
+        Rating.objects.filter(note=other).delete()
+        other.refresh_from_db()
+        self.assertEqual(other.rating_count, 0)
+
+    def test_check_command_detects_and_fixes_drift(self):
+        Rating.objects.create(author=self.rater, note=self.note, score=3)
+        Note.objects.filter(pk=self.note.pk).update(rating_count=0, rating_avg=0)
+        with self.assertRaises(CommandError):
+            call_command("check_rating_totals", stdout=StringIO())
+        call_command("check_rating_totals", "--fix", stdout=StringIO())
+        call_command("check_rating_totals", stdout=StringIO())
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.rating_avg, 3)
+
+
+class NoteListQueryCountTests(TestCase):
+    def setUp(self):
+        self.user = create_user("reader")
+        self.group = Group.objects.create(name="Group", moderator=self.user)
+        Membership.objects.create(group=self.group, user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_notes(self, count):
+        for i in range(count):
+            author = create_user("author{0}".format(Note.objects.count()))
+            university = University.objects.create(name=author.username + " College")
+            owners = ((author, None), (author, self.group), (self.user, None))
+            for owner, group in owners:
+                note = Note.objects.create(
+                    author=owner,
+                    title="Note",
+                    course="CS",
+                    university=university,
+                    group=group,
+                )
+                Rating.objects.create(author=self.user, note=note, score=4)
+                Favorite.objects.create(user=self.user, note=note)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_query_count_is_independent_of_list_size(self):
+        urls = [
+            "/api/notes/",
+            "/api/groups/{0}/notes/".format(self.group.id),
+            "/api/user/notes/",
+            "/api/user/favorites/",
+        ]
+        self.add_notes(2)
+        small = [self.count_queries(url) for url in urls]
+        self.add_notes(8)
+        large = [self.count_queries(url) for url in urls]
+        self.assertEqual(small, large)
+
+
+class QueryBudgetTests(TestCase):
+    def test_endpoints_stay_within_query_budgets(self):
+        with benchmark_settings():
+            fixtures = seed(notes=20, rows=6)
+            results = run_benchmarks(fixtures, page_sizes=(2, 5))
+        self.assertEqual(check_results(results, load_baseline()), [])
+
+
+class QueryPlanTests(TestCase):
+    """
+    EXPLAIN every query behind the listing endpoints over a few thousand rows
+    and fail when one reads a large table without an index.
+    """
+
+    large_tables = ("api_note", "api_comment")
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user("reader")
+        cls.group = Group.objects.create(name="Group", moderator=cls.user)
+        Membership.objects.create(group=cls.group, user=cls.user)
+        universities = [
+            University.objects.create(name="University {0}".format(i))
+            for i in range(20)
+        ]
+        Note.objects.bulk_create(
+            Note(
+                author=cls.user,
+                title="Note {0}".format(i),
+                course="CS {0}".format(i % 50),
+                university=universities[i % 20],
+                group=cls.group if i % 10 == 0 else None,
+            )
+            for i in range(3000)
+        )
+        cls.note = Note.objects.filter(group=None).first()
+        Comment.objects.bulk_create(
+            Comment(author=cls.user, note_id=note_id, text="Comment")
+            for note_id in Note.objects.values_list("id", flat=True)
+        )
+        cls.university = universities[3]
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("EXPLAIN " + sql)
+                return [
+                    table
+                    for row in cursor.fetchall()
+                    for table in re.findall(r"Seq Scan on (\w+)", row[0])
+                ]
+            cursor.execute("EXPLAIN QUERY PLAN " + sql)
+            return [
+                match.group(1)
+                for row in cursor.fetchall()
+                for match in [re.match(r"SCAN (?:TABLE )?(\w+)$", row[-1])]
+                if match is not None
+            ]
+
+    def assertNoFullScans(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        for query in context.captured_queries:
+            if not query["sql"].startswith("SELECT"):
+                continue
+            scanned = set(self.explain(query["sql"])) & set(self.large_tables)
+            message = "{0} scans {1}:\n{2}".format(url, scanned, query["sql"])
+            self.assertFalse(scanned, message)
+
+    def test_listings_use_indexes(self):
+        for url in [
+            "/api/notes/",
+            "/api/notes/?course=CS+7",
+            "/api/notes/?university={0}".format(self.university.id),
+            "/api/notes/?order_by=updated",
+            "/api/notes/?order_by=title",
+            "/api/notes/?order_by=rating",
+            "/api/notes/?order_by=popularity",
+            "/api/groups/{0}/notes/".format(self.group.id),
+            "/api/user/notes/",
+            "/api/notes/{0}/".format(self.note.id),
+            "/api/notes/{0}/comments/".format(self.note.id),
+            "/api/universities/{0}/".format(self.university.name),
+        ]:
+            self.assertNoFullScans(url)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.user = create_user("reader")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for i in range(7):
+            Note.objects.create(author=self.user, title=str(i % 3), course="CS")
+
+    def collect(self, url):
+        ids = []
+        while url is not None:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data["results"]), 2)
+            ids += [note["id"] for note in response.data["results"]]
+            if len(ids) == 2:
+                Note.objects.create(author=self.user, title="1", course="CS")
+            url = response.data["next"]
+        return ids
+
+    def test_pages_are_stable_under_inserts(self):
+        expected = list(
+            Note.objects.order_by("-created_at", "-id").values_list("id", flat=True)
+        )
+        self.assertEqual(self.collect("/api/notes/?page_size=2"), expected)
+
+    def test_pages_follow_requested_order(self):
+        ids = self.collect("/api/notes/?page_size=2&order_by=title")
+        expected = list(Note.objects.order_by("title", "id").values_list("id", flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_rating_and_popularity_orders(self):
+        other = create_user("other")
+        notes = list(Note.objects.order_by("id"))
+        Rating.objects.create(author=other, note=notes[2], score=5)
+        Rating.objects.create(author=other, note=notes[4], score=3)
+        Favorite.objects.create(user=other, note=notes[5])
+        Favorite.objects.create(user=self.user, note=notes[5])
+        Favorite.objects.create(user=other, note=notes[1])
+
+        ids = self.collect("/api/notes/?page_size=2&order_by=rating")
+        self.assertEqual(ids[:2], [notes[2].id, notes[4].id])
+        ids = self.collect("/api/notes/?page_size=2&order_by=popularity")
+        self.assertEqual(ids[:2], [notes[5].id, notes[1].id])
+        Favorite.objects.filter(note=notes[5]).delete()
+        ids = self.collect("/api/notes/?page_size=2&order_by=popularity")
+        self.assertEqual(ids[0], notes[1].id)
+
+    def test_unknown_orders_are_rejected(self):
+        for order_by in ("author__email", "-created_at"):
+            response = self.client.get("/api/notes/", {"order_by": order_by})
+            self.assertEqual(response.status_code, 400)
+        response = self.client.get("/api/universities/", {"order_by": "id"})
+        self.assertEqual(response.status_code, 400)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.user = create_user("reader")
+        self.author = create_user("author")
+        self.note = Note.objects.create(author=self.author, title="Note", course="CS")
+        Comment.objects.create(author=self.user, note=self.note, text="First")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_unchanged_resources_are_not_modified(self):
+        urls = [
+            "/api/notes/",
+            "/api/notes/{0}/".format(self.note.id),
+            "/api/notes/{0}/comments/".format(self.note.id),
+        ]
+        for url in urls:
+            response = self.client.get(url)
+            self.assertEqual(response["Cache-Control"], "private, no-cache")
+            etag = response["ETag"]
+            with CaptureQueriesContext(connection) as full:
+                self.client.get(url)
+            with CaptureQueriesContext(connection) as revalidated:
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertLess(len(revalidated), len(full))
+
+    def test_writes_change_the_etag(self):
+        url = "/api/notes/{0}/".format(self.note.id)
+        etag = self.client.get(url)["ETag"]
+        Rating.objects.create(author=self.user, note=self.note, score=5)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data["has_rated"])
+
+        url = "/api/notes/{0}/comments/".format(self.note.id)
+        etag = self.client.get(url)["ETag"]
+        Comment.objects.create(author=self.author, note=self.note, text="Hi")
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag = self.client.get("/api/notes/")["ETag"]
+        self.client.force_authenticate(self.author)
+        self.assertNotEqual(self.client.get("/api/notes/")["ETag"], etag)
+
+    @override_settings(NOTEHUB_RESPONSE_CACHE="default")
+    def test_anonymous_responses_are_cached(self):
+        cache.clear()
+        client = APIClient()
+        self.assertEqual(client.get("/api/notes/").data["results"][0]["title"], "Note")
+        with CaptureQueriesContext(connection) as cached:
+            response = client.get("/api/notes/")
+        self.assertEqual(len(cached), 1)
+        self.assertEqual(response["Cache-Control"], "public, no-cache")
+
+        self.note.title = "Renamed"
+        self.note.save()
+        self.assertEqual(
+            client.get("/api/notes/").data["results"][0]["title"], "Renamed"
+        )
+
+
+class CollectionVersionTests(TestCase):
+    def setUp(self):
+        self.user = create_user("member")
+        self.group = Group.objects.create(name="Group", moderator=self.user)
+        Membership.objects.create(group=self.group, user=self.user)
+        self.note = Note.objects.create(
+            author=self.user, title="Note", course="CS", group=self.group
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def versions(self):
+        note = self.client.get("/api/notes/{0}/".format(self.note.id)).data
+        group = self.client.get("/api/groups/{0}/".format(self.group.id)).data
+        return (
+            note["comments_version"],
+            note["ratings_version"],
+            group["notes_version"],
+            group["members_version"],
+        )
+
+    def test_writes_bump_versions(self):
+        start = self.versions()
+        comment = Comment.objects.create(author=self.user, note=self.note, text="Hi")
+        comment.delete()
+        Rating.objects.create(author=self.user, note=self.note, score=3)
+        Membership.objects.create(group=self.group, user=create_user("other"))
+        end = self.versions()
+        self.assertEqual([b - a for a, b in zip(start, end)], [2, 1, 3, 1])
+
+        # Full saves of stale instances leave the counters alone.
+        self.note.title = "Renamed"
+        self.note.save()
+        self.group.name = "Renamed"
+        self.group.save()
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.comments_version, end[0])
+
+    def test_collection_versions_validate_lists(self):
+        url = "/api/notes/{0}/comments/".format(self.note.id)
+        etag = self.client.get(url)["ETag"]
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        Comment.objects.create(author=self.user, note=self.note, text="Hi")
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        url = "/api/groups/{0}/notes/".format(self.group.id)
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Rating.objects.create(author=self.user, note=self.note, score=3)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # Listed notes carry their comment and file versions.
+        etag = self.client.get(url)["ETag"]
+        Comment.objects.create(author=self.user, note=self.note, text="Hi")
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        etag = self.client.get(url)["ETag"]
+        NoteFile.objects.create(note=self.note, index=0, file="1/notes.pdf")
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class UserStatsTests(TestCase):
+    def setUp(self):
+        self.user = create_user("author")
+        self.other = create_user("other")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_stats_follow_writes(self):
+        note = Note.objects.create(author=self.user, title="Note", course="CS")
+        Note.objects.create(author=self.user, title="Other", course="CS")
+        Rating.objects.create(author=self.other, note=note, score=2)
+        Rating.objects.create(author=self.user, note=note, score=4)
+        Favorite.objects.create(user=self.user, note=note)
+        Subscription.objects.create(
+            user=self.user,
+            starts_at=timezone.now() - timezone.timedelta(days=1),
+            expires_at=timezone.now() + timezone.timedelta(days=1),
+        )
+        data = self.client.get("/api/user/").data
+        self.assertEqual(data["total_uploads"], 2)
+        self.assertEqual(data["avg_rating"], 3)
+        self.assertEqual(data["total_favorite"], 1)
+        self.assertTrue(data["is_premium"])
+
+        note.delete()
+        data = self.client.get("/api/user/").data
+        self.assertEqual(data["total_uploads"], 1)
+        self.assertIsNone(data["avg_rating"])
+        self.assertEqual(data["total_favorite"], 0)
+
+    def test_missing_stats_are_rebuilt(self):
+        Note.objects.create(author=self.user, title="Note", course="CS")
+        UserStats.objects.all().delete()
+        self.assertEqual(self.client.get("/api/user/").data["total_uploads"], 1)
+
+    def test_user_list_query_count_is_constant(self):
+        with CaptureQueriesContext(connection) as small:
+            self.client.get("/api/users/")
+        for i in range(10):
+            user = create_user("user{0}".format(i))
+            Note.objects.create(author=user, title="Note", course="CS")
+        with CaptureQueriesContext(connection) as large:
+            self.client.get("/api/users/")
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.user = create_user("reader")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.university = University.objects.create(name="Oregon State University")
+        self.group = Group.objects.create(name="Group", moderator=self.user)
+
+    def search(self, query, kind="notes"):
+        response = self.client.get("/api/search/", {"q": query, "type": kind})
+        self.assertEqual(response.status_code, 200)
+        return [result["id"] for result in response.data["results"]]
+
+    def test_ranked_prefix_search_over_notes(self):
+        by_course = Note.objects.create(
+            author=self.user, title="Week one", course="Algorithms"
+        )
+        by_title = Note.objects.create(
+            author=self.user, title="Algorithms review", course="CS 325"
+        )
+        by_university = Note.objects.create(
+            author=self.user, title="Exam", course="CS", university=self.university
+        )
+        Note.objects.create(
+            author=self.user, title="Algorithms", course="CS", group=self.group
+        )
+        self.assertEqual(self.search("algo"), [by_title.id, by_course.id])
+        self.assertEqual(self.search("oregon exa"), [by_university.id])
+
+        by_title.title = "Graphs"
+        by_title.save()
+        self.university.name = "Portland State University"
+        self.university.save()
+        self.assertEqual(self.search("algo"), [by_course.id])
+        self.assertEqual(self.search("portland"), [by_university.id])
+
+        by_course.delete()
+        self.assertEqual(self.search("algo"), [])
+
+    def test_search_universities(self):
+        University.objects.create(name="Oregon Health & Science University")
+        self.assertEqual(len(self.search("oregon", "universities")), 2)
+        self.assertEqual(self.search("ore stat", "universities"), [self.university.id])
+        self.assertEqual(self.search("", "universities"), [])
+
+
+class ImportUniversitiesTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "uni.csv")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_import(self, names, *args):
+        with open(self.path, "w", newline="") as csv_file:
+            csv_file.write("\n".join(names))
+        call_command("import_universities", self.path, *args, stdout=StringIO())
+
+    def names(self):
+        return sorted(University.objects.values_list("name", flat=True))
+
+    def test_import_is_incremental(self):
+        user = create_user("author")
+        self.run_import(['"Oregon State University"', "Reed College", "Reed College"])
+        self.assertEqual(self.names(), ["Oregon State University", "Reed College"])
+        query = {"q": "reed", "type": "universities"}
+        response = APIClient().get("/api/search/", query)
+        self.assertEqual(len(response.data["results"]), 1)
+
+        reed = University.objects.get(name="Reed College")
+        Note.objects.create(author=user, title="Note", course="CS", university=reed)
+        with self.assertNumQueries(3):
+            self.run_import(["Oregon State University", "Reed College"])
+
+        self.run_import(["Portland State University"], "--delete-missing")
+        self.assertEqual(self.names(), ["Portland State University", "Reed College"])
+
+
+class UniversityAutocompleteTests(TransactionTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        for name in (
+            "Oregon State University",
+            "University of Oregon",
+            "University of California-Berkeley",
+            "Universidad de Córdoba",
+        ):
+            University.objects.create(name=name)
+
+    def complete(self, query, limit=10):
+        response = self.client.get(
+            "/api/universities/autocomplete/", {"q": query, "limit": limit}
+        )
+        self.assertEqual(response.status_code, 200)
+        return [result["name"] for result in response.data["results"]]
+
+    def test_prefix_word_and_typo_matches(self):
+        self.assertEqual(
+            self.complete("univ", 2),
+            ["Universidad de Córdoba", "University of California-Berkeley"],
+        )
+        self.assertEqual(
+            self.complete("oreg"), ["Oregon State University", "University of Oregon"]
+        )
+        self.assertEqual(self.complete("berk"), ["University of California-Berkeley"])
+        self.assertEqual(self.complete("cordoba"), ["Universidad de Córdoba"])
+        self.assertEqual(self.complete("oregn stat")[0], "Oregon State University")
+
+    def test_index_follows_changes(self):
+        self.complete("pac")
+        University.objects.create(name="Pacific University")
+        self.assertEqual(self.complete("pac"), ["Pacific University"])
+
+    def test_index_is_rebuilt_for_changes_by_other_workers(self):
+        self.complete("pac")
+        # Bulk inserts stand in for another worker, as they send no signals.
+        University.objects.bulk_create([University(name="Pacific University")])
+        self.assertEqual(self.complete("pac"), [])
+        with mock.patch("time.monotonic", return_value=time.monotonic() + 300):
+            self.assertEqual(self.complete("pac"), ["Pacific University"])
+
+    @override_settings(NOTEHUB_AUTOCOMPLETE_CACHE="default")
+    def test_index_follows_a_shared_version(self):
+        self.complete("pac")
+        University.objects.bulk_create([University(name="Pacific University")])
+        cache.set("university_index_version", 42, None)
+        with mock.patch("time.monotonic", return_value=time.monotonic() + 10):
+            self.assertEqual(self.complete("pac"), ["Pacific University"])
+
+
+class PremiumCacheTests(TestCase):
+    def setUp(self):
+        local_cache.clear()
+        self.user = create_user("user")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_status_is_cached_until_subscription_changes(self):
+        self.assertFalse(is_premium(self.user))
+        with self.assertNumQueries(0):
+            self.assertFalse(is_premium(self.user))
+        response = self.client.post("/api/user/add_subscription/")
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(is_premium(self.user))
+        with self.assertNumQueries(0):
+            self.assertTrue(is_premium(self.user))
+
+    def test_entry_expires_with_subscription(self):
+        Subscription.objects.create(
+            user=self.user,
+            starts_at=timezone.now() - timezone.timedelta(days=1),
+            expires_at=timezone.now() + timezone.timedelta(seconds=1),
+        )
+        self.assertTrue(is_premium(self.user))
+        self.assertLessEqual(
+            local_cache.entries[self.user.id][1],
+            (timezone.now() + timezone.timedelta(seconds=1)).timestamp(),
+        )
+
+    def test_entry_expires_when_subscription_starts(self):
+        starts_at = timezone.now() + timezone.timedelta(seconds=1)
+        Subscription.objects.create(
+            user=self.user,
+            starts_at=starts_at,
+            expires_at=starts_at + timezone.timedelta(days=1),
+        )
+        self.assertFalse(is_premium(self.user))
+        self.assertEqual(local_cache.entries[self.user.id][1], starts_at.timestamp())
+        later = starts_at + timezone.timedelta(seconds=1)
+        with mock.patch("django.utils.timezone.now", return_value=later):
+            with mock.patch("time.time", return_value=later.timestamp()):
+                self.assertTrue(is_premium(self.user))
+
+
+class TokenCacheTests(TestCase):
+    def setUp(self):
+        throttle_buckets.clear()
+        token_cache.clear()
+        self.user = create_user("user")
+        self.client = APIClient()
+        self.use_token(Token.objects.create(user=self.user).key)
+
+    def use_token(self, key):
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + key)
+
+    def test_warm_requests_make_no_queries(self):
+        self.assertEqual(self.client.get("/api/search/?q=").status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/search/?q=")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.wsgi_request.user, self.user)
+
+    def test_password_change_invalidates_token(self):
+        self.client.get("/api/search/?q=")
+        response = self.client.put(
+            "/api/user/update_password/",
+            {"old_password": "password", "new_password": "changed"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get("/api/search/?q=").status_code, 403)
+        self.use_token(response.data["token"])
+        self.assertEqual(self.client.get("/api/search/?q=").status_code, 200)
+
+    def test_cached_users_are_not_written_back(self):
+        self.client.get("/api/search/?q=")
+        # Another worker revokes signed tokens while this one has the user cached.
+        User.objects.filter(pk=self.user.pk).update(token_generation=3)
+        response = self.client.patch("/api/user/", {"first_name": "Ann"})
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, "Ann")
+        self.assertEqual(self.user.token_generation, 3)
+
+    def test_inactive_users_are_rejected(self):
+        self.client.get("/api/search/?q=")
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get("/api/search/?q=").status_code, 403)
+
+
+class SignedTokenTests(TestCase):
+    def setUp(self):
+        throttle_buckets.clear()
+        token_cache.clear()
+        self.user = create_user("user")
+        self.client = APIClient()
+
+    def obtain(self):
+        data = {"username": "user", "password": "password"}
+        response = self.client.post("/api/token/", data, format="json")
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def get(self, access):
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer " + access)
+        return self.client.get("/api/search/?q=").status_code
+
+    def test_access_tokens_need_no_queries(self):
+        tokens = self.obtain()
+        self.assertEqual(self.get(tokens["access"]), 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(tokens["access"]), 200)
+        self.assertEqual(self.get(tokens["refresh"]), 403)
+        self.assertEqual(self.get(tokens["access"][:-1]), 403)
+
+    def test_tokens_expire_and_refresh(self):
+        with mock.patch("time.time", return_value=time.time() - 3600):
+            tokens = self.obtain()
+        self.assertEqual(self.get(tokens["access"]), 403)
+        self.client.credentials()
+        response = self.client.post(
+            "/api/token/refresh/", {"refresh": tokens["refresh"]}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get(response.data["access"]), 200)
+
+    def test_malformed_refresh_requests_are_rejected(self):
+        for data in ([], "token", {}):
+            response = self.client.post("/api/token/refresh/", data, format="json")
+            self.assertEqual(response.status_code, 400)
+
+    def test_password_change_revokes_tokens(self):
+        tokens = self.obtain()
+        self.assertEqual(self.get(tokens["access"]), 200)
+        response = self.client.put(
+            "/api/user/update_password/",
+            {"old_password": "password", "new_password": "changed"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get(tokens["access"]), 403)
+        self.client.credentials()
+        response = self.client.post(
+            "/api/token/refresh/", {"refresh": tokens["refresh"]}, format="json"
+        )
+        self.assertEqual(response.status_code, 401)
+
+
+    def test_password_change_through_warm_cache_revokes_tokens(self):
+        tokens = self.obtain()
+        self.assertEqual(self.get(tokens["access"]), 200)
+        # Another worker revokes tokens while this one has the user cached.
+        User.objects.filter(pk=self.user.pk).update(token_generation=1)
+        newer = self.obtain()
+        response = self.client.put(
+            "/api/user/update_password/",
+            {"old_password": "password", "new_password": "changed"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.token_generation, 2)
+        self.assertTrue(self.user.check_password("changed"))
+        self.assertEqual(self.get(newer["access"]), 403)
+        self.assertEqual(self.get(tokens["access"]), 403)
+
+
+class ThrottleTests(TestCase):
+    def setUp(self):
+        throttle_buckets.clear()
+        self.user = create_user("user")
+        self.note = Note.objects.create(author=self.user, title="Note", course="CS")
+        self.url = "/api/notes/{0}/comments/".format(self.note.id)
+        self.client = APIClient()
+
+    @override_settings(NOTEHUB_THROTTLE_RATES={"writes": "2/min"})
+    def test_writes_are_limited_per_user(self):
+        self.client.force_authenticate(self.user)
+        for _ in range(2):
+            response = self.client.post(self.url, {"text": "Hi"}, format="json")
+            self.assertEqual(response.status_code, 201)
+        response = self.client.post(self.url, {"text": "Hi"}, format="json")
+        self.assertEqual(response.status_code, 429)
+        self.assertIn(response["Retry-After"], ("30", "31"))
+        # Reads are not limited, and other users have buckets of their own.
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.client.force_authenticate(create_user("other"))
+        response = self.client.post(self.url, {"text": "Hi"}, format="json")
+        self.assertEqual(response.status_code, 201)
+
+    @override_settings(NOTEHUB_THROTTLE_RATES={"auth": "1/min", "writes": None})
+    def test_login_is_limited_per_address(self):
+        data = {"username": "user", "password": "wrong"}
+        self.assertEqual(self.client.post("/api/login/", data).status_code, 400)
+        self.assertEqual(self.client.post("/api/login/", data).status_code, 429)
+        response = self.client.post("/api/login/", data, REMOTE_ADDR="10.0.0.2")
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(NOTEHUB_THROTTLE_RATES={"auth": "1/min", "writes": None})
+    def test_forwarded_for_does_not_reset_the_bucket(self):
+        data = {"username": "user", "password": "wrong"}
+        self.assertEqual(self.client.post("/api/login/", data).status_code, 400)
+        for address in ("10.0.0.3", "10.0.0.4, 10.0.0.5"):
+            response = self.client.post(
+                "/api/login/", data, HTTP_X_FORWARDED_FOR=address
+            )
+            self.assertEqual(response.status_code, 429)
+
+    @override_settings(
+        NOTEHUB_THROTTLE_CACHE="default", NOTEHUB_THROTTLE_RATES={"writes": "1/min"}
+    )
+    def test_shared_buckets_are_used_without_the_lock(self):
+        cache.clear()
+        get = cache.get
+
+        def unlocked_get(*args, **kwargs):
+            self.assertFalse(throttle_lock.locked())
+            return get(*args, **kwargs)
+
+        self.client.force_authenticate(self.user)
+        with mock.patch.object(cache, "get", side_effect=unlocked_get):
+            response = self.client.post(self.url, {"text": "Hi"}, format="json")
+            self.assertEqual(response.status_code, 201)
+            response = self.client.post(self.url, {"text": "Hi"}, format="json")
+            self.assertEqual(response.status_code, 429)
+        self.assertEqual(len(throttle_buckets.entries), 0)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics_registry.clear()
+        user = create_user("user")
+        for title in ("One", "Two"):
+            Note.objects.create(author=user, title=title, course="CS")
+        self.client = APIClient()
+
+    @override_settings(NOTEHUB_SLOW_REQUEST_SECONDS=0, NOTEHUB_METRICS_TOKEN="secret")
+    def test_requests_are_recorded(self):
+        with self.assertLogs("api.metrics", "WARNING") as logs:
+            self.assertEqual(self.client.get("/api/notes/").status_code, 200)
+            body = self.client.get(
+                "/metrics", HTTP_AUTHORIZATION="Bearer secret"
+            ).content.decode()
+        self.assertIn("Slow request GET /api/notes/", logs.output[0])
+        self.assertIn("SELECT", logs.output[0])
+
+        labels = 'route="/api/notes/",method="GET"'
+        self.assertIn(
+            "notehub_requests_total{{{0},status=\"200\"}} 1".format(labels), body
+        )
+        self.assertIn("notehub_request_queries_sum{{{0}}} 1".format(labels), body)
+        self.assertIn(
+            "notehub_request_duration_seconds_count{{{0}}} 1".format(labels), body
+        )
+        match = re.search(
+            r"notehub_request_serializer_seconds_total\{%s\} (\S+)" % labels, body
+        )
+        self.assertGreater(float(match.group(1)), 0)
+
+    @override_settings(NOTEHUB_METRICS_TOKEN="secret")
+    def test_metrics_are_private(self):
+        # Behind a proxy on the same host every client looks local.
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer wrong")
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+        with override_settings(NOTEHUB_METRICS_TOKEN=None):
+            self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+
+class NoteAccessTests(TestCase):
+    def setUp(self):
+        self.moderator = create_user("moderator")
+        self.member = create_user("member")
+        self.outsider = create_user("outsider")
+        self.group = Group.objects.create(name="Group", moderator=self.moderator)
+        Membership.objects.create(group=self.group, user=self.member)
+        self.note = Note.objects.create(
+            author=self.moderator, title="Note", course="CS", group=self.group
+        )
+        self.client = APIClient()
+
+    def get(self, user, url):
+        if user is None:
+            self.client.force_authenticate(None)
+        else:
+            self.client.force_authenticate(user)
+        return self.client.get(url.format(self.note.id)).status_code
+
+    def test_group_notes_are_limited_to_members(self):
+        for url in ("/api/notes/{0}/", "/api/notes/{0}/comments/"):
+            self.assertEqual(self.get(self.moderator, url), 200)
+            self.assertEqual(self.get(self.member, url), 200)
+            self.assertEqual(self.get(self.outsider, url), 403)
+            self.assertEqual(self.get(None, url), 403)
+        self.assertEqual(self.get(self.outsider, "/api/notes/{0}/favorites/"), 200)
+        self.assertEqual(self.get(self.member, "/api/notes/0/"), 403)
+
+    def test_note_is_loaded_once_per_request(self):
+        self.client.force_authenticate(self.member)
+        # The note with its membership flag, and the member's rating.
+        with self.assertNumQueries(2):
+            self.client.get("/api/notes/{0}/".format(self.note.id))
+        url = "/api/notes/{0}/comments/".format(self.note.id)
+        # The note, inserting the comment, and bumping the note's comments_version
+        # and the group's notes_version.
+        with self.assertNumQueries(4):
+            self.client.post(url, {"text": "Hello"}, format="json")
+
+
+class NoteRelationshipTests(TestCase):
+    def setUp(self):
+        self.user = create_user("user")
+        author = create_user("author")
+        group = Group.objects.create(name="Group", moderator=author)
+        self.notes = [
+            Note.objects.create(author=author, title="Note", course="CS")
+            for _ in range(3)
+        ]
+        self.private = Note.objects.create(
+            author=author, title="Private", course="CS", group=group
+        )
+        self.rating = Rating.objects.create(
+            author=self.user, note=self.notes[0], score=4
+        )
+        self.favorite = Favorite.objects.create(user=self.user, note=self.notes[1])
+        self.report = NoteReport.objects.create(user=self.user, note=self.notes[1])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_relationships_in_one_query(self):
+        ids = [note.id for note in reversed(self.notes)] + [self.private.id]
+        url = "/api/user/relationships/?notes=" + ",".join(map(str, ids))
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        results = response.data["results"]
+        # Unreadable notes are left out and the rest keep the requested order.
+        self.assertEqual([result["note"] for result in results], ids[:3])
+        first, second, third = reversed(results)
+        self.assertEqual(first["rating"], {"id": self.rating.id, "score": 4})
+        self.assertIsNone(first["favorite"])
+        self.assertEqual(second["favorite"], self.favorite.id)
+        self.assertEqual(second["report"], self.report.id)
+        self.assertEqual(
+            third, {"note": ids[0], "rating": None, "favorite": None, "report": None}
+        )
+
+    def test_invalid_requests(self):
+        url = "/api/user/relationships/?notes="
+        self.assertEqual(self.client.get(url).status_code, 400)
+        self.assertEqual(self.client.get(url + "1,x").status_code, 400)
+        many = ",".join(str(pk) for pk in range(101))
+        self.assertEqual(self.client.get(url + many).status_code, 400)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(url + "1").status_code, 403)
+
+
+class MediaTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.media_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.media_override.enable()
+
+    def tearDown(self):
+        self.media_override.disable()
+        shutil.rmtree(self.media_root)
+
+
+class NoteFileContentTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user("author")
+        self.note = Note.objects.create(author=self.user, title="Note", course="CS")
+        self.body = bytes(range(256)) * 4
+        NoteFile.objects.create(
+            note=self.note,
+            index=0,
+            file=SimpleUploadedFile("notes.pdf", b"%PDF" + self.body),
+        )
+        self.url = "/api/notes/{0}/files/0/content/".format(self.note.id)
+        self.client = APIClient()
+
+    def test_full_and_partial_content(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        self.assertEqual(b"".join(response.streaming_content), b"%PDF" + self.body)
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=4-7")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 4-7/1028")
+        self.assertEqual(b"".join(response.streaming_content), self.body[:4])
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=-2")
+        self.assertEqual(b"".join(response.streaming_content), self.body[-2:])
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=2000-")
+        self.assertEqual(response.status_code, 416)
+
+    def test_ranges_of_empty_files_are_unsatisfiable(self):
+        NoteFile.objects.create(
+            note=self.note, index=1, file=SimpleUploadedFile("empty.pdf", b"")
+        )
+        url = "/api/notes/{0}/files/1/content/".format(self.note.id)
+        for header in ("bytes=-5", "bytes=0-"):
+            response = self.client.get(url, HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 416)
+
+    def test_conditional_requests(self):
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(
+            self.url, HTTP_RANGE="bytes=0-1", HTTP_IF_RANGE='"stale"'
+        )
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(NOTEHUB_SENDFILE="nginx")
+    def test_sendfile_offload(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["X-Accel-Redirect"].startswith("/protected/"))
+
+    def test_listings_link_only_the_checked_url(self):
+        listed = self.client.get("/api/notes/{0}/files/".format(self.note.id)).data
+        self.assertNotIn("file", listed[0])
+        self.assertTrue(listed[0]["content"].endswith(self.url))
+
+    def test_group_files_require_membership(self):
+        group = Group.objects.create(name="Group", moderator=self.user)
+        Note.objects.filter(pk=self.note.pk).update(group=group)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+
+class StorageQuotaTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        local_cache.clear()
+        self.user = create_user("author")
+        self.note = Note.objects.create(author=self.user, title="Note", course="CS")
+        self.url = "/api/notes/{0}/files/".format(self.note.id)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, index, size):
+        data = {"index": index, "file": SimpleUploadedFile("f.pdf", b"x" * size)}
+        return self.client.post(self.url, data, format="multipart")
+
+    def totals(self):
+        self.note.refresh_from_db()
+        return self.note.total_bytes, UserStats.objects.get(user=self.user).total_bytes
+
+    def test_totals_follow_files(self):
+        self.assertEqual(self.upload(0, 100).status_code, 201)
+        self.assertEqual(self.upload(1, 50).status_code, 201)
+        self.assertEqual(self.totals(), (150, 150))
+
+        data = {"file": SimpleUploadedFile("g.pdf", b"x" * 10)}
+        response = self.client.patch(self.url + "0/", data, format="multipart")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.totals(), (60, 60))
+
+        self.client.delete(self.url + "1/")
+        self.assertEqual(self.totals(), (10, 10))
+
+    def test_uploads_past_the_limit_are_rejected(self):
+        Note.objects.filter(pk=self.note.pk).update(total_bytes=15000000 - 10)
+        self.assertEqual(self.upload(0, 20).status_code, 403)
+        self.assertEqual(self.upload(0, 10).status_code, 201)
+
+    @override_settings(NOTEHUB_ACCOUNT_STORAGE_LIMIT=100)
+    def test_account_limit(self):
+        self.assertEqual(self.upload(0, 80).status_code, 201)
+        other = Note.objects.create(author=self.user, title="Other", course="CS")
+        self.url = "/api/notes/{0}/files/".format(other.id)
+        self.assertEqual(self.upload(0, 30).status_code, 403)
+
+    @override_settings(NOTEHUB_ACCOUNT_STORAGE_LIMIT=100)
+    def test_account_limit_rebuilds_missing_stats(self):
+        self.assertEqual(self.upload(0, 80).status_code, 201)
+        UserStats.objects.all().delete()
+        self.assertEqual(self.upload(1, 30).status_code, 403)
+        self.assertEqual(self.upload(1, 20).status_code, 201)
+        self.assertEqual(self.totals(), (100, 100))
+
+
+class ChunkedUploadTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        local_cache.clear()
+        self.upload_override = override_settings(
+            NOTEHUB_UPLOAD_DIR=os.path.join(self.media_root, "uploads")
+        )
+        self.upload_override.enable()
+        self.user = create_user("author")
+        self.note = Note.objects.create(author=self.user, title="Note", course="CS")
+        self.url = "/api/notes/{0}/uploads/".format(self.note.id)
+        self.body = b"%PDF-" + bytes(range(256)) * 8
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        self.upload_override.disable()
+        super().tearDown()
+
+    def start(self, filename="notes.pdf", size=None):
+        data = {"index": 0, "filename": filename, "size": size or len(self.body)}
+        return self.client.post(self.url, data, format="json")
+
+    def put(self, session_id, start, chunk, total=None):
+        return self.client.put(
+            "{0}{1}/".format(self.url, session_id),
+            chunk,
+            content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE="bytes {0}-{1}/{2}".format(
+                start, start + len(chunk) - 1, total or len(self.body)
+            ),
+        )
+
+    def finalize(self, session_id):
+        return self.client.post("{0}{1}/finalize/".format(self.url, session_id))
+
+    def test_chunked_upload(self):
+        response = self.start()
+        self.assertEqual(response.status_code, 201)
+        session_id = response.data["id"]
+
+        self.assertEqual(self.finalize(session_id).status_code, 400)
+        response = self.put(session_id, 0, self.body[:1000])
+        self.assertEqual(response.data["received_bytes"], 1000)
+        response = self.put(session_id, 1000, self.body[1000:])
+        self.assertEqual(response.data["received_bytes"], len(self.body))
+
+        response = self.finalize(session_id)
+        self.assertEqual(response.status_code, 201)
+        note_file = NoteFile.objects.get(note=self.note, index=0)
+        with note_file.file.open("rb") as file:
+            self.assertEqual(file.read(), self.body)
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.total_bytes, len(self.body))
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(self.media_root, "uploads")), [])
+
+    def test_chunks_must_continue_from_received_offset(self):
+        session_id = self.start().data["id"]
+        self.put(session_id, 0, self.body[:1000])
+        response = self.put(session_id, 500, self.body[500:])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data["received_bytes"], 1000)
+        response = self.put(session_id, 1000, self.body[1000:], total=10)
+        self.assertEqual(response.status_code, 416)
+
+    def test_chunks_written_meanwhile_are_rechecked(self):
+        session_id = self.start().data["id"]
+        self.put(session_id, 0, self.body[:1000])
+
+        def read_meanwhile(stream, length):
+            # Another request writes the same range while this one reads.
+            session = UploadSession.objects.get(pk=session_id)
+            with open(get_upload_path(session), "ab") as file:
+                file.write(self.body[1000:2000])
+            UploadSession.objects.filter(pk=session_id).update(received_bytes=2000)
+            return read_chunk(stream, length)
+
+        with mock.patch("api.views.read_chunk", side_effect=read_meanwhile):
+            response = self.put(session_id, 1000, b"x" * 1000)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data["received_bytes"], 2000)
+        session = UploadSession.objects.get(pk=session_id)
+        with open(get_upload_path(session), "rb") as file:
+            self.assertEqual(file.read(), self.body[:2000])
+
+    def test_content_must_match_extension(self):
+        self.assertEqual(self.start(filename="notes.exe").status_code, 400)
+        session_id = self.start(filename="notes.png").data["id"]
+        self.put(session_id, 0, self.body)
+        self.assertEqual(self.finalize(session_id).status_code, 400)
+        self.assertFalse(NoteFile.objects.exists())
+
+    def test_declared_size_counts_against_quota(self):
+        Note.objects.filter(pk=self.note.pk).update(total_bytes=15000000 - 10)
+        self.assertEqual(self.start().status_code, 403)
+
+
+class PreviewTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user("author")
+        self.note = Note.objects.create(author=self.user, title="Note", course="CS")
+        self.client = APIClient()
+
+    def add_file(self, index, name, content):
+        return NoteFile.objects.create(
+            note=self.note, index=index, file=SimpleUploadedFile(name, content)
+        )
+
+    def image(self, size, format="PNG"):
+        buffer = BytesIO()
+        Image.new("RGB", size, "red").save(buffer, format)
+        return buffer.getvalue()
+
+    def test_images_get_previews(self):
+        note_file = self.add_file(0, "page.png", self.image((2000, 1000)))
+        url = "/api/notes/{0}/files/".format(self.note.id)
+        self.assertIsNone(self.client.get(url).data[0]["thumbnail"])
+
+        self.assertEqual(process_pending(), 1)
+        self.assertEqual(process_pending(), 0)
+        note_file.refresh_from_db()
+        self.assertEqual(note_file.preview_status, NoteFile.PREVIEW_READY)
+        with Image.open(note_file.thumbnail.path) as thumbnail:
+            self.assertEqual(thumbnail.size, (256, 128))
+        with Image.open(note_file.preview.path) as preview:
+            self.assertEqual(preview.size, (1024, 512))
+
+        data = self.client.get(url).data[0]
+        response = self.client.get(data["thumbnail"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+
+    def test_replacing_the_file_renders_again(self):
+        note_file = self.add_file(0, "page.jpg", self.image((600, 600), "JPEG"))
+        process_pending()
+        note_file.refresh_from_db()
+        old_thumbnail = note_file.thumbnail.path
+
+        note_file.file = SimpleUploadedFile("new.png", self.image((300, 600)))
+        note_file.save()
+        self.assertEqual(note_file.preview_status, NoteFile.PREVIEW_PENDING)
+        process_pending()
+        note_file.refresh_from_db()
+        self.assertEqual(note_file.preview_status, NoteFile.PREVIEW_READY)
+        self.assertFalse(os.path.exists(old_thumbnail))
+        with Image.open(note_file.thumbnail.path) as thumbnail:
+            self.assertEqual(thumbnail.size, (128, 256))
+
+    @override_settings(NOTEHUB_PDFTOPPM="no-such-pdftoppm")
+    def test_unrenderable_files_fail(self):
+        note_file = self.add_file(0, "notes.pdf", b"%PDF-1.4")
+        with self.assertLogs("api.previews", "ERROR"):
+            process_pending()
+        note_file.refresh_from_db()
+        self.assertEqual(note_file.preview_status, NoteFile.PREVIEW_FAILED)
+        url = "/api/notes/{0}/files/0/thumbnail/".format(self.note.id)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class AvatarTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user("author")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def image(self, size, format="JPEG"):
+        buffer = BytesIO()
+        Image.new("RGB", size, "blue").save(buffer, format)
+        return SimpleUploadedFile("avatar." + format.lower(), buffer.getvalue())
+
+    def test_uploads_are_resized(self):
+        data = {"new_avatar": self.image((1200, 800))}
+        response = self.client.put("/api/user/upload_avatar/", data, format="multipart")
+        self.assertEqual(response.status_code, 200)
+
+        self.user.refresh_from_db()
+        avatars = self.client.get("/api/user/").data["avatars"]
+        self.assertEqual(set(avatars), {"32", "64", "256"})
+        for size in (32, 64, 256):
+            name = self.user.avatar.name.replace("-256.", "-{0}.".format(size))
+            with Image.open(self.user.avatar.storage.path(name)) as image:
+                self.assertEqual(image.format, "WEBP")
+                self.assertEqual(image.size, (size, size))
+                self.assertNotIn("exif", image.info)
+            self.assertTrue(avatars[str(size)].endswith(name))
+
+    def test_failed_avatar_does_not_create_the_account(self):
+        data = {
+            "username": "new",
+            "email": "new@example.com",
+            "first_name": "New",
+            "last_name": "User",
+            "password": "password",
+            "avatar": self.image((100, 100)),
+        }
+        with mock.patch("api.avatars.MAX_AVATAR_PIXELS", 10):
+            response = self.client.post("/api/users/", data, format="multipart")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(User.objects.filter(username="new").exists())
+        data["avatar"] = self.image((100, 100))
+        response = self.client.post("/api/users/", data, format="multipart")
+        self.assertEqual(response.status_code, 201)
+
+    def test_backfill(self):
+        self.user.avatar = self.image((100, 300), "PNG")
+        self.user.save()
+        avatars = self.client.get("/api/user/").data["avatars"]
+        self.assertEqual(len(set(avatars.values())), 1)
+
+        call_command("backfill_avatars", stdout=StringIO())
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.avatar.name.endswith("-256.webp"))
+        avatars = self.client.get("/api/user/").data["avatars"]
+        self.assertEqual(len(set(avatars.values())), 3)
+
+
+@override_settings(MEDIA_ROOT=tempfile.gettempdir())
+class ASGITests(TransactionTestCase):
+    def setUp(self):
+        self.application = NoteHubASGIHandler()
+        self.user = create_user("reader")
+        self.token = Token.objects.create(user=self.user).key
+        author = create_user("author")
+        self.group = Group.objects.create(name="Group", moderator=author)
+        self.note = Note.objects.create(author=author, title="Physics", course="PH")
+        self.private = Note.objects.create(
+            author=author, title="Private", course="PH", group=self.group
+        )
+        Rating.objects.create(author=self.user, note=self.note, score=5)
+        self.note_file = NoteFile.objects.create(
+            note=self.note,
+            index=0,
+            file=SimpleUploadedFile("notes.pdf", b"%PDF" + bytes(range(256))),
+        )
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token)
+
+    def tearDown(self):
+        self.note_file.file.delete(save=False)
+
+    def get(self, path, query="", headers=()):
+        headers = [(b"host", b"testserver")] + [
+            (name.encode(), value.encode()) for name, value in headers
+        ]
+        if self.token is not None:
+            headers.append((b"authorization", ("Token " + self.token).encode()))
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": path,
+            "query_string": query.encode(),
+            "headers": headers,
+        }
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(self.application(scope, receive, send))
+        body = b"".join(message.get("body", b"") for message in messages[1:])
+        return messages[0]["status"], dict(messages[0]["headers"]), body
+
+    def test_native_responses_match_wsgi(self):
+        for path, query in (
+            ("/api/notes/", "order_by=title"),
+            ("/api/notes/{0}/".format(self.note.id), ""),
+            ("/api/search/", "q=phys"),
+        ):
+            status, headers, body = self.get(path, query)
+            self.assertEqual(status, 200)
+            expected = self.client.get(path + "?" + query)
+            self.assertEqual(json.loads(body), json.loads(expected.content))
+            etag = headers.get(b"ETag")
+            self.assertEqual(etag and etag.decode(), expected.get("ETag"))
+            self.assertEqual(headers[b"X-Frame-Options"], b"DENY")
+        detail = json.loads(self.get("/api/notes/{0}/".format(self.note.id))[2])
+        self.assertTrue(detail["has_rated"])
+        self.assertIn(("/api/notes/<int:pk>/", "GET"), metrics_registry.series)
+
+        path = "/api/notes/{0}/".format(self.note.id)
+        etag = self.get(path)[1][b"ETag"].decode()
+        self.assertEqual(self.get(path, headers=[("if-none-match", etag)])[0], 304)
+        self.assertEqual(self.get("/api/notes/", "order_by=size")[0], 400)
+
+    def test_access_checks(self):
+        path = "/api/notes/{0}/".format(self.private.id)
+        self.assertEqual(self.get(path)[0], 403)
+        self.assertEqual(self.get(path + "files/0/content/")[0], 403)
+        self.token = "invalid"
+        self.client.credentials(HTTP_AUTHORIZATION="Token invalid")
+        expected = self.client.get("/api/notes/").status_code
+        self.assertEqual(self.get("/api/notes/")[0], expected)
+        self.token = None
+        status, headers, body = self.get("/api/notes/")
+        self.assertEqual(status, 200)
+        self.assertEqual(len(json.loads(body)["results"]), 1)
+
+    def test_downloads_are_streamed(self):
+        path = "/api/notes/{0}/files/0/content/".format(self.note.id)
+        status, headers, body = self.get(path)
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b"%PDF" + bytes(range(256)))
+        self.assertEqual(headers[b"Content-Type"], b"application/pdf")
+        status, headers, body = self.get(path, headers=[("range", "bytes=4-7")])
+        self.assertEqual(status, 206)
+        self.assertEqual(body, bytes(range(4)))
+        self.assertEqual(self.get(path.replace("/0/", "/1/"))[0], 404)
+
+    def test_sessions_take_the_django_path(self):
+        factory = APIRequestFactory()
+        native = self.application.get_native_view
+        self.assertIsNotNone(native(factory.get("/api/notes/")))
+        factory.cookies["sessionid"] = "session"
+        self.assertIsNone(native(factory.get("/api/notes/")))
+        factory.cookies.clear()
+        self.assertIsNone(native(factory.get("/api/notes/", HTTP_ACCEPT="text/html")))
+        self.assertIsNone(native(factory.post("/api/notes/")))
+
+    def test_unlisted_middleware_disables_the_native_path(self):
+        middleware = settings.MIDDLEWARE + ["django.middleware.gzip.GZipMiddleware"]
+        with override_settings(MIDDLEWARE=middleware):
+            self.assertEqual(NoteHubASGIHandler().native_views, {})
+        self.assertTrue(NoteHubASGIHandler().native_views)
+
+    def test_threads_are_bounded(self):
+        pool = ThreadPool(2)
+
+        async def request():
+            threads = RequestThreads(pool)
+            try:
+                # Concurrent lookups queue up instead of waiting on the pool.
+                await gather(*(threads.run(time.sleep, 0.01) for _ in range(3)))
+            finally:
+                await threads.close()
+
+        async def serve():
+            await asyncio.gather(*(request() for _ in range(5)))
+
+        asyncio.run(asyncio.wait_for(serve(), 5))
+        self.assertEqual(pool.created, 2)
+        self.assertEqual(len(pool.idle), 2)
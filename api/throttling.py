@@ -0,0 +1,140 @@
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+from .localcache import LocalCache
+
+CACHE_KEY = "throttle:{0}:{1}"
+# Requests allowed per period; a client may use them all in one burst.
+DEFAULT_RATES = {
+    "auth": "20/min",
+    "uploads": "100/hour",
+    "writes": "120/min",
+    "search": "60/min",
+}
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+# Key -> (tokens, updated_at). Entries expire once their bucket is full again,
+# since a missing bucket counts as full.
+local_buckets = LocalCache(
+    getattr(settings, "NOTEHUB_THROTTLE_CACHE_SIZE", 100000), float("inf")
+)
+lock = threading.Lock()
+
+
+def get_shared_cache():
+    # Optionally share buckets between workers through one of Django's caches,
+    # e.g. NOTEHUB_THROTTLE_CACHE = "default". Concurrent requests, within a
+    # worker or across workers, may then overdraw a bucket slightly.
+    alias = getattr(settings, "NOTEHUB_THROTTLE_CACHE", None)
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def get_rate(scope):
+    """Return (capacity, period in seconds) for a scope, or None if unlimited."""
+    rates = dict(DEFAULT_RATES, **getattr(settings, "NOTEHUB_THROTTLE_RATES", {}))
+    rate = rates.get(scope)
+    if rate is None:
+        return None
+    capacity, period = rate.split("/")
+    return int(capacity), PERIODS[period[0]]
+
+
+def spend_token(bucket, now, capacity, period):
+    """
+    Refill `bucket`, a (tokens, updated_at) pair or None for a full one, up to
+    `now` and take a token from it. Returns (tokens left, seconds until a
+    token is available or 0 if one was taken, seconds until the bucket is
+    full again).
+    """
+    tokens, updated_at = bucket or (capacity, now)
+    # Clocks of different workers may disagree, so time never runs back.
+    elapsed = max(now - updated_at, 0)
+    tokens = min(capacity, tokens + elapsed * capacity / period)
+    wait = 0
+    if tokens >= 1:
+        tokens -= 1
+    else:
+        wait = (1 - tokens) * period / capacity
+    refill = (capacity - tokens) * period / capacity
+    return tokens, wait, refill
+
+
+def take_token(key, capacity, period):
+    """
+    Take a token from the bucket stored under `key`, which holds up to
+    `capacity` tokens and refills at `capacity` per `period` seconds. Returns
+    0 if a token was taken, otherwise the seconds until one is available.
+    """
+    shared = get_shared_cache()
+    if shared is None:
+        with lock:
+            now = time.time()
+            tokens, wait, refill = spend_token(
+                local_buckets.get(key), now, capacity, period
+            )
+            local_buckets.set(key, (tokens, now), now + refill)
+        return wait
+    # No lock around the round trips to the shared cache; it would not cover
+    # other workers anyway, and the overdraw is accepted.
+    now = time.time()
+    tokens, wait, refill = spend_token(shared.get(key), now, capacity, period)
+    shared.set(key, (tokens, now), math.ceil(refill) or 1)
+    return wait
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Throttle requests per user, or per IP address for anonymous requests,
+    with a token bucket per scope. Rates are set per scope in
+    NOTEHUB_THROTTLE_RATES, e.g. {"writes": "120/min"}; None disables one.
+    """
+
+    scope = None
+    methods = None
+
+    def allow_request(self, request, view):
+        self.retry_after = None
+        if self.methods is not None and request.method not in self.methods:
+            return True
+        rate = get_rate(self.scope)
+        if rate is None:
+            return True
+        if request.user.is_authenticated:
+            ident = "user-{0}".format(request.user.pk)
+        else:
+            ident = "ip-{0}".format(self.get_ident(request))
+        wait = take_token(CACHE_KEY.format(self.scope, ident), *rate)
+        if wait:
+            self.retry_after = wait
+            return False
+        return True
+
+    def wait(self):
+        return self.retry_after
+
+
+class UnsafeMethodThrottle(TokenBucketThrottle):
+    methods = ("POST", "PUT", "PATCH", "DELETE")
+
+
+class AuthThrottle(UnsafeMethodThrottle):
+    scope = "auth"
+
+
+class UploadThrottle(UnsafeMethodThrottle):
+    scope = "uploads"
+
+
+class WriteThrottle(UnsafeMethodThrottle):
+    scope = "writes"
+
+
+class SearchThrottle(TokenBucketThrottle):
+    scope = "search"
@@ -0,0 +1,115 @@
+import os
+import re
+import tempfile
+
+from django.conf import settings
+
+CHUNK_BLOCK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = getattr(settings, "NOTEHUB_UPLOAD_MAX_CHUNK_SIZE", 8 * 1024 * 1024)
+CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+# Leading bytes every file of an accepted extension starts with.
+FILE_SIGNATURES = {
+    "pdf": (b"%PDF-",),
+    "png": (b"\x89PNG\r\n\x1a\n",),
+    "jpg": (b"\xff\xd8\xff",),
+}
+
+
+class UploadError(Exception):
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def get_upload_dir():
+    return getattr(
+        settings,
+        "NOTEHUB_UPLOAD_DIR",
+        os.path.join(settings.BASE_DIR, "data/uploads"),
+    )
+
+
+def get_upload_path(session):
+    return os.path.join(get_upload_dir(), "{0}.part".format(session.id))
+
+
+def get_extension(filename):
+    return os.path.splitext(filename)[1].lstrip(".").lower()
+
+
+def create_upload_file(session):
+    os.makedirs(get_upload_dir(), exist_ok=True)
+    open(get_upload_path(session), "wb").close()
+
+
+def remove_upload_file(session):
+    try:
+        os.remove(get_upload_path(session))
+    except FileNotFoundError:
+        pass
+
+
+def parse_content_range(header, session):
+    """Return (start, length) of the chunk described by a Content-Range header."""
+    match = CONTENT_RANGE_RE.match(header or "")
+    if match is None:
+        raise UploadError("Missing or invalid Content-Range header.", 400)
+    start, end, total = (int(value) for value in match.groups())
+    if total != session.size or end < start or end >= total:
+        raise UploadError("Content-Range does not match the upload.", 416)
+    if start != session.received_bytes:
+        raise UploadError("Chunk does not start at the received offset.", 409)
+    length = end - start + 1
+    if length > MAX_CHUNK_SIZE:
+        raise UploadError("Chunk is too large.", 413)
+    return start, length
+
+
+def read_chunk(stream, length):
+    """
+    Copy `length` bytes of `stream` into a temporary file, a block at a time,
+    and return the file rewound to its start.
+    """
+    chunk = tempfile.SpooledTemporaryFile(CHUNK_BLOCK_SIZE, dir=get_upload_dir())
+    copied = 0
+    while copied < length:
+        block = stream.read(min(CHUNK_BLOCK_SIZE, length - copied))
+        if not block:
+            break
+        chunk.write(block)
+        copied += len(block)
+    if copied != length:
+        chunk.close()
+        raise UploadError("Chunk is shorter than its Content-Range.", 400)
+    chunk.seek(0)
+    return chunk
+
+
+def write_chunk(session, stream, start, length):
+    """
+    Copy `length` bytes of `stream` into the session's file at `start`, a
+    block at a time, and return how many bytes were written.
+    """
+    written = 0
+    with open(get_upload_path(session), "r+b") as file:
+        file.seek(start)
+        file.truncate()
+        while written < length:
+            block = stream.read(min(CHUNK_BLOCK_SIZE, length - written))
+            if not block:
+                break
+            file.write(block)
+            written += len(block)
+    if written != length:
+        raise UploadError("Chunk is shorter than its Content-Range.", 400)
+    return written
+
+
+def check_signature(session):
+    signatures = FILE_SIGNATURES[get_extension(session.filename)]
+    with open(get_upload_path(session), "rb") as file:
+        head = file.read(max(len(signature) for signature in signatures))
+    if not any(head.startswith(signature) for signature in signatures):
+        raise UploadError("File content does not match its extension.", 400)
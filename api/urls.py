@@ -1,21 +1,31 @@
 from django.urls import path
 from rest_framework.authtoken import views
+from .throttling import AuthThrottle
 from .views import (
     UserView,
     NoteView,
     NoteDetailView,
     NoteFileView,
     NoteFileDetailView,
+    NoteFileContentView,
+    UploadSessionView,
+    UploadSessionDetailView,
+    UploadSessionFinalizeView,
     UniversityView,
     UniversityDetailView,
+    UniversityAutocompleteView,
+    SearchView,
     RatingView,
     RatingDetailView,
     SelfView,
     SelfNoteView,
     SelfGroupView,
     SelfInvitationView,
+    SelfNoteRelationshipView,
     SelfFavoritesView,
     UpdatePasswordView,
+    SignedTokenView,
+    RefreshSignedTokenView,
     UploadAvatarView,
     CommentView,
     CommentDetailView,
@@ -34,12 +44,15 @@ from .views import (
 )
 
 urlpatterns = [
-    path("login/", views.obtain_auth_token),
+    path("login/", views.ObtainAuthToken.as_view(throttle_classes=[AuthThrottle])),
+    path("token/", SignedTokenView.as_view()),
+    path("token/refresh/", RefreshSignedTokenView.as_view()),
     path("user/", SelfView.as_view()),
     path("user/notes/", SelfNoteView.as_view()),
     path("user/groups/", SelfGroupView.as_view()),
     path("user/invitations/", SelfInvitationView.as_view()),
     path("user/favorites/", SelfFavoritesView.as_view()),
+    path("user/relationships/", SelfNoteRelationshipView.as_view()),
     path("user/update_password/", UpdatePasswordView.as_view()),
     path("user/upload_avatar/", UploadAvatarView.as_view()),
     path("user/add_subscription/", AddSubscriptionView.as_view()),
@@ -48,6 +61,27 @@ urlpatterns = [
     path("notes/<int:pk>/", NoteDetailView.as_view()),
     path("notes/<int:note_id>/files/", NoteFileView.as_view()),
     path("notes/<int:note_id>/files/<int:index>/", NoteFileDetailView.as_view()),
+    path(
+        "notes/<int:note_id>/files/<int:index>/content/",
+        NoteFileContentView.as_view(),
+        name="note-file-content",
+    ),
+    path(
+        "notes/<int:note_id>/files/<int:index>/thumbnail/",
+        NoteFileContentView.as_view(field="thumbnail"),
+        name="note-file-thumbnail",
+    ),
+    path(
+        "notes/<int:note_id>/files/<int:index>/preview/",
+        NoteFileContentView.as_view(field="preview"),
+        name="note-file-preview",
+    ),
+    path("notes/<int:note_id>/uploads/", UploadSessionView.as_view()),
+    path("notes/<int:note_id>/uploads/<uuid:pk>/", UploadSessionDetailView.as_view()),
+    path(
+        "notes/<int:note_id>/uploads/<uuid:pk>/finalize/",
+        UploadSessionFinalizeView.as_view(),
+    ),
     path("notes/<int:note_id>/ratings/", RatingView.as_view()),
     path("notes/<int:note_id>/ratings/<int:pk>/", RatingDetailView.as_view()),
     path("notes/<int:note_id>/comments/", CommentView.as_view()),
@@ -56,7 +90,9 @@ urlpatterns = [
     path("notes/<int:note_id>/favorites/", FavoriteView.as_view()),
     path("notes/<int:note_id>/favorites/<int:pk>/", FavoriteDetailView.as_view()),
     path("notes/<int:note_id>/report/", NoteReportView.as_view()),
+    path("search/", SearchView.as_view()),
     path("universities/", UniversityView.as_view()),
+    path("universities/autocomplete/", UniversityAutocompleteView.as_view()),
     path("universities/<str:name>/", UniversityDetailView.as_view()),
     path("groups/", GroupView.as_view()),
     path("groups/<int:pk>/", GroupDetailView.as_view()),
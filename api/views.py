@@ -1,8 +1,15 @@
-from django.shortcuts import render
+from django.shortcuts import render, get_object_or_404
 from rest_framework import generics, mixins, permissions, status
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
+from rest_framework.authtoken.serializers import AuthTokenSerializer
 from rest_framework.parsers import FileUploadParser
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+from django.http import Http404
 from django.utils import timezone
 
 from .models import (
@@ -18,7 +25,45 @@ from .models import (
     NoteReport,
     CommentReport,
     Subscription,
+    UploadSession,
+    UserStats,
+    rebuild_user_stats,
 )
+from .access import can_read_note, get_note, get_note_queryset
+from .authentication import (
+    REFRESH_TOKEN_SALT,
+    REFRESH_TOKEN_TTL,
+    get_signed_token_user,
+    issue_signed_tokens,
+)
+from .autocomplete import get_university_index
+from .caching import (
+    COMMENT_FINGERPRINT,
+    NOTE_FINGERPRINT,
+    UNIVERSITY_FINGERPRINT,
+    ConditionalGetMixin,
+)
+from .avatars import AvatarError, set_avatar
+from .downloads import serve_note_file
+from .uploads import (
+    UploadError,
+    check_signature,
+    create_upload_file,
+    get_upload_path,
+    parse_content_range,
+    read_chunk,
+    remove_upload_file,
+    write_chunk,
+)
+from .pagination import (
+    NOTE_ORDERINGS,
+    UNIVERSITY_ORDERINGS,
+    KeysetPagination,
+    order_by_param,
+)
+from .premium import is_premium, invalidate_premium
+from .search import get_search_backend
+from .throttling import AuthThrottle, SearchThrottle, UploadThrottle, WriteThrottle
 from .permissions import (
     IsAuthor,
     IsAuthorOrReadOnly,
@@ -39,6 +84,7 @@ from .permissions import (
 from .serializers import (
     UserSerializer,
     UpdatePasswordSerializer,
+    RefreshTokenSerializer,
     UpdateUserSerializer,
     UploadAvatarSerializer,
     NoteSerializer,
@@ -53,27 +99,55 @@ from .serializers import (
     NoteReportSerializer,
     CommentReportSerializer,
     SubscriptionSerializer,
+    UploadSessionSerializer,
 )
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
 
-def check_is_premium(user):
-    subscriptions = Subscription.objects.filter(user=user)
-    for subscription in subscriptions:
-        if subscription.is_active():
-            return True
-    return False
+def check_storage_quota(user, note_id, size):
+    """
+    Lock the note's row, and the user's stats row if an account quota is set,
+    and return an error message if storing `size` more bytes would exceed a
+    quota. Must run inside a transaction so concurrent uploads queue up on the
+    lock instead of both passing the check.
+    """
+    limit_size = 50000000
+    if not is_premium(user):
+        limit_size = 15000000
+    total = (
+        Note.objects.select_for_update()
+        .values_list("total_bytes", flat=True)
+        .get(pk=note_id)
+    )
+    if total + size > limit_size:
+        return "Exceeded note size limit."
+    account_limit = getattr(settings, "NOTEHUB_ACCOUNT_STORAGE_LIMIT", None)
+    if account_limit is not None:
+        stats = UserStats.objects.select_for_update().values_list(
+            "total_bytes", flat=True
+        )
+        try:
+            total = stats.get(user=user)
+        except UserStats.DoesNotExist:
+            rebuild_user_stats(User.objects.filter(pk=user.pk))
+            total = stats.get(user=user)
+        if total + size > account_limit:
+            return "Exceeded account storage limit."
+    return None
 
 
 # Create your views here.
 class UserView(mixins.CreateModelMixin, mixins.ListModelMixin, generics.GenericAPIView):
     permission_classes = (permissions.AllowAny,)
+    throttle_classes = (AuthThrottle,)
     serializer_class = UserSerializer
+    pagination_class = KeysetPagination
+    ordering = ("id",)
 
     def get_queryset(self):
-        queryset = User.objects.all()
+        queryset = User.objects.select_related("stats")
         username = self.request.query_params.get("username", None)
         if username is not None:
             queryset = queryset.filter(username=username)
@@ -88,11 +162,13 @@ class UserView(mixins.CreateModelMixin, mixins.ListModelMixin, generics.GenericA
 
 class UpdatePasswordView(generics.UpdateAPIView):
     permission_classes = (permissions.IsAuthenticated,)
+    throttle_classes = (AuthThrottle,)
     serializer_class = UpdatePasswordSerializer
     model = User
 
     def get_object(self):
-        return self.request.user
+        # request.user may be a cached snapshot, which must not be saved.
+        return User.objects.get(pk=self.request.user.pk)
 
     def update(self, request, *args, **kwargs):
         self.obj = self.get_object()
@@ -104,8 +180,12 @@ class UpdatePasswordView(generics.UpdateAPIView):
                     {"message": "Password is incorrect."},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
+            # Revoke signed tokens in SQL, so a concurrent revocation is kept.
+            User.objects.filter(pk=self.obj.pk).update(
+                token_generation=F("token_generation") + 1
+            )
             self.obj.set_password(serializer.data["new_password"])
-            self.obj.save()
+            self.obj.save(update_fields=["password"])
             Token.objects.filter(user=self.obj).delete()
             token = Token.objects.create(user=self.obj)
             return Response(
@@ -115,21 +195,62 @@ class UpdatePasswordView(generics.UpdateAPIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class SignedTokenView(generics.GenericAPIView):
+    authentication_classes = ()
+    permission_classes = (permissions.AllowAny,)
+    throttle_classes = (AuthThrottle,)
+    serializer_class = AuthTokenSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data["user"]
+        return Response(issue_signed_tokens(user), status=status.HTTP_200_OK)
+
+
+class RefreshSignedTokenView(generics.GenericAPIView):
+    authentication_classes = ()
+    permission_classes = (permissions.AllowAny,)
+    throttle_classes = (AuthThrottle,)
+    serializer_class = RefreshTokenSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = get_signed_token_user(
+            serializer.validated_data["refresh"],
+            REFRESH_TOKEN_SALT,
+            REFRESH_TOKEN_TTL,
+        )
+        if user is None:
+            return Response(
+                {"message": "Refresh token is invalid or expired."},
+                status=status.HTTP_401_UNAUTHORIZED,
+            )
+        return Response(issue_signed_tokens(user), status=status.HTTP_200_OK)
+
+
 class UploadAvatarView(generics.UpdateAPIView):
     parser_class = (FileUploadParser,)
     permission_classes = (permissions.IsAuthenticated,)
+    throttle_classes = (WriteThrottle, UploadThrottle)
     serializer_class = UploadAvatarSerializer
     model = User
 
     def get_object(self):
-        return self.request.user
+        # request.user may be a cached snapshot, which must not be saved.
+        return User.objects.get(pk=self.request.user.pk)
 
     def update(self, request, *args, **kwargs):
         self.obj = self.get_object()
         serializer = self.get_serializer(data=request.data)
         if request.data["new_avatar"] == "" or serializer.is_valid():
-            self.obj.avatar = request.data["new_avatar"]
-            self.obj.save()
+            try:
+                set_avatar(self.obj, request.data["new_avatar"])
+            except AvatarError as error:
+                return Response(
+                    {"message": str(error)}, status=status.HTTP_400_BAD_REQUEST
+                )
             return Response({"message": "Uploaded Avatar."}, status=status.HTTP_200_OK,)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -140,10 +261,11 @@ class SelfView(generics.RetrieveUpdateAPIView):
     serializer_class = UserSerializer
 
     def get_object(self):
-        return self.request.user
+        # request.user may be a cached snapshot, which must not be saved.
+        return User.objects.get(pk=self.request.user.pk)
 
     def get(self, request, *args, **kwargs):
-        user = User.objects.get(id=request.user.id)
+        user = User.objects.select_related("stats").get(id=request.user.id)
         serializer = UserSerializer(user, many=False)
         return Response(serializer.data)
 
@@ -159,10 +281,13 @@ class SelfView(generics.RetrieveUpdateAPIView):
 class SelfNoteView(mixins.ListModelMixin, generics.GenericAPIView):
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = NoteSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         user = self.request.user
-        return Note.objects.filter(author__id=user.id)
+        return Note.objects.select_related("author", "university", "group").filter(
+            author__id=user.id
+        )
 
     def get(self, request, *args, **kwargs):
         return self.list(request, *args, **kwargs)
@@ -170,58 +295,128 @@ class SelfNoteView(mixins.ListModelMixin, generics.GenericAPIView):
 
 class SelfGroupView(generics.GenericAPIView):
     permission_classes = (permissions.IsAuthenticated,)
-    queryset = Group.objects.all()
     serializer_class = GroupSerializer
+    pagination_class = KeysetPagination
+    ordering = ("id",)
 
     def get(self, request, *args, **kwargs):
-        memberships = Membership.objects.filter(user__id=request.user.id)
-        id_list = []
-        for membership in memberships:
-            id_list.append(membership.group.id)
-        groups = Group.objects.filter(id__in=id_list)
-        serializer = GroupSerializer(groups, many=True, context={"request": request})
-        return Response(serializer.data)
+        memberships = Membership.objects.filter(user=request.user, group=OuterRef("pk"))
+        groups = (
+            Group.objects.select_related("moderator")
+            .filter(membership__user__id=request.user.id)
+            .annotate(user_membership_id=Subquery(memberships.values("pk")[:1]))
+        )
+        page = self.paginate_queryset(groups)
+        serializer = GroupSerializer(page, many=True, context={"request": request})
+        return self.get_paginated_response(serializer.data)
 
 
 class SelfFavoritesView(mixins.ListModelMixin, generics.GenericAPIView):
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = NoteSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         user = self.request.user
-        favorites = Favorite.objects.filter(user__id=user.id)
-        id_list = []
-        for favorite in favorites:
-            id_list.append(favorite.note.id)
-        return Note.objects.filter(id__in=id_list)
+        return Note.objects.select_related("author", "university", "group").filter(
+            favorite__user__id=user.id
+        )
 
     def get(self, request, *args, **kwargs):
         return self.list(request, *args, **kwargs)
 
 
+class SelfNoteRelationshipView(generics.GenericAPIView):
+    permission_classes = (permissions.IsAuthenticated,)
+    max_notes = 100
+
+    def get(self, request, *args, **kwargs):
+        try:
+            ids = [int(pk) for pk in request.query_params.get("notes", "").split(",")]
+        except ValueError:
+            return Response(
+                {"message": "notes must be a comma-separated list of note ids."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(ids) > self.max_notes:
+            return Response(
+                {"message": "At most {0} notes at a time.".format(self.max_notes)},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        user = request.user
+        ratings = Rating.objects.filter(author=user, note=OuterRef("pk"))
+        favorites = Favorite.objects.filter(user=user, note=OuterRef("pk"))
+        reports = NoteReport.objects.filter(user=user, note=OuterRef("pk"))
+        # One query for every note, whether the user may read it, and the
+        # user's rating, favorite and report of it.
+        notes = (
+            get_note_queryset(user)
+            .select_related(None)
+            .only("id", "author_id", "group_id")
+            .filter(pk__in=ids)
+            .annotate(
+                rating_id=Subquery(ratings.values("id")[:1]),
+                rating_score=Subquery(ratings.values("score")[:1]),
+                favorite_id=Subquery(favorites.values("id")[:1]),
+                report_id=Subquery(reports.values("id")[:1]),
+            )
+        )
+        results = []
+        for note in notes:
+            if not can_read_note(user, note):
+                continue
+            rating = None
+            if note.rating_id is not None:
+                rating = {"id": note.rating_id, "score": note.rating_score}
+            results.append(
+                {
+                    "note": note.id,
+                    "rating": rating,
+                    "favorite": note.favorite_id,
+                    "report": note.report_id,
+                }
+            )
+        order = {pk: index for index, pk in enumerate(ids)}
+        results.sort(key=lambda result: order[result["note"]])
+        return Response({"results": results})
+
+
 class SelfInvitationView(mixins.ListModelMixin, generics.GenericAPIView):
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = InvitationSerializer
+    pagination_class = KeysetPagination
+    ordering = ("id",)
 
     def get_queryset(self):
         user = self.request.user
-        return Invitation.objects.filter(user__id=user.id)
+        return Invitation.objects.select_related("group__moderator", "user").filter(
+            user__id=user.id
+        )
 
     def get(self, request, *args, **kwargs):
         return self.list(request, *args, **kwargs)
 
 
-class NoteView(mixins.CreateModelMixin, mixins.ListModelMixin, generics.GenericAPIView):
+class NoteView(
+    ConditionalGetMixin,
+    mixins.CreateModelMixin,
+    mixins.ListModelMixin,
+    generics.GenericAPIView,
+):
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
     serializer_class = NoteSerializer
+    pagination_class = KeysetPagination
+    fingerprint_fields = NOTE_FINGERPRINT
+    last_modified_field = "updated_at"
 
     def get_queryset(self):
-        queryset = Note.objects.all().filter(group__isnull=True)
+        queryset = Note.objects.select_related("author", "university", "group").filter(
+            group__isnull=True
+        )
         username = self.request.query_params.get("username", None)
         title = self.request.query_params.get("title", None)
         university = self.request.query_params.get("university", None)
         course = self.request.query_params.get("course", None)
-        order_by = self.request.query_params.get("order_by", None)
         if username is not None:
             queryset = queryset.filter(author__username=username)
         if title is not None:
@@ -230,9 +425,7 @@ class NoteView(mixins.CreateModelMixin, mixins.ListModelMixin, generics.GenericA
             queryset = queryset.filter(university=university)
         if course is not None:
             queryset = queryset.filter(course=course)
-        if order_by is not None:
-            queryset = queryset.order_by(order_by)
-        return queryset
+        return order_by_param(queryset, self.request, NOTE_ORDERINGS, "newest")
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user, group=None)
@@ -244,21 +437,45 @@ class NoteView(mixins.CreateModelMixin, mixins.ListModelMixin, generics.GenericA
         return self.create(request, *args, **kwargs)
 
 
-class NoteDetailView(generics.RetrieveUpdateDestroyAPIView):
+class NoteDetailView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     permission_classes = (IsAuthorOrModeratorOrReadOnly, CanAccessNote)
-    queryset = Note.objects.all()
     serializer_class = NoteSerializer
+    fingerprint_fields = NOTE_FINGERPRINT
+    last_modified_field = "updated_at"
+    # Set by the ASGI handler, which looks the user's rating up concurrently
+    # with the note.
+    rated_notes = None
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.rated_notes is not None:
+            context["rated_notes"] = self.rated_notes
+        return context
+
+    def get_object(self):
+        note = get_note(self.request, self.kwargs["pk"])
+        if note is None:
+            raise Http404
+        self.check_object_permissions(self.request, note)
+        return note
 
 
 class NoteFileView(
-    mixins.CreateModelMixin, mixins.ListModelMixin, generics.GenericAPIView
+    ConditionalGetMixin,
+    mixins.CreateModelMixin,
+    mixins.ListModelMixin,
+    generics.GenericAPIView,
 ):
     http_method_names = ["get", "post", "patch", "delete"]
     permission_classes = (IsNoteAuthorOrReadOnly, CanAccessNote)
+    throttle_classes = (WriteThrottle, UploadThrottle)
     serializer_class = NoteFileSerializer
 
+    def get_collection_version(self):
+        return get_note(self.request, self.kwargs["note_id"]).files_version
+
     def perform_create(self, serializer):
-        serializer.save(note=Note.objects.get(pk=self.kwargs["note_id"]))
+        serializer.save(note=get_note(self.request, self.kwargs["note_id"]))
 
     def get_queryset(self):
         note_id = self.kwargs["note_id"]
@@ -268,31 +485,23 @@ class NoteFileView(
         return self.list(request, *args, **kwargs)
 
     def post(self, request, *args, **kwargs):
-        user = request.user
         note_id = self.kwargs["note_id"]
         size = request.data["file"].size
-        limit_size = 50000000
-        if not check_is_premium(user):
-            limit_size = 15000000
-        files = NoteFile.objects.filter(note=note_id)
-        for file in files:
-            size += file.file.size
-        if size > limit_size:
-            return Response(
-                {"message": "Exceeded note size limit."},
-                status=status.HTTP_403_FORBIDDEN,
-            )
-        responce = self.create(request, *args, **kwargs)
-        if status.is_success(responce.status_code):
-            note_id = self.kwargs["note_id"]
-            note = Note.objects.get(pk=note_id)
-            note.save()
+        with transaction.atomic():
+            message = check_storage_quota(request.user, note_id, size)
+            if message is not None:
+                return Response({"message": message}, status=status.HTTP_403_FORBIDDEN)
+            responce = self.create(request, *args, **kwargs)
+            if status.is_success(responce.status_code):
+                note = get_note(request, note_id)
+                note.save()
         return responce
 
 
 class NoteFileDetailView(generics.RetrieveUpdateDestroyAPIView):
     http_method_names = ["get", "post", "patch", "delete", "options"]
     permission_classes = (IsNoteAuthorOrReadOnly, CanAccessNote)
+    throttle_classes = (WriteThrottle, UploadThrottle)
     serializer_class = NoteFileSerializer
     lookup_field = "index"
 
@@ -300,33 +509,229 @@ class NoteFileDetailView(generics.RetrieveUpdateDestroyAPIView):
         note_id = self.kwargs["note_id"]
         return NoteFile.objects.filter(note__pk=note_id)
 
+    @transaction.atomic
+    def update(self, request, *args, **kwargs):
+        return super().update(request, *args, **kwargs)
+
+    def perform_update(self, serializer):
+        new_file = serializer.validated_data.get("file")
+        if new_file is not None:
+            size = new_file.size - serializer.instance.size_bytes
+            note_id = self.kwargs["note_id"]
+            message = check_storage_quota(self.request.user, note_id, size)
+            if message is not None:
+                raise PermissionDenied(message)
+        serializer.save()
 
-class UniversityView(mixins.ListModelMixin, generics.GenericAPIView):
+
+class UploadSessionView(mixins.CreateModelMixin, generics.GenericAPIView):
+    permission_classes = (
+        permissions.IsAuthenticated,
+        IsNoteAuthorOrReadOnly,
+        CanAccessNote,
+    )
+    throttle_classes = (WriteThrottle, UploadThrottle)
+    serializer_class = UploadSessionSerializer
+
+    def perform_create(self, serializer):
+        note_id = self.kwargs["note_id"]
+        with transaction.atomic():
+            size = serializer.validated_data["size"]
+            message = check_storage_quota(self.request.user, note_id, size)
+        if message is not None:
+            raise PermissionDenied(message)
+        session = serializer.save(
+            user=self.request.user, note=get_note(self.request, note_id)
+        )
+        create_upload_file(session)
+
+    def post(self, request, *args, **kwargs):
+        return self.create(request, *args, **kwargs)
+
+
+def upload_error_response(error, session):
+    return Response(
+        {"message": error.message, "received_bytes": session.received_bytes},
+        status=error.status,
+    )
+
+
+class UploadSessionDetailView(generics.RetrieveDestroyAPIView):
+    permission_classes = (permissions.IsAuthenticated, CanAccessNote)
+    serializer_class = UploadSessionSerializer
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(
+            note=self.kwargs["note_id"], user=self.request.user
+        )
+
+    def put(self, request, *args, **kwargs):
+        session = self.get_object()
+        content_range = request.META.get("HTTP_CONTENT_RANGE")
+        try:
+            start, length = parse_content_range(content_range, session)
+            # Read the whole chunk before locking the session, so a slow
+            # client does not hold the lock.
+            chunk = read_chunk(request.stream, length)
+        except UploadError as error:
+            return upload_error_response(error, session)
+        with chunk, transaction.atomic():
+            # Another chunk may have been written meanwhile; the lock makes
+            # concurrent chunks for the session check and write in turn.
+            session = self.get_queryset().select_for_update().get(pk=session.pk)
+            try:
+                parse_content_range(content_range, session)
+                write_chunk(session, chunk, start, length)
+            except UploadError as error:
+                return upload_error_response(error, session)
+            session.received_bytes = start + length
+            session.save(update_fields=["received_bytes", "updated_at"])
+        return Response(self.get_serializer(session).data)
+
+    def perform_destroy(self, instance):
+        remove_upload_file(instance)
+        instance.delete()
+
+
+class UploadSessionFinalizeView(generics.GenericAPIView):
+    permission_classes = (permissions.IsAuthenticated, CanAccessNote)
+
+    def post(self, request, *args, **kwargs):
+        note_id = self.kwargs["note_id"]
+        session = get_object_or_404(
+            UploadSession, pk=self.kwargs["pk"], note=note_id, user=request.user
+        )
+        if session.received_bytes != session.size:
+            return Response(
+                {"message": "Upload is incomplete."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            check_signature(session)
+        except UploadError as error:
+            return Response({"message": error.message}, status=error.status)
+        with transaction.atomic():
+            message = check_storage_quota(request.user, note_id, session.size)
+            if message is not None:
+                return Response({"message": message}, status=status.HTTP_403_FORBIDDEN)
+            if NoteFile.objects.filter(note=note_id, index=session.index).exists():
+                return Response(
+                    {"message": "A file with this index already exists."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            note = get_note(request, note_id)
+            note_file = NoteFile(
+                note=note, index=session.index, size_bytes=session.size
+            )
+            with open(get_upload_path(session), "rb") as file:
+                note_file.file.save(session.filename, File(file), save=False)
+            note_file.save()
+            # Delete through the queryset so `session` keeps its id for the
+            # file cleanup below.
+            UploadSession.objects.filter(pk=session.pk).delete()
+            note.save()
+        remove_upload_file(session)
+        serializer = NoteFileSerializer(
+            note_file, context=self.get_serializer_context()
+        )
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class NoteFileContentView(generics.GenericAPIView):
+    permission_classes = (CanAccessNote,)
+    field = "file"
+
+    def get_note_file(self):
+        note_file = get_object_or_404(
+            NoteFile, note=self.kwargs["note_id"], index=self.kwargs["index"]
+        )
+        if self.field != "file" and note_file.preview_status != NoteFile.PREVIEW_READY:
+            raise Http404
+        return note_file
+
+    def get(self, request, *args, **kwargs):
+        return serve_note_file(request, self.get_note_file(), self.field)
+
+
+class UniversityView(
+    ConditionalGetMixin, mixins.ListModelMixin, generics.GenericAPIView
+):
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
     serializer_class = UniversitySerializer
+    pagination_class = KeysetPagination
+    fingerprint_fields = UNIVERSITY_FINGERPRINT
 
     def get_queryset(self):
         queryset = University.objects.all()
         starts_with = self.request.query_params.get("starts_with", None)
         contains = self.request.query_params.get("contains", None)
-        order_by = self.request.query_params.get("order_by", None)
         if starts_with is not None:
             queryset = queryset.filter(name__startswith=starts_with)
         if contains is not None:
             queryset = queryset.filter(name__contains=contains)
-        if order_by is not None:
-            queryset = queryset.order_by(order_by)
-        return queryset
+        return order_by_param(queryset, self.request, UNIVERSITY_ORDERINGS, "name")
 
     def get(self, request, *args, **kwargs):
         return self.list(request, *args, **kwargs)
 
 
-class UniversityDetailView(generics.RetrieveAPIView):
+class UniversityAutocompleteView(generics.GenericAPIView):
+    permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+    default_limit = 10
+    max_limit = 25
+
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = int(request.query_params.get("limit", self.default_limit))
+        except ValueError:
+            limit = self.default_limit
+        limit = max(1, min(limit, self.max_limit))
+        query = request.query_params.get("q", "")
+        return Response({"results": get_university_index().complete(query, limit)})
+
+
+class SearchView(generics.GenericAPIView):
+    permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+    throttle_classes = (SearchThrottle,)
+    default_limit = 20
+    max_limit = 50
+
+    def get_limit(self):
+        try:
+            limit = int(self.request.query_params.get("limit", self.default_limit))
+        except ValueError:
+            limit = self.default_limit
+        return max(1, min(limit, self.max_limit))
+
+    def get(self, request, *args, **kwargs):
+        query = request.query_params.get("q", "")
+        kind = request.query_params.get("type", "notes")
+        backend = get_search_backend()
+        if kind == "notes":
+            notes = Note.objects.select_related("author", "university", "group").filter(
+                group__isnull=True
+            )
+            results = backend.search(notes, query)[: self.get_limit()]
+            serializer = NoteSerializer(
+                results, many=True, context=self.get_serializer_context()
+            )
+        elif kind == "universities":
+            results = backend.search(University.objects.all(), query)
+            results = results[: self.get_limit()]
+            serializer = UniversitySerializer(results, many=True)
+        else:
+            return Response(
+                {"message": "Unknown search type."}, status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response({"results": serializer.data})
+
+
+class UniversityDetailView(ConditionalGetMixin, generics.RetrieveAPIView):
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
     queryset = University.objects.all()
     serializer_class = UniversitySerializer
     lookup_field = "name"
+    fingerprint_fields = UNIVERSITY_FINGERPRINT
 
 
 class RatingView(
@@ -341,7 +746,8 @@ class RatingView(
 
     def perform_create(self, serializer):
         serializer.save(
-            author=self.request.user, note=Note.objects.get(pk=self.kwargs["note_id"])
+            author=self.request.user,
+            note=get_note(self.request, self.kwargs["note_id"]),
         )
 
     def get_queryset(self):
@@ -370,19 +776,33 @@ class RatingDetailView(generics.RetrieveUpdateDestroyAPIView):
 
 
 class CommentView(
-    mixins.CreateModelMixin, mixins.ListModelMixin, generics.GenericAPIView
+    ConditionalGetMixin,
+    mixins.CreateModelMixin,
+    mixins.ListModelMixin,
+    generics.GenericAPIView,
 ):
     permission_classes = (permissions.IsAuthenticatedOrReadOnly, CanAccessNote)
     serializer_class = CommentSerializer
+    pagination_class = KeysetPagination
+    fingerprint_fields = COMMENT_FINGERPRINT
+    last_modified_field = "updated_at"
+
+    def get_collection_version(self):
+        return get_note(self.request, self.kwargs["note_id"]).comments_version
 
     def perform_create(self, serializer):
         serializer.save(
-            author=self.request.user, note=Note.objects.get(pk=self.kwargs["note_id"])
+            author=self.request.user,
+            note=get_note(self.request, self.kwargs["note_id"]),
         )
 
     def get_queryset(self):
         note_id = self.kwargs["note_id"]
-        return Comment.objects.filter(note__pk=note_id).order_by("created_at")
+        return (
+            Comment.objects.select_related("author")
+            .filter(note__pk=note_id)
+            .order_by("created_at")
+        )
 
     def get(self, request, *args, **kwargs):
         return self.list(request, *args, **kwargs)
@@ -411,7 +831,7 @@ class GroupView(mixins.CreateModelMixin, generics.GenericAPIView):
     def post(self, request, *args, **kwargs):
         user = request.user
         if (
-            not check_is_premium(user)
+            not is_premium(user)
             and Membership.objects.filter(user=user).count() >= 3
         ):
             return Response(
@@ -437,18 +857,29 @@ class GroupDetailView(generics.RetrieveUpdateDestroyAPIView):
 
 
 class GroupNoteView(
-    mixins.CreateModelMixin, mixins.ListModelMixin, generics.GenericAPIView
+    ConditionalGetMixin,
+    mixins.CreateModelMixin,
+    mixins.ListModelMixin,
+    generics.GenericAPIView,
 ):
     permission_classes = (permissions.IsAuthenticated, CanAccessGroup)
     serializer_class = NoteSerializer
+    pagination_class = KeysetPagination
+    fingerprint_fields = NOTE_FINGERPRINT
+    last_modified_field = "updated_at"
+
+    def get_collection_version(self):
+        groups = Group.objects.filter(pk=self.kwargs["group_id"])
+        return groups.values_list("notes_version", flat=True).first()
 
     def get_queryset(self):
-        queryset = Note.objects.all().filter(group=self.kwargs["group_id"])
+        queryset = Note.objects.select_related("author", "university", "group").filter(
+            group=self.kwargs["group_id"]
+        )
         username = self.request.query_params.get("username", None)
         title = self.request.query_params.get("title", None)
         university = self.request.query_params.get("university", None)
         course = self.request.query_params.get("course", None)
-        order_by = self.request.query_params.get("order_by", None)
         if username is not None:
             queryset = queryset.filter(author__username=username)
         if title is not None:
@@ -457,9 +888,7 @@ class GroupNoteView(
             queryset = queryset.filter(university=university)
         if course is not None:
             queryset = queryset.filter(course=course)
-        if order_by is not None:
-            queryset = queryset.order_by(order_by)
-        return queryset
+        return order_by_param(queryset, self.request, NOTE_ORDERINGS, "newest")
 
     def perform_create(self, serializer):
         serializer.save(
@@ -475,13 +904,22 @@ class GroupNoteView(
 
 
 class GroupMembershipView(
-    mixins.CreateModelMixin, mixins.ListModelMixin, generics.GenericAPIView
+    ConditionalGetMixin,
+    mixins.CreateModelMixin,
+    mixins.ListModelMixin,
+    generics.GenericAPIView,
 ):
     permission_classes = (
         permissions.IsAuthenticated,
         HasInvitation,
     )
     serializer_class = MembershipSerializer
+    pagination_class = KeysetPagination
+    ordering = ("joined_at",)
+
+    def get_collection_version(self):
+        groups = Group.objects.filter(pk=self.kwargs["group_id"])
+        return groups.values_list("members_version", flat=True).first()
 
     def perform_create(self, serializer):
         serializer.save(
@@ -490,7 +928,7 @@ class GroupMembershipView(
 
     def get_queryset(self):
         group_id = self.kwargs["group_id"]
-        return Membership.objects.filter(group=group_id)
+        return Membership.objects.select_related("group", "user").filter(group=group_id)
 
     def get(self, request, *args, **kwargs):
         return self.list(request, *args, **kwargs)
@@ -498,7 +936,7 @@ class GroupMembershipView(
     def post(self, request, *args, **kwargs):
         user = request.user
         if (
-            not check_is_premium(user)
+            not is_premium(user)
             and Membership.objects.filter(user=user).count() >= 3
         ):
             return Response(
@@ -523,7 +961,9 @@ class GroupMembershipDetailView(generics.RetrieveDestroyAPIView):
 
     def get_queryset(self):
         group_id = self.kwargs["group_id"]
-        return Membership.objects.filter(group__pk=group_id)
+        return Membership.objects.select_related("group", "user").filter(
+            group__pk=group_id
+        )
 
     def delete(self, request, *args, **kwargs):
         group_id = self.kwargs["group_id"]
@@ -552,7 +992,9 @@ class GroupInvitationView(
 
     def get_queryset(self):
         group_id = self.kwargs["group_id"]
-        return Invitation.objects.filter(group=group_id)
+        return Invitation.objects.select_related("group__moderator", "user").filter(
+            group=group_id
+        )
 
     def get(self, request, *args, **kwargs):
         return self.list(request, *args, **kwargs)
@@ -577,7 +1019,9 @@ class GroupInvitationDetailView(generics.RetrieveDestroyAPIView):
 
     def get_queryset(self):
         group_id = self.kwargs["group_id"]
-        return Invitation.objects.filter(group__pk=group_id)
+        return Invitation.objects.select_related("group__moderator", "user").filter(
+            group__pk=group_id
+        )
 
 
 class FavoriteView(
@@ -593,7 +1037,8 @@ class FavoriteView(
 
     def perform_create(self, serializer):
         serializer.save(
-            user=self.request.user, note=Note.objects.get(pk=self.kwargs["note_id"])
+            user=self.request.user,
+            note=get_note(self.request, self.kwargs["note_id"]),
         )
 
     def get_queryset(self):
@@ -632,7 +1077,8 @@ class NoteReportView(
 
     def perform_create(self, serializer):
         serializer.save(
-            user=self.request.user, note=Note.objects.get(pk=self.kwargs["note_id"])
+            user=self.request.user,
+            note=get_note(self.request, self.kwargs["note_id"]),
         )
 
     def get_queryset(self):
@@ -682,7 +1128,7 @@ class AddSubscriptionView(generics.CreateAPIView):
     model = User
 
     def post(self, request, *args, **kwargs):
-        if check_is_premium(request.user):
+        if is_premium(request.user):
             return Response(
                 {"message": "Already have active subscription."},
                 status=status.HTTP_400_BAD_REQUEST,
@@ -693,5 +1139,6 @@ class AddSubscriptionView(generics.CreateAPIView):
             expires_at=timezone.now() + timezone.timedelta(days=30),
         )
         subscription.save()
+        invalidate_premium(request.user.id)
         serializer = self.get_serializer(subscription)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -2,6 +2,10 @@
 ASGI config for notehub_project project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+With NOTEHUB_NATIVE_ASGI=True in the environment, note listing, note detail,
+search and file downloads are served natively by api.asgi.NoteHubASGIHandler
+and every other request goes through Django. Run ``manage.py benchmark_asgi``
+against your deployment before turning it on.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
@@ -9,8 +13,16 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 
 import os
 
+import django
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'notehub_project.settings')
 
-application = get_asgi_application()
+if os.environ.get('NOTEHUB_NATIVE_ASGI', '') == 'True':
+    django.setup(set_prefix=False)
+
+    from api.asgi import NoteHubASGIHandler  # noqa: E402
+
+    application = NoteHubASGIHandler()
+else:
+    application = get_asgi_application()
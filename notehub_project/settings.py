@@ -54,12 +54,31 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
-    ]
+        'api.authentication.CachedTokenAuthentication',
+        'api.authentication.SignedTokenAuthentication',
+    ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'api.throttling.WriteThrottle',
+    ],
+    # Reverse proxies in front of the app. Throttles take the client address
+    # from X-Forwarded-For, counting this many entries from the right, and
+    # use REMOTE_ADDR when it is 0, so clients cannot pick their own.
+    'NUM_PROXIES': int(os.environ.get('NOTEHUB_NUM_PROXIES', '0')),
 }
 
+# Requests slower than this many seconds are logged with their queries.
+NOTEHUB_SLOW_REQUEST_SECONDS = 1.0
+
+# /metrics answers only requests with "Authorization: Bearer <token>", and is
+# disabled when no token is set.
+NOTEHUB_METRICS_TOKEN = os.environ.get('NOTEHUB_METRICS_TOKEN')
+
+# Sessions are read from the cache and written through to the database.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -7,3 +7,6 @@ def user_avatar_path(instance, filename):
 
 class User(AbstractUser):
     avatar = models.ImageField(upload_to=user_avatar_path, blank=True)
+    # Signed tokens carry the generation they were issued in; bumping it
+    # revokes all of them.
+    token_generation = models.PositiveIntegerField(default=0)